@@ -0,0 +1,98 @@
+#
+# check_bench.py -- time trunnel's Checker on files with many structures.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: check_bench.py [--legacy-limit=N] [NSTRUCTS...]
+
+   Run the Checker over synthetic trunnel files (see
+   schemas.makeDependencySchema) with chains, trees, and wide fans of
+   structures, and report how long it took.  For files with up to N
+   structures (default 1000), also time the fixed-point dependency
+   analysis that trunnel used to do, and check that both give the same
+   order.
+"""
+
+import getopt
+import sys
+import time
+
+import schemas
+import trunnel.CodeGen
+import trunnel.Grammar
+
+
+class LegacyChecker(trunnel.CodeGen.Checker):
+
+    """A Checker that sorts structures the way trunnel used to: by
+       computing the transitive closure of structUses, and then repeatedly
+       scanning it for structures with nothing left to wait for."""
+
+    def sortStructures(self):
+        uses = dict((k, set(v)) for k, v in self.structUses.items())
+        while True:
+            changed = False
+            for structname, u in list(uses.items()):
+                oldlen = len(u)
+                for used in list(u):
+                    u.update(uses[used])
+                if len(u) != oldlen:
+                    changed = True
+            if not changed:
+                break
+
+        sorted_structs = []
+        removed = set()
+        while uses:
+            removed_this_time = []
+            for structname, u in list(uses.items()):
+                u.difference_update(removed)
+                if not u:
+                    removed_this_time.append(structname)
+            removed_this_time.sort()
+            sorted_structs.extend(removed_this_time)
+            removed.update(removed_this_time)
+            for s in removed_this_time:
+                del uses[s]
+        return sorted_structs
+
+
+def timeCheck(checkerClass, parsed):
+    checker = checkerClass()
+    t0 = time.time()
+    checker.visit(parsed)
+    return checker.sortedStructs, time.time() - t0
+
+
+def main(args):
+    opts, args = getopt.gnu_getopt(args, "", ["legacy-limit="])
+    legacyLimit = 1000
+    for k, v in opts:
+        if k == '--legacy-limit':
+            legacyLimit = int(v)
+    sizes = [int(a) for a in args] or [1000, 5000, 10000, 50000]
+
+    for shape in ("chain", "tree", "wide"):
+        for n in sizes:
+            text = schemas.makeDependencySchema(n, shape)
+            parsed = trunnel.Grammar.getParser("rd").parse(
+                trunnel.Grammar.Lexer().itertokens(text))
+            order, t_new = timeCheck(trunnel.CodeGen.Checker, parsed)
+            line = "%5s %6d structs: check %.3fs (%.1fus/struct)" % (
+                shape, n, t_new, t_new * 1e6 / n)
+            if n <= legacyLimit:
+                # The Checker annotates the AST, so start from scratch.
+                parsed = trunnel.Grammar.getParser("rd").parse(
+                    trunnel.Grammar.Lexer().itertokens(text))
+                old, t_old = timeCheck(LegacyChecker, parsed)
+                if old != order:
+                    sys.stderr.write("Orders differ for %d %s structs!\n" % (
+                        n, shape))
+                    sys.exit(1)
+                line += "; legacy %.3fs (%.1fx)" % (t_old, t_old / t_new)
+            print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,127 @@
+#
+# codegen_bench.py -- time trunnel's code generators on a scaled-up input.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: codegen_bench.py [NCOPIES...]
+
+   Make a large trunnel file out of NCOPIES renamed copies of
+   examples/tor.trunnel, and time the code generators on it: once with
+   CodeGenerator.w and CodeGenerator.format as they are, and once with the
+   old versions, which dedented each template on every call and wrote
+   each line separately.  Then time CodeGenerationVisitor with and
+   without its fused pass over each structure.  Check that every
+   variant produces the same code.
+"""
+
+import io
+import os
+import re
+import sys
+import time
+
+import trunnel.CodeGen
+import trunnel.Grammar
+
+TOR_TRUNNEL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "examples", "tor.trunnel")
+
+
+def scaledSchema(fname, nCopies):
+    """Return the text of 'fname', repeated 'nCopies' times, with every
+       structure, context, and constant renamed in each copy."""
+    with open(fname) as f:
+        text = f.read()
+    names = re.findall(r'^\s*(?:struct|context|const)\s+(\w+)', text, re.M)
+    pattern = re.compile(r'\b(%s)\b' % "|".join(sorted(set(names))))
+    return "".join(pattern.sub(lambda m: "%s_%d" % (m.group(1), i), text)
+                   for i in range(nCopies))
+
+
+def legacyW(self, string):
+    lines = string.split("\n")
+    if lines[-1] == "":
+        del lines[-1]
+    for line in lines:
+        if line.isspace() or not line:
+            self.w_('\n')
+        elif line.startswith("#"):
+            self.w_("%s\n" % line)
+        else:
+            self.w_("%s%s\n" % (self.indent, line))
+
+
+def legacyFormat(self, fmt, *args, **kwargs):
+    self.w(legacyFormat_s(self, fmt, *args, **kwargs))
+
+
+def legacyFormat_s(self, fmt, *args, **kwargs):
+    return trunnel.CodeGen.dedent_code(fmt).format(*args, **kwargs)
+
+
+def generate(parsed, order):
+    """Run all the code generators over 'parsed'; return the time they
+       took and the code they generated."""
+    out = io.StringIO()
+    t0 = time.time()
+    trunnel.CodeGen.DeclarationGenerationVisitor(order, out).visit(parsed)
+    trunnel.CodeGen.PrototypeGenerationVisitor(order, out).visit(parsed)
+    trunnel.CodeGen.CodeGenerationVisitor(order, out).visit(parsed)
+    return time.time() - t0, out.getvalue()
+
+
+def generateCode(parsed, order, fused):
+    """Run CodeGenerationVisitor over 'parsed'; return the time it took
+       and the code it generated."""
+    out = io.StringIO()
+    t0 = time.time()
+    trunnel.CodeGen.CodeGenerationVisitor(order, out,
+                                          fused=fused).visit(parsed)
+    return time.time() - t0, out.getvalue()
+
+
+def bestOf(fn, repeat=5):
+    results = [fn() for _ in range(repeat)]
+    return min(t for t, _ in results), results[-1][1]
+
+
+def main(args):
+    sizes = [int(a) for a in args] or [1, 10, 50]
+    cg = trunnel.CodeGen.CodeGenerator
+    current = (cg.w, cg.format, cg.format_s)
+    for n in sizes:
+        text = scaledSchema(TOR_TRUNNEL, n)
+        parsed = trunnel.Grammar.getParser("rd").parse(
+            trunnel.Grammar.Lexer().itertokens(text))
+        checker = trunnel.CodeGen.Checker()
+        checker.visit(parsed)
+        trunnel.CodeGen.Annotator(checker.constValues).visit(parsed)
+        order = checker.sortedStructs
+
+        t_new, code_new = bestOf(lambda: generate(parsed, order))
+        cg.w, cg.format, cg.format_s = legacyW, legacyFormat, legacyFormat_s
+        try:
+            t_old, code_old = bestOf(lambda: generate(parsed, order))
+        finally:
+            cg.w, cg.format, cg.format_s = current
+        if code_old != code_new:
+            sys.stderr.write("Generated code differs for %d copies!\n" % n)
+            sys.exit(1)
+
+        t_sep, code_sep = bestOf(lambda: generateCode(parsed, order, False))
+        t_fused, code_fused = bestOf(lambda: generateCode(parsed, order, True))
+        if code_sep != code_fused:
+            sys.stderr.write("Fused code differs for %d copies!\n" % n)
+            sys.exit(1)
+
+        print("%4d copies, %5d structs, %8d bytes of code: legacy %.3fs; "
+              "cached templates %.3fs (%.2fx)" % (
+                  n, len(order), len(code_new), t_old, t_new,
+                  t_old / t_new))
+        print("%37s code only: separate %.3fs; fused %.3fs (%.2fx)" % (
+            "", t_sep, t_fused, t_sep / t_fused))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
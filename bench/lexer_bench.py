@@ -0,0 +1,70 @@
+#
+# lexer_bench.py -- time trunnel's lexer on large inputs.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: lexer_bench.py [NSTRUCTS...]
+
+   Tokenize synthetic trunnel files (see schemas.py) with spark's
+   GenericScanner loop and with Lexer.itertokens, check that they agree,
+   and report how long each one took.
+"""
+
+import sys
+import time
+
+import schemas
+import trunnel.Grammar
+import trunnel.spark
+
+
+def bestTime(fn, repeat=3):
+    """Call fn() 'repeat' times; return its result and the fastest time."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        result = fn()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def main(args):
+    sizes = [int(a) for a in args] or [100, 1000, 5000]
+    for n in sizes:
+        text = schemas.makeSchema(n)
+        lexer = trunnel.Grammar.Lexer()
+
+        def scanner():
+            lexer.rv = []
+            lexer.lineno = 1
+            trunnel.spark.GenericScanner.tokenize(lexer, text)
+            return lexer.rv
+
+        def listed():
+            return list(lexer.itertokens(text))
+
+        def streamed():
+            # This is what RecursiveDescentParser sees: we never need to
+            # hold all the tokens at once.
+            for _ in lexer.itertokens(text):
+                pass
+
+        old, t_old = bestTime(scanner)
+        new, t_new = bestTime(listed)
+        _, t_stream = bestTime(streamed)
+        key = lambda toks: [(t.type, str(t), t.lineno) for t in toks]
+        if key(old) != key(new):
+            sys.stderr.write("Token streams differ for %d structs!\n" % n)
+            sys.exit(1)
+
+        print("%6d structs, %7d lines, %7d tokens: GenericScanner %.3fs; "
+              "itertokens %.3fs (%.1fx), streamed %.3fs (%.1fx)" % (
+                  n, text.count("\n"), len(new), t_old, t_new,
+                  t_old / t_new, t_stream, t_old / t_stream))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,68 @@
+#
+# memory_bench.py -- measure how much memory trunnel's tokens and AST use.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: memory_bench.py [NSTRUCTS...]
+
+   Use tracemalloc to measure the memory held by the token list for a
+   synthetic trunnel file (see schemas.py), and by its AST once Checker
+   and Annotator have run over it.  Also reports the peak memory for the
+   whole process.
+
+   This only uses interfaces that have been around for a while, so you
+   can run it against an older checkout to see what has changed.
+"""
+
+import gc
+import sys
+import tracemalloc
+
+import schemas
+import trunnel.CodeGen
+import trunnel.Grammar
+
+
+def held():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure(text):
+    """Return a tuple of: the number of tokens in 'text', the bytes they
+       occupy, the bytes used by the annotated AST, and the peak bytes
+       traced while building all of them."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = held()
+
+    tokens = trunnel.Grammar.Lexer().tokenize(text)
+    after_tokens = held()
+
+    parsed = trunnel.Grammar.getParser("rd").parse(tokens)
+    checker = trunnel.CodeGen.Checker()
+    checker.visit(parsed)
+    trunnel.CodeGen.Annotator(checker.constValues).visit(parsed)
+    del checker
+    after_ast = held()
+
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (len(tokens), after_tokens - base, after_ast - after_tokens,
+            peak - base)
+
+
+def main(args):
+    sizes = [int(a) for a in args] or [100, 1000, 5000]
+    mb = 1024.0 * 1024
+    for n in sizes:
+        ntokens, tokbytes, astbytes, peak = measure(schemas.makeSchema(n))
+        print("%6d structs, %7d tokens: tokens %6.1f MiB (%3d bytes/token), "
+              "AST %6.1f MiB, peak %6.1f MiB" % (
+                  n, ntokens, tokbytes / mb, tokbytes // ntokens,
+                  astbytes / mb, peak / mb))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
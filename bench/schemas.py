@@ -0,0 +1,148 @@
+#
+# schemas.py -- synthetic trunnel input for the benchmarks.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Generate large, valid trunnel files, for timing trunnel on inputs
+   bigger than anything in test/ or examples/.
+"""
+
+import os
+import sys
+
+# Let the benchmarks find trunnel without installing it.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "lib"))
+
+STRUCT_TEMPLATE = """\
+const WORDS_%(i)d = %(words)d;
+
+/** Synthetic structure number %(i)d. */
+struct s%(i)d {
+  u8 version IN [1, 3..5];
+  u16 len;
+  /** A variable-length body. */
+  u8 body[len];
+  u32 words[WORDS_%(i)d];
+  char label[8];
+  nulterm name;
+  /* A multi-line
+   * comment. */
+%(inner)s  u8 tag;
+  union u[tag] {
+    1, 2 : u8 a; u16 b;
+    3 : u32 c[2];
+    4 : ;
+    5..9 : nulterm d;
+    default : fail;
+  };
+  u16 n_items;
+  struct s%(i)d_item items[n_items];
+  u8 rest[];
+}
+
+struct s%(i)d_item {
+  u64 when;
+  u8 flags;  // Trailing comment.
+}
+
+"""
+
+
+def makeSchema(nStructs):
+    """Return the text of a trunnel file declaring 2*nStructs structures.
+       Each one refers to an earlier one, so the dependency graph is a
+       tree of depth log2(nStructs)."""
+    parts = ["/* Generated by bench/schemas.py */\n\n"]
+    for i in range(nStructs):
+        if i:
+            inner = "  struct s%d prev;\n" % ((i - 1) // 2)
+        else:
+            inner = ""
+        parts.append(STRUCT_TEMPLATE % dict(i=i, words=i % 7 + 1,
+                                            inner=inner))
+    return "".join(parts)
+
+
+def makeDependencySchema(nStructs, shape="chain"):
+    """Return the text of a trunnel file declaring nStructs small
+       structures, where what matters is how they use one another.  If
+       'shape' is "chain", each one uses the one before it.  If it is
+       "tree", each one uses its parent in a binary tree.  If it is "wide",
+       each one uses the first structure and the one before it."""
+    parts = ["/* Generated by bench/schemas.py */\n\n"]
+    for i in range(nStructs):
+        if i == 0:
+            uses = []
+        elif shape == "chain":
+            uses = [i - 1]
+        elif shape == "tree":
+            uses = [(i - 1) // 2]
+        elif shape == "wide":
+            uses = sorted(set([0, i - 1]))
+        else:
+            raise ValueError("Unknown shape %r" % shape)
+        parts.append("struct d%d {\n  u8 x;\n" % i)
+        for u in uses:
+            parts.append("  struct d%d m%d;\n" % (u, u))
+        parts.append("}\n\n")
+    return "".join(parts)
+
+
+def makeParametrizedSchema(nStructs=100, depth=1, unionArms=4, nContexts=0,
+                           listLength=4):
+    """Return the text of a trunnel file with nStructs top-level structures
+       that use one another as in makeSchema.  Each structure holds
+       structures nested 'depth' deep, a union with 'unionArms' cases, and
+       an integer field restricted to a list of 'listLength' values.  If
+       nContexts is nonzero, declare that many contexts, and make every
+       structure use all of them.  There are also 'listLength' constants.
+    """
+    parts = ["/* Generated by bench/schemas.py */\n\n"]
+    for j in range(listLength):
+        parts.append("const K_%d = %d;\n" % (j, j * 3 + 1))
+    parts.append("\n")
+
+    contexts = ["c%d" % k for k in range(nContexts)]
+    for c in contexts:
+        parts.append("context %s {\n  u8 n;\n  u8 tag;\n}\n\n" % c)
+    withContext = ""
+    if contexts:
+        withContext = " with context " + ", ".join(contexts)
+
+    values = ", ".join(str(j * 5) for j in range(max(listLength, 1)))
+    tagtype = "u8" if unionArms < 255 else "u16"
+    armTypes = ["u8 a%d", "u16 a%d", "u32 a%d[2]", "u64 a%d", "nulterm a%d",
+                "char a%d[4]"]
+    for i in range(nStructs):
+        parts.append("struct p%d%s {\n" % (i, withContext))
+        parts.append("  u32 magic IN [%s];\n" % values)
+        parts.append("  u8 pad[K_%d];\n" % (i % max(listLength, 1))
+                     if listLength else "")
+        for c in contexts:
+            parts.append("  u8 body_%s[%s.n];\n" % (c, c))
+        if i:
+            parts.append("  struct p%d prev;\n" % ((i - 1) // 2))
+
+        indent = "  "
+        for d in range(depth):
+            parts.append("%sstruct p%d_n%d {\n" % (indent, i, d))
+            indent += "  "
+            parts.append("%su16 x%d;\n" % (indent, d))
+        for d in reversed(range(depth)):
+            indent = indent[:-2]
+            parts.append("%s} n%d;\n" % (indent, d))
+
+        parts.append("  %s tag;\n" % tagtype)
+        parts.append("  union u[tag] {\n")
+        for a in range(unionArms):
+            parts.append("    %d: %s;\n" % (
+                a + 1, armTypes[a % len(armTypes)] % a))
+        parts.append("    default: fail;\n  };\n")
+        parts.append("  u8 rest[];\n}\n\n")
+    return "".join(parts)
+
+
+if __name__ == '__main__':
+    sys.stdout.write(makeSchema(int(sys.argv[1])))
@@ -0,0 +1,249 @@
+#
+# suite.py -- time every phase of trunnel on a set of synthetic schemas.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: suite.py [options] [SCENARIO...]
+
+   Generate trunnel files with schemas.makeParametrizedSchema, and time
+   each phase of compiling them: tokenizing, parsing, checking,
+   annotating, and generating declarations, prototypes, and code.  With
+   no SCENARIO arguments, run every scenario in SCENARIO_LIST.
+
+   Options:
+     --list            List the scenarios and exit.
+     --parser=ENGINE   Use the given parser (default: earley).
+     --repeat=N        Time each phase N times, and keep the best (default 3).
+     --scale=F         Multiply the number of structures in each scenario
+                       by F.
+     --save=FILE       Save the results to FILE as JSON.
+     --compare=FILE    Compare the results with a baseline saved earlier
+                       with --save.  Exit with status 1 if any phase got
+                       slower by more than the threshold.
+     --threshold=R     Count a phase as slower when it takes more than R
+                       times as long as in the baseline (default 1.25).
+"""
+
+import getopt
+import json
+import platform
+import sys
+import time
+
+import schemas
+import trunnel
+import trunnel.CodeGen
+import trunnel.Grammar
+
+# Bump this if the format of the saved results changes.
+RESULTS_VERSION = 1
+
+# A list of (name, arguments for makeParametrizedSchema) for each scenario,
+# in the order we run them.
+SCENARIO_LIST = [
+    ("small", dict(nStructs=20)),
+    ("structs-250", dict(nStructs=250)),
+    ("structs-1000", dict(nStructs=1000)),
+    ("structs-4000", dict(nStructs=4000)),
+    ("nesting-8", dict(nStructs=100, depth=8)),
+    ("unions-64", dict(nStructs=100, unionArms=64)),
+    ("unions-512", dict(nStructs=20, unionArms=512)),
+    ("contexts-4", dict(nStructs=250, nContexts=4)),
+    ("lists-1000", dict(nStructs=50, listLength=1000)),
+]
+SCENARIOS = dict(SCENARIO_LIST)
+
+PHASES = ["tokenize", "parse", "check", "annotate", "declarations",
+          "prototypes", "code"]
+
+
+class NullFile(object):
+
+    """A file-like object that throws away what we write to it."""
+
+    def write(self, s):
+        pass
+
+
+def bestTime(fn, repeat):
+    """Call fn() 'repeat' times; return its last result and the fastest
+       time."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        result = fn()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def timePhases(text, parser, repeat):
+    """Return a map from each of PHASES to the best time we got for it
+       when compiling 'text' with 'parser'."""
+    lexer = trunnel.Grammar.Lexer()
+    out = NullFile()
+    times = {}
+
+    tokens, times["tokenize"] = bestTime(lambda: lexer.tokenize(text),
+                                         repeat)
+    _, times["parse"] = bestTime(lambda: parser.parse(tokens), repeat)
+
+    # Checker and Annotator modify the AST, so they each need a fresh one.
+    def check():
+        parsed = parser.parse(tokens)
+        t0 = time.time()
+        checker = trunnel.CodeGen.Checker()
+        checker.visit(parsed)
+        return parsed, checker, time.time() - t0
+
+    best = None
+    for _ in range(repeat):
+        parsed, checker, elapsed = check()
+        if best is None or elapsed < best:
+            best = elapsed
+    times["check"] = best
+
+    def annotate():
+        parsed, checker, _ = check()
+        t0 = time.time()
+        trunnel.CodeGen.Annotator(checker.constValues).visit(parsed)
+        return parsed, checker, time.time() - t0
+
+    best = None
+    for _ in range(repeat):
+        parsed, checker, elapsed = annotate()
+        if best is None or elapsed < best:
+            best = elapsed
+    times["annotate"] = best
+
+    order = checker.sortedStructs
+    generators = [
+        ("declarations", trunnel.CodeGen.DeclarationGenerationVisitor),
+        ("prototypes", trunnel.CodeGen.PrototypeGenerationVisitor),
+        ("code", trunnel.CodeGen.CodeGenerationVisitor),
+    ]
+    for phase, visitor in generators:
+        _, times[phase] = bestTime(
+            lambda: visitor(order, out).visit(parsed), repeat)
+    return times
+
+
+def runScenarios(names, parserEngine, repeat, scale):
+    """Run the scenarios in 'names', and return a map from each name to
+       the result of timePhases for it."""
+    parser = trunnel.Grammar.getParser(parserEngine)
+    results = {}
+    for name in names:
+        params = dict(SCENARIOS[name])
+        params["nStructs"] = max(1, int(params["nStructs"] * scale))
+        text = schemas.makeParametrizedSchema(**params)
+        results[name] = timePhases(text, parser, repeat)
+        report(name, results[name])
+    return results
+
+
+def report(name, times, baseline=None):
+    """Print the times for one scenario, and their ratio to 'baseline' if
+       we have one."""
+    total = sum(times[p] for p in PHASES)
+    cells = []
+    for p in PHASES + ["total"]:
+        t = total if p == "total" else times[p]
+        cell = "%s %.3fs" % (p, t)
+        if baseline is not None:
+            old = sum(baseline[q] for q in PHASES) if p == "total" \
+                else baseline.get(p)
+            if old:
+                cell += " (%.2fx)" % (t / old)
+        cells.append(cell)
+    print("%-13s %s" % (name, ", ".join(cells)))
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison of 'results' with 'baseline', and return a list
+       of (scenario, phase, ratio) for every phase that got slower by more
+       than 'threshold'."""
+    regressions = []
+    for name, _ in SCENARIO_LIST:
+        old = baseline.get(name)
+        if name not in results or old is None:
+            continue
+        report(name, results[name], old)
+        for p in PHASES:
+            # Ignore phases too quick to time reliably.
+            if old.get(p) and max(old[p], results[name][p]) > 0.01:
+                ratio = results[name][p] / old[p]
+                if ratio > threshold:
+                    regressions.append((name, p, ratio))
+    return regressions
+
+
+def main(args):
+    opts, args = getopt.gnu_getopt(
+        args, "", ["list", "parser=", "repeat=", "scale=", "save=",
+                   "compare=", "threshold="])
+    parserEngine = "earley"
+    repeat = 3
+    scale = 1.0
+    saveTo = None
+    compareWith = None
+    threshold = 1.25
+    for k, v in opts:
+        if k == '--list':
+            for name, _ in SCENARIO_LIST:
+                print("%-13s %s" % (name, SCENARIOS[name]))
+            return
+        elif k == '--parser':
+            parserEngine = v
+        elif k == '--repeat':
+            repeat = int(v)
+        elif k == '--scale':
+            scale = float(v)
+        elif k == '--save':
+            saveTo = v
+        elif k == '--compare':
+            compareWith = v
+        elif k == '--threshold':
+            threshold = float(v)
+
+    names = args or [name for name, _ in SCENARIO_LIST]
+    for name in names:
+        if name not in SCENARIOS:
+            sys.stderr.write("Unknown scenario %r; try --list\n" % name)
+            sys.exit(1)
+
+    results = runScenarios(names, parserEngine, repeat, scale)
+
+    if saveTo is not None:
+        with open(saveTo, 'w') as f:
+            json.dump({"version": RESULTS_VERSION,
+                       "trunnel": trunnel.__version__,
+                       "python": platform.python_version(),
+                       "parser": parserEngine,
+                       "scale": scale,
+                       "results": results}, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+    if compareWith is not None:
+        with open(compareWith) as f:
+            saved = json.load(f)
+        if saved.get("version") != RESULTS_VERSION:
+            sys.stderr.write("Can't read baseline %s\n" % compareWith)
+            sys.exit(1)
+        if (saved.get("parser"), saved.get("scale")) != (parserEngine, scale):
+            sys.stderr.write("Warning: baseline used --parser=%s "
+                             "--scale=%s\n" % (saved.get("parser"),
+                                               saved.get("scale")))
+        print("\nCompared with %s (trunnel %s, Python %s):" % (
+            compareWith, saved.get("trunnel"), saved.get("python")))
+        regressions = compare(results, saved["results"], threshold)
+        for name, phase, ratio in regressions:
+            print("SLOWER: %s %s (%.2fx)" % (name, phase, ratio))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,109 @@
+#
+# visit_bench.py -- time how quickly ASTVisitor dispatches to visit methods.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: visit_bench.py [NSTRUCTS...]
+
+   Walk the AST of a synthetic trunnel file (see schemas.py) with a
+   visitor that does nothing but visit every node, and then run all the
+   code generators over it.  Do each once with ASTVisitor.visit as it is,
+   and once with the old version, which built a method name and called
+   getattr for every node.
+
+   The table-driven dispatch helps the bare walk only once the tree is
+   large: expect anywhere from 0.9x to 1.5x at 100 structs, and 1.7x to
+   2.2x at 1000.  It does not make code generation any faster, since
+   dispatch is a tiny part of that; the "generate" ratio stays within
+   noise of 1.0x.
+"""
+
+import io
+import sys
+import time
+
+import schemas
+import trunnel.CodeGen
+import trunnel.Grammar
+
+
+def legacyVisit(self, ast, *args):
+    name = "visit" + ast.__class__.__name__
+    method = getattr(self, name, self.visit_other)
+    return method(ast, *args)
+
+
+class Walker(trunnel.CodeGen.ASTVisitor):
+
+    """Visits every node in a File, and counts them."""
+
+    def __init__(self):
+        trunnel.CodeGen.ASTVisitor.__init__(self)
+        self.count = 0
+
+    def visit_other(self, ast):
+        self.count += 1
+        # Not every kind of node implements visitChildren.
+        if type(ast).visitChildren is not trunnel.Grammar.AST.visitChildren:
+            ast.visitChildren(self)
+
+    def visitConstDecl(self, cd):
+        self.count += 1
+
+
+def walk(parsed):
+    w = Walker()
+    t0 = time.time()
+    for _ in range(10):
+        w.visit(parsed)
+    return time.time() - t0, w.count // 10
+
+
+def generate(parsed, order):
+    out = io.StringIO()
+    t0 = time.time()
+    trunnel.CodeGen.DeclarationGenerationVisitor(order, out).visit(parsed)
+    trunnel.CodeGen.PrototypeGenerationVisitor(order, out).visit(parsed)
+    trunnel.CodeGen.CodeGenerationVisitor(order, out).visit(parsed)
+    return time.time() - t0, out.getvalue()
+
+
+def bestOf(fn, repeat=5):
+    results = [fn() for _ in range(repeat)]
+    return min(t for t, _ in results), results[-1][1]
+
+
+def main(args):
+    sizes = [int(a) for a in args] or [100, 1000]
+    visitor = trunnel.CodeGen.ASTVisitor
+    current = visitor.visit
+    for n in sizes:
+        text = schemas.makeSchema(n)
+        parsed = trunnel.Grammar.getParser("rd").parse(
+            trunnel.Grammar.Lexer().itertokens(text))
+        checker = trunnel.CodeGen.Checker()
+        checker.visit(parsed)
+        trunnel.CodeGen.Annotator(checker.constValues).visit(parsed)
+        order = checker.sortedStructs
+
+        t_walk, nodes = bestOf(lambda: walk(parsed))
+        t_gen, code = bestOf(lambda: generate(parsed, order))
+        visitor.visit = legacyVisit
+        try:
+            t_walk_old, _ = bestOf(lambda: walk(parsed))
+            t_gen_old, code_old = bestOf(lambda: generate(parsed, order))
+        finally:
+            visitor.visit = current
+        if code != code_old:
+            sys.stderr.write("Generated code differs for %d structs!\n" % n)
+            sys.exit(1)
+
+        print("%6d structs, %7d nodes: walk x10 %.3fs (legacy %.3fs, "
+              "%.2fx); generate %.3fs (legacy %.3fs, %.2fx)" % (
+                  n, nodes, t_walk, t_walk_old, t_walk_old / t_walk,
+                  t_gen, t_gen_old, t_gen_old / t_gen))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
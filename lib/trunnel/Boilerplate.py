@@ -9,7 +9,10 @@ import trunnel
 FILES = ["trunnel.c", "trunnel.h", "trunnel-impl.h"]
 
 
-def emit(target_dir=None):
+def emit(target_dir=None, only_if_changed=False):
+    """Copy trunnel's support files into 'target_dir'.  If
+       'only_if_changed' is true, leave alone any copy that is already
+       up to date, so that its mtime doesn't change."""
     if target_dir == None:
         target_dir = '.'
     directory = os.path.split(__file__)[0]
@@ -18,20 +21,29 @@ def emit(target_dir=None):
     for f in FILES:
         emitfile(f,
                  os.path.join(directory, "data", f),
-                 os.path.join(target_dir, f))
+                 os.path.join(target_dir, f),
+                 only_if_changed)
 
 
-def emitfile(fname, in_fname, out_fname):
+def emitfile(fname, in_fname, out_fname, only_if_changed=False):
     settings = {
         'fname': fname,
         'version': trunnel.__version__
     }
-    with open(in_fname, 'r') as inp, open(out_fname, 'w') as out:
-        out.write("/* %(fname)s -- copied from Trunnel v%(version)s\n"
-                  " * https://gitweb.torproject.org/trunnel.git\n"
-                  " * You probably shouldn't edit this file.\n"
-                  " */\n" % settings)
-        out.write(inp.read())
+    with open(in_fname, 'r') as inp:
+        content = ("/* %(fname)s -- copied from Trunnel v%(version)s\n"
+                   " * https://gitweb.torproject.org/trunnel.git\n"
+                   " * You probably shouldn't edit this file.\n"
+                   " */\n" % settings) + inp.read()
+    if only_if_changed:
+        try:
+            with open(out_fname, 'r') as old:
+                if old.read() == content:
+                    return
+        except (IOError, OSError):
+            pass
+    with open(out_fname, 'w') as out:
+        out.write(content)
 
 __license__ = """
 Copyright 2014  The Tor Project, Inc.
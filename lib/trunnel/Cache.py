@@ -0,0 +1,134 @@
+# Cache.py -- on-disk caches for trunnel.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Helpers for storing data that trunnel can recompute, but would rather
+   not: things like parser tables.
+
+   Everything lives in a single directory.  By default, that's
+   $XDG_CACHE_HOME/trunnel (or ~/.cache/trunnel).  You can override it by
+   setting $TRUNNEL_CACHE_DIR; setting that variable to the empty string
+   disables caching entirely.
+
+   The cache is only ever an optimization: if we can't read or write it for
+   any reason, we behave as though it were empty.
+"""
+
+import hashlib
+import os
+import tempfile
+
+
+def cacheDir():
+    """Return the name of the directory where trunnel keeps its caches, or
+       None if caching is disabled."""
+    d = os.environ.get("TRUNNEL_CACHE_DIR")
+    if d is not None:
+        return d or None
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "trunnel")
+
+
+def digest(*items):
+    """Return a hex digest identifying the sequence of strings in 'items'."""
+    h = hashlib.sha256()
+    for item in items:
+        if not isinstance(item, bytes):
+            item = item.encode("utf-8")
+        # Length-prefix every item, so that ("ab", "c") and ("a", "bc")
+        # get different digests.
+        h.update(("%d:" % len(item)).encode("ascii"))
+        h.update(item)
+    return h.hexdigest()
+
+
+def load(name):
+    """Return the bytes stored in the cache under 'name', or None if there
+       are none."""
+    d = cacheDir()
+    if d is None:
+        return None
+    try:
+        with open(os.path.join(d, name), 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def store(name, data):
+    """Store the bytes in 'data' in the cache under 'name'.  Readers will
+       see either the old contents or the new ones, never a mix."""
+    d = cacheDir()
+    if d is None:
+        return
+    try:
+        if not os.path.exists(d):
+            os.makedirs(d)
+        fd, tmpname = tempfile.mkstemp(dir=d, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmpname, os.path.join(d, name))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+    except (IOError, OSError):
+        pass
+
+
+def prune(prefix, keep):
+    """Remove the least recently stored entries whose names begin with
+       'prefix', until there are at most 'keep' of them."""
+    d = cacheDir()
+    if d is None:
+        return
+    entries = []
+    try:
+        for name in os.listdir(d):
+            if name.startswith(prefix):
+                path = os.path.join(d, name)
+                entries.append((os.stat(path).st_mtime, path))
+    except (IOError, OSError):
+        return
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - keep)]:
+        try:
+            os.unlink(path)
+        except (IOError, OSError):
+            # Maybe another trunnel process beat us to it.
+            pass
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
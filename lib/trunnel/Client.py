@@ -0,0 +1,186 @@
+# Client.py -- a thin client for the trunnel compile server.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Ask a running trunnel server (see trunnel.Server) to compile files for
+   us, so that we don't need to pay for starting up a code generator every
+   time.  This module is meant to import quickly: it only loads the rest
+   of trunnel if it needs to compile something itself.
+
+   The protocol is simple: the client connects to the server's Unix
+   socket, and sends one JSON object per line, like this:
+
+      {"input": "/abs/path/foo.trunnel", "options": ["opaque"],
+       "target_dir": "/abs/path/out", "incremental": false}
+
+   For each request, the server sends back one JSON object per line: either
+   {"ok": true, "timings": [[phase, seconds], ...]}, or {"ok": false,
+   "error": message}.  If the server notices that trunnel itself has
+   changed since it started, it answers with {"ok": false, "stale": true,
+   ...} and shuts down.
+
+   Usage: python -m trunnel.Client --socket=PATH [-O option]
+              [--target-dir=DIR] [--incremental] <fname>...
+"""
+
+import json
+import os
+import socket
+
+
+class ServerUnavailable(Exception):
+    """Raised when we can't get an answer from a trunnel server."""
+    pass
+
+
+def makeRequest(input_fname, extra_options=(), target_dir=None,
+                incremental=False):
+    """Return a request to compile 'input_fname'.  The other arguments are
+       as for trunnel.CodeGen.generate_code.  Since the server might have a
+       different working directory, we make all the paths absolute."""
+    if target_dir is not None:
+        target_dir = os.path.abspath(target_dir)
+    return {"input": os.path.abspath(input_fname),
+            "options": list(extra_options),
+            "target_dir": target_dir,
+            "incremental": bool(incremental)}
+
+
+class Connection(object):
+
+    """A connection to a trunnel server."""
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socket_path)
+        except (IOError, OSError) as e:
+            self.sock.close()
+            raise ServerUnavailable(str(e))
+        self.f = self.sock.makefile('rw')
+
+    def send(self, request):
+        """Send 'request' to the server, and return its response."""
+        try:
+            self.f.write(json.dumps(request) + "\n")
+            self.f.flush()
+            line = self.f.readline()
+        except (IOError, OSError) as e:
+            raise ServerUnavailable(str(e))
+        if not line:
+            raise ServerUnavailable("Server closed the connection")
+        response = json.loads(line)
+        if response.get("stale"):
+            raise ServerUnavailable(response.get("error"))
+        return response
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+
+def compile_files(socket_path, input_fnames, extra_options=(),
+                  target_dir=None, incremental=False):
+    """Compile every file in 'input_fnames', as generate_code would, using
+       the trunnel server listening at 'socket_path'.  If there is no
+       server, or it goes away, compile the rest of the files ourselves.
+
+       Return a list of (input_fname, error) tuples, where 'error' is
+       None or a string describing why we couldn't compile the file.
+    """
+    results = []
+    remaining = list(input_fnames)
+    try:
+        conn = Connection(socket_path)
+        try:
+            while remaining:
+                response = conn.send(makeRequest(
+                    remaining[0], extra_options, target_dir, incremental))
+                results.append((remaining.pop(0), response.get("error")))
+        finally:
+            conn.close()
+    except ServerUnavailable:
+        pass
+
+    if remaining:
+        import trunnel.CodeGen
+        compiler = trunnel.CodeGen.Compiler(extra_options, target_dir,
+                                            incremental=incremental)
+        for fname in remaining:
+            try:
+                compiler.compile(fname)
+                results.append((fname, None))
+            except Exception as e:
+                results.append((fname, "%s: %s" % (type(e).__name__, e)))
+        compiler.finish()
+    return results
+
+
+if __name__ == '__main__':
+    import getopt
+    import sys
+
+    opts, args = getopt.gnu_getopt(
+        sys.argv[1:], "O:",
+        ["option=", "socket=", "target-dir=", "incremental"])
+
+    more_options = []
+    socket_path = None
+    target_dir = None
+    incremental = False
+    for (k, v) in opts:
+        if k in ('-O', '--option'):
+            more_options.append(v)
+        elif k == '--socket':
+            socket_path = v
+        elif k == '--target-dir':
+            target_dir = v
+        elif k == '--incremental':
+            incremental = True
+
+    if socket_path is None or not args:
+        sys.stderr.write("Syntax: python -m trunnel.Client --socket=PATH "
+                         "<fname>...\n")
+        sys.exit(1)
+
+    failed = False
+    for fname, err in compile_files(socket_path, args, more_options,
+                                    target_dir, incremental):
+        if err is not None:
+            sys.stderr.write("%s: %s\n" % (fname, err))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
@@ -49,8 +49,16 @@
                                                    -- see EncodeFnGenerator
       ssize_t typename_parse_into(typename_t **, const uint8_t *, size_t)
                                                    -- see ParseFnGenerator
+      ssize_t typename_validate(const uint8_t *, size_t)
+                                                -- see ValidateFnGenerator
       const char *typename_check(const typename_t *) -- see CheckFnGenerator
 
+   In a file that uses the 'arena' option, we also generate:
+
+      ssize_t typename_parse_arena(typename_t **, const uint8_t *, size_t,
+                                   trunnel_arena_t *)
+                                                -- see ArenaParseFnGenerator
+
    We also generate these static, non-exported functions. See the
    associated generators for more information about how they work and
    what they do.
@@ -64,10 +72,23 @@
 
 """
 
+import filecmp
+import io
+import itertools
+import multiprocessing
 import os
+import pickle
 import re
 import textwrap
+import time
 import trunnel.Grammar
+import trunnel.Interface
+import trunnel.Manifest
+
+
+# Map from each ASTVisitor class to its dispatch table: a map from AST
+# node class to the function that handles nodes of that class.
+_dispatchTables = {}
 
 
 class ASTVisitor(object):
@@ -75,15 +96,29 @@ class ASTVisitor(object):
     """Visitor pattern for an AST object.  When you call
        ASTVisitor.visit(foo) on an object of type X, it calls the
        appropriate visitX method on the visitor.
+
+       We look up each visitX method once for each visitor class, and
+       remember it, so visitX methods need to be defined on the class,
+       not on the instance.
     """
 
     def __init__(self):
         pass
 
     def visit(self, ast, *args):
-        name = "visit" + ast.__class__.__name__
-        method = getattr(self, name, self.visit_other)
-        return method(ast, *args)
+        try:
+            method = _dispatchTables[self.__class__][ast.__class__]
+        except KeyError:
+            method = self.findVisitMethod(ast.__class__)
+        return method(self, ast, *args)
+
+    @classmethod
+    def findVisitMethod(cls, astClass):
+        """Return the function to call on ASTs of class 'astClass', and
+           remember it in the dispatch table for this class."""
+        method = getattr(cls, "visit" + astClass.__name__, cls.visit_other)
+        _dispatchTables.setdefault(cls, {})[astClass] = method
+        return method
 
     def visit_other(self, ast, *args):
         """Invoked when there is no visitor method for a given AST node"""
@@ -120,6 +155,55 @@ NTOH_FN = {
 }
 
 
+def stronglyConnectedComponents(graph):
+    """Given a map from each node in a directed graph to a collection of
+       the nodes it has edges to, return a list of the graph's strongly
+       connected components, each as a list of nodes.  Every component
+       comes after all the components it has edges to.
+
+       (This is Tarjan's algorithm, made iterative so that long chains of
+       structures don't overflow Python's stack.)
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    onStack = set()
+    result = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        onStack.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    onStack.add(child)
+                    work.append((child, iter(graph[child])))
+                    break
+                elif child in onStack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        n = stack.pop()
+                        onStack.discard(n)
+                        component.append(n)
+                        if n == node:
+                            break
+                    result.append(component)
+    return result
+
+
 class Checker(ASTVisitor):
 
     """Validation visitor for a Trunnel AST.  Ensures consistency and
@@ -178,6 +262,14 @@ class Checker(ASTVisitor):
         if "opaque" in f.options and "very_opaque" in f.options:
             raise CheckError("can't use both 'opaque' and 'very_opaque'")
 
+        # Everything that we import counts as declared here, but we don't
+        # generate any code for it.
+        importedNames = set()
+        for imp in f.imports:
+            self.addImport(imp)
+            importedNames.update(imp.interface.structs)
+            importedNames.update(imp.interface.contexts)
+
         # Build up the sets of all constant and structure names.
         for c in f.constants:
             if c.name in self.constNames:
@@ -193,7 +285,7 @@ class Checker(ASTVisitor):
             self.structUses[n] = set()
             self.structUsesContexts[n] = set()
         for d in f.declarations:
-            if d.name in self.structNames:
+            if d.name in self.structNames or d.name in self.contextNames:
                 raise CheckError("duplicate structure name %s" % d.name)
             if d.isContext():
                 self.contextNames.add(d.name)
@@ -203,57 +295,103 @@ class Checker(ASTVisitor):
         # Recurse through all the constants and structures.
         f.visitChildren(self)
 
-        # Compute the transitive closure of self.structUses
-        while True:
-            changed = False
-            for structname, uses in list(self.structUses.items()):
-                oldlen = len(uses)
-                newuses = uses.copy()
-                for used in uses:
-                    newuses.update(self.structUses[used])
-                uses.update(newuses)
-                if len(uses) != oldlen:
-                    changed = True
-
-            if not changed:
-                break
+        sorted_structs = self.sortStructures()
+
+        externNames = set(es.name for es in f.externStructs)
+        externNames.update(importedNames)
+
+        self.sortedStructs = [
+            s for s in sorted_structs if s not in externNames]
+
+    def addImport(self, imp):
+        """Add the constants, structures, and contexts from the ImportDecl
+           'imp' to the ones we know about."""
+        iface = imp.interface
+        if iface is None:
+            raise CheckError("Couldn't import %s" % imp.fname)
+        for name, value in sorted(iface.constants.items()):
+            if name in self.constNames:
+                raise CheckError("duplicate constant name %s" % name)
+            self.constNames.add(name)
+            self.constValues[name] = value
+        for name, es in sorted(iface.structs.items()):
+            if name in self.structNames:
+                raise CheckError("duplicate structure name %s" % name)
+            self.structNames.add(name)
+            self.structUses[name] = set()
+            self.structUsesContexts[name] = set(es.contextList)
+        for name in sorted(iface.contexts):
+            if name in self.contextNames:
+                raise CheckError("duplicate context name %s" % name)
+            self.contextNames.add(name)
+            self.structUses[name] = set()
+            self.structUsesContexts[name] = set()
+
+    def sortStructures(self):
+        """Check the structures for dependency cycles and for context
+           mismatches, and return a list of all their names, sorted so
+           that no structure appears before any structure that it uses."""
+        # Find the strongly connected components of the graph of which
+        # structures use which.  They come out with every component after
+        # all the ones that it uses.
+        components = stronglyConnectedComponents(self.structUses)
 
         # check for cycles
-        for structname, uses in list(self.structUses.items()):
-            if structname in uses:
+        cyclic = set()
+        for component in components:
+            if len(component) > 1 or \
+                    component[0] in self.structUses[component[0]]:
+                cyclic.update(component)
+        for structname in self.structUses:
+            if structname in cyclic:
                 raise CheckError(
                     "There is a cycle in the %s structure" % structname)
 
-        # check for context mismatch.
-        for structname, uses in list(self.structUses.items()):
-            for u in uses:
+        # Now that there are no cycles, every component holds exactly one
+        # structure, and 'ordered' lists each structure after everything
+        # it uses.
+        ordered = [component[0] for component in components]
+
+        # check for context mismatch.  A structure needs every context
+        # that any structure it uses (directly or not) needs.
+        neededContexts = {}
+        for structname in ordered:
+            needed = set()
+            for u in self.structUses[structname]:
+                needed.update(self.structUsesContexts[u])
+                needed.update(neededContexts[u])
+            neededContexts[structname] = needed
+        for structname in self.structUses:
+            if neededContexts[structname] <= \
+                    self.structUsesContexts[structname]:
+                continue
+            for u in self.allUses(structname):
                 missing = self.structUsesContexts[
                     u] - self.structUsesContexts[structname]
                 if missing:
                     raise CheckError(
                         "{0} contains {1}, which uses contexts ({2}), but {0} does not use those contexts.".format(structname, u, ",".join(missing)))
 
-        # Perform a topological sort.
-        sorted_structs = []
-        removed = set()
-        while len(self.structUses):
-            removed_this_time = []
-            for structname, uses in list(self.structUses.items()):
-                uses.difference_update(removed)
-                if len(uses) == 0:
-                    removed_this_time.append(structname)
-
-            removed_this_time.sort()
-            sorted_structs.extend(removed_this_time)
-            removed.update(removed_this_time)
-
-            for s in removed_this_time:
-                del self.structUses[s]
-
-        externNames = set(es.name for es in f.externStructs)
-
-        self.sortedStructs = [
-            s for s in sorted_structs if s not in externNames]
+        # Perform a topological sort: first the structures that use
+        # nothing, then the ones that only use those, and so on.  Break
+        # ties alphabetically.
+        depth = {}
+        for structname in ordered:
+            depth[structname] = 1 + max(
+                [depth[u] for u in self.structUses[structname]] or [-1])
+        return sorted(ordered, key=lambda s: (depth[s], s))
+
+    def allUses(self, structname):
+        """Return a set of every structure that 'structname' uses, directly
+           or indirectly."""
+        result = set()
+        pending = list(self.structUses[structname])
+        while pending:
+            u = pending.pop()
+            if u not in result:
+                result.add(u)
+                pending.extend(self.structUses[u])
+        return result
 
     def visitConstDecl(self, cd):
         self.constValues[cd.name] = cd.value.value
@@ -493,15 +631,81 @@ class Annotator(ASTVisitor):
     # after_leftover_field -- true if we are after an SMLenConstrained
     #   that uses the 'leftover bytes' feature.
     # file -- the Grammar.File object we're currently checking
-
-    def __init__(self):
+    # zeroCopy -- true if the file uses the 'zero_copy' option.
+    # arena -- true if the file uses the 'arena' option.
+    # constValues -- as Checker.constValues
+    # sizes -- a map from structure name to the number of bytes that the
+    #   structure always takes when encoded, or None if that can vary.
+    # foldable -- a map from structure name to the result of
+    #   canFoldStruct for that structure.
+
+    def __init__(self, constValues):
         ASTVisitor.__init__(self)
         self.prefix = ""
         self.memberByName = None
+        self.zeroCopy = False
+        self.arena = False
+        self.constValues = constValues
+        self.sizes = {}
+        self.foldable = {}
 
     def visitFile(self, f):
         self.file = f
+        self.zeroCopy = "zero_copy" in f.options
+        self.arena = "arena" in f.options
         f.visitChildren(self)
+        for sd in f.declarations:
+            if not sd.isContext():
+                sd.encodedSize = self.encodedSize(sd.name)
+
+    def encodedSize(self, name):
+        """Return the number of bytes that the structure called 'name'
+           always takes when encoded, or None if that can vary."""
+        if name in self.sizes:
+            return self.sizes[name]
+        sd = self.file.getDeclaration(name)
+        if isinstance(sd, trunnel.Grammar.ExternStructDecl):
+            size = sd.size
+        else:
+            for m in sd.members:
+                if isinstance(m, trunnel.Grammar.SMStruct):
+                    self.encodedSize(m.structname)
+                elif (isinstance(m, trunnel.Grammar.SMFixedArray) and
+                      type(m.basetype) == str):
+                    self.encodedSize(m.basetype)
+            size = trunnel.Interface.encodedSize(sd, self.constValues,
+                                                 self.sizes)
+        self.sizes[name] = size
+        return size
+
+    def canFoldStruct(self, name):
+        """Return true iff we can parse and encode the structure called
+           'name' as part of a run: that is, iff it's declared in this
+           file, takes no contexts, always has the same length, and
+           can't be invalid."""
+        # If a nested structure could be invalid, folding it into a run
+        # would make us notice truncated input before its bad value.
+        if name in self.foldable:
+            return self.foldable[name]
+        sd = self.file.getDeclaration(name)
+        result = (isinstance(sd, trunnel.Grammar.StructDecl) and
+                  not sd.contextList and
+                  self.encodedSize(name) is not None)
+        for m in sd.members if result else ():
+            if isinstance(m, trunnel.Grammar.SMInteger):
+                result = m.constraints is None
+            elif isinstance(m, trunnel.Grammar.SMEos):
+                # This depends on how much input we pass it.
+                result = False
+            elif isinstance(m, trunnel.Grammar.SMStruct):
+                result = self.canFoldStruct(m.structname)
+            elif (isinstance(m, trunnel.Grammar.SMFixedArray) and
+                  type(m.basetype) == str):
+                result = self.canFoldStruct(m.basetype)
+            if not result:
+                break
+        self.foldable[name] = result
+        return result
 
     def visitConstDecl(self, cd):
         pass
@@ -513,7 +717,9 @@ class Annotator(ASTVisitor):
         self.after_leftover_field = False
         self.memberByName = {}
         sd.lengthFields = {}
+        sd.arena = self.arena and not sd.isContext()
         sd.visitChildren(self)
+        self.annotateRuns(sd.members)
         self.cur_struct = None
         self.cur_struct_obj = None
         self.memberByName = None
@@ -526,6 +732,64 @@ class Annotator(ASTVisitor):
         member.after_leftover_field = self.after_leftover_field
         self.memberByName[member.name] = member
 
+    def fixedWidth(self, member):
+        """Return the number of bytes that 'member' takes when encoded, if
+           that never changes and we can parse and encode it in place.
+           Otherwise return None.  (We leave out arrays of structures,
+           which we parse one element at a time anyway.)"""
+        if member.after_leftover_field:
+            # Encoding these has to check against two lengths.
+            return None
+        if isinstance(member, trunnel.Grammar.SMInteger):
+            return member.inttype.width // 8
+        if (isinstance(member, trunnel.Grammar.SMFixedArray) and
+                type(member.basetype) != str):
+            width = member.width
+            if isinstance(width, str):
+                width = self.constValues[width]
+            if type(member.basetype) == trunnel.Grammar.IntType:
+                return width * (member.basetype.width // 8)
+            return width
+        if (isinstance(member, trunnel.Grammar.SMStruct) and
+                self.canFoldStruct(member.structname)):
+            return self.encodedSize(member.structname)
+        return None
+
+    def annotateRuns(self, members):
+        """Find the runs of two or more fixed-width members in 'members'
+           that we can parse and encode with a single length check, and
+           annotate them with their offsets within the run."""
+        # An integer with constraints has to end its run: if we're going
+        # to reject its value, we have to do that before we notice that
+        # the input is truncated later on.
+        run = []
+        for m in members:
+            width = self.fixedWidth(m)
+            if width is None:
+                self.annotateRun(run)
+                run = []
+                continue
+            run.append((m, width))
+            if (isinstance(m, trunnel.Grammar.SMInteger) and
+                    m.constraints is not None):
+                self.annotateRun(run)
+                run = []
+        self.annotateRun(run)
+
+    def annotateRun(self, run):
+        """Given a list of (member, width) tuples for fixed-width members
+           that come one after another, annotate them as a run, if there
+           are at least two of them."""
+        if len(run) < 2:
+            return
+        offset = 0
+        total = sum(w for _, w in run)
+        for m, w in run:
+            m.runOffset = offset
+            m.runLength = total
+            offset += w
+        run[-1][0].endsRun = True
+
     def visitSMInteger(self, smi):
         self.annotateMember(smi)
 
@@ -544,9 +808,12 @@ class Annotator(ASTVisitor):
             sva.widthfieldmember = self.memberByName.get(sva.widthfield)
         if type(sva.basetype) == str:
             sva.structDeclaration = self.file.getDeclaration(sva.basetype)
+        sva.zeroCopy = (self.zeroCopy and arrayIsBytes(sva) and
+                        str(sva.basetype) != "char")
 
     def visitSMString(self, ss):
         self.annotateMember(ss)
+        ss.zeroCopy = self.zeroCopy
 
     def visitSMPosition(self, smp):
         self.annotateMember(smp)
@@ -581,6 +848,7 @@ class Annotator(ASTVisitor):
 
     def visitUnionMember(self, um):
         um.visitChildren(self)
+        self.annotateRuns(um.decls)
 
     def visitSMFail(self, fail):
         pass
@@ -618,6 +886,77 @@ def dedent_code(s):
     return "\n".join(result)
 
 
+class CodeTemplate(object):
+
+    """A format string for CodeGenerator.format, dedented once, and ready
+       to be indented to any level without splitting it up again.
+    """
+    #
+    # text -- the format string, after dedent_code.
+    # lines -- 'text', split into lines.
+    # simple -- true if we can indent this template before filling in its
+    #    fields, and get the same result as indenting it afterwards.  This
+    #    holds when no line starts (after its indentation) with a field,
+    #    since a field could expand to something that CodeGenerator.w
+    #    treats specially: a blank line, or a preprocessor directive.
+    # indented -- a map from indentation prefix to 'text', indented as
+    #    CodeGenerator.w would indent it, with a newline at the end.
+
+    __slots__ = ["text", "lines", "simple", "indented"]
+
+    def __init__(self, fmt):
+        self.text = dedent_code(fmt)
+        self.lines = self.text.split("\n")
+        if self.lines[-1] == "":
+            del self.lines[-1]
+        self.simple = not any(line.lstrip().startswith("{")
+                              for line in self.lines)
+        self.indented = {}
+
+    def indent(self, indent):
+        """Return this template, indented by 'indent'."""
+        try:
+            return self.indented[indent]
+        except KeyError:
+            pass
+        out = []
+        for line in self.lines:
+            if line.isspace() or not line:
+                out.append("\n")
+            elif line.startswith("#"):
+                out.append("%s\n" % line)
+            else:
+                out.append("%s%s\n" % (indent, line))
+        result = self.indented[indent] = "".join(out)
+        return result
+
+# Map from the format strings passed to CodeGenerator.format to
+# CodeTemplate objects.  The format strings are nearly all literals in this
+# file, so this stays small.
+_templateCache = {}
+
+
+def getTemplate(fmt):
+    """Return the CodeTemplate for the format string 'fmt'."""
+    try:
+        return _templateCache[fmt]
+    except KeyError:
+        t = _templateCache[fmt] = CodeTemplate(fmt)
+        return t
+
+
+def _hasNewline(args, kwargs):
+    """Return true if any string in 'args' or the values of 'kwargs'
+       contains a newline."""
+    for a in args:
+        if isinstance(a, str) and "\n" in a:
+            return True
+    for a in kwargs.values():
+        if isinstance(a, str) and "\n" in a:
+            return True
+    return False
+
+
 class CodeGenerator(ASTVisitor):
 
     """Helper class for code-generating visitors: tracks current indentation
@@ -638,16 +977,28 @@ class CodeGenerator(ASTVisitor):
     def w(self, string):
         """Write some code, with the current indentation level added to
            each line."""
-        lines = string.split("\n")
-        if lines[-1] == "":
-            del lines[-1]
-        for line in lines:
+        if string.endswith("\n"):
+            string = string[:-1]
+        elif not string:
+            return
+        if "\n" not in string:
+            # This is most of what we write, so make it quick.
+            if string.isspace() or not string:
+                self.w_("\n")
+            elif string.startswith("#"):
+                self.w_(string + "\n")
+            else:
+                self.w_(self.indent + string + "\n")
+            return
+        out = []
+        for line in string.split("\n"):
             if line.isspace() or not line:
-                self.w_('\n')
+                out.append("\n")
             elif line.startswith("#"):
-                self.w_("%s\n" % line)
+                out.append("%s\n" % line)
             else:
-                self.w_("%s%s\n" % (self.indent, line))
+                out.append("%s%s\n" % (self.indent, line))
+        self.w_("".join(out))
 
     def format(self, fmt, *args, **kwargs):
         """Write code from 'fmt' with the current indentation level added to
@@ -656,12 +1007,17 @@ class CodeGenerator(ASTVisitor):
            indenting it.  Fill in variables in the string using
            'str.format', and the arguments from 'args' and 'kwargs'.
         """
-        self.w(self.format_s(fmt, *args, **kwargs))
+        t = getTemplate(fmt)
+        if t.simple and not _hasNewline(args, kwargs):
+            # Indenting first is the same as indenting afterwards, and we
+            # only need to indent the template once for each level.
+            self.w_(t.indent(self.indent).format(*args, **kwargs))
+        else:
+            self.w(t.text.format(*args, **kwargs))
 
     def format_s(self, fmt, *args, **kwargs):
         """As format, but return a string rather writing to the file."""
-        fmt = dedent_code(fmt)
-        return fmt.format(*args, **kwargs)
+        return getTemplate(fmt).text.format(*args, **kwargs)
 
     def pushIndent(self, n):
         """Increase the current indentation level by 'n' spaces"""
@@ -703,24 +1059,42 @@ class DeclarationGenerationVisitor(CodeGenerator):
 
     """
 
-    def __init__(self, sort_order, f, inCFile=False):
+    #
+    # chunks -- a map from structure name to the code that we already
+    #    generated for it in another process; see generateStructChunks.
+    #    We write that code instead of visiting the structure.  The other
+    #    file-level generators use this the same way.
+
+    def __init__(self, sort_order, f, inCFile=False, chunks=None):
         CodeGenerator.__init__(self, f.write)
         self.sort_order = sort_order
         self.inCFile = inCFile
+        self.chunks = chunks or {}
 
     def visitFile(self, f):
+        if not self.inCFile:
+            for imp in f.imports:
+                self.w('#include "%s"\n' % imp.header)
         for n in f.externStructs:
             self.w("struct %s_st;\n" % n.name)
-        self.isOpaque = ("opaque" in f.options) and not self.inCFile
-        self.isVeryOpaque = ("very_opaque" in f.options) and not self.inCFile
+        self.setOptions(f.options)
         f.visitChildrenSorted(self.sort_order, self)
 
+    def setOptions(self, options):
+        """Remember which of the file's 'options' change what we
+           generate."""
+        self.isOpaque = ("opaque" in options) and not self.inCFile
+        self.isVeryOpaque = ("very_opaque" in options) and not self.inCFile
+
     def visitConstDecl(self, cd):
         if cd.annotation != None:
             self.w(cd.annotation)
         self.w("#define %s %s\n" % (cd.name, cd.value.value))
 
     def visitStructDecl(self, sd):
+        if sd.name in self.chunks:
+            self.w_(self.chunks[sd.name])
+            return
         if sd.annotation != None:
             self.w(sd.annotation)
         if self.isVeryOpaque:
@@ -787,6 +1161,9 @@ class DeclarationGenerationVisitor(CodeGenerator):
             self.w(ss.annotation)
 
         self.w("char *%s;\n" % (ss.c_name))
+        if ss.zeroCopy:
+            # True if the string points into the buffer we parsed it from.
+            self.w("uint8_t %s_borrowed_;\n" % (ss.c_name))
 
     def visitSMPosition(self, smp):
         if smp.annotation != None:
@@ -825,19 +1202,32 @@ class PrototypeGenerationVisitor(CodeGenerator):
        various functions we generate.
     """
 
-    def __init__(self, sort_order, f, docstrings=True):
+    def __init__(self, sort_order, f, docstrings=True, chunks=None):
         CodeGenerator.__init__(self, f.write)
         self.sort_order = sort_order
+        self.chunks = chunks or {}
+        self.zeroCopy = False
+        self.arena = False
         if not docstrings:
             self.docstring = lambda *a: None
 
     def visitFile(self, f):
+        self.setOptions(f.options)
         f.visitChildrenSorted(self.sort_order, self)
 
+    def setOptions(self, options):
+        """Remember which of the file's 'options' change what we
+           generate."""
+        self.zeroCopy = "zero_copy" in options
+        self.arena = "arena" in options
+
     def visitConstDecl(self, cd):
         pass
 
     def visitStructDecl(self, sd):
+        if sd.name in self.chunks:
+            self.w_(self.chunks[sd.name])
+            return
         name = sd.name
         self.docstring("""Return a newly allocated %s with all elements set
                           to zero.""" % name)
@@ -857,17 +1247,51 @@ class PrototypeGenerationVisitor(CodeGenerator):
     def writeParseEncodePrototypes(self, sd):
         name = sd.name
         contextFormals = formatContexts(sd.contextList, declaration=True)
+        lifetime = ""
+        if self.zeroCopy:
+            lifetime = """The new object's byte arrays and nul-terminated
+                          strings may point into 'input', so 'input' must
+                          not change or go away until the object is freed.
+                       """
         self.docstring("""Try to parse a %s from the buffer in 'input',
                           using up to 'len_in' bytes from the input buffer.
                           On success, return the number of bytes consumed and
                           set *output to the newly allocated %s_t. On failure,
                           return -2 if the input appears truncated, and -1
-                          if the input is otherwise invalid.
-                       """ % (name, name))
+                          if the input is otherwise invalid. %s
+                       """ % (name, name, lifetime))
         self.w(
             "ssize_t %s_parse(%s_t **output, const uint8_t *input, const size_t len_in%s);\n" %
                (name, name, contextFormals))
 
+        self.docstring("""Check whether 'input' begins with a valid
+                          encoded %s, using up to 'len_in' bytes from the
+                          input buffer, without allocating anything.
+                          Return what %s_parse() would return, if it
+                          didn't run out of memory: the number of bytes
+                          used, -2 if the input appears truncated, or -1
+                          if the input is otherwise invalid.
+                       """ % (name, name))
+        self.w(
+            "ssize_t %s_validate(const uint8_t *input, const size_t len_in%s);\n" %
+               (name, contextFormals))
+
+        if self.arena:
+            self.docstring("""As %s_parse(), but allocate the new object,
+                              and everything in it, from 'arena'.  Don't
+                              free the new object or change it: it goes
+                              away when 'arena' is reset or destroyed.
+                              Even on failure, this function may have used
+                              some of the arena's memory.""" % name)
+            self.w(
+                "ssize_t %s_parse_arena(%s_t **output, const uint8_t *input, const size_t len_in, trunnel_arena_t *arena%s);\n" %
+                (name, name, contextFormals))
+
+        if sd.encodedSize is not None:
+            self.docstring("""The number of bytes that every encoded %s
+                              takes.""" % name)
+            self.w("#define %s %s\n" % (encodedLenMacro(sd), sd.encodedSize))
+
         self.docstring("""Return the number of bytes we expect to need to
                           encode the %s in 'obj'.  On
                           failure, return a negative value.  Note that
@@ -922,6 +1346,21 @@ def field(name):
         return "obj->" + name
 
 
+def runPointer(member):
+    """Return a C expression for the place in the input or output where
+       'member' goes, given that 'ptr' points to the start of its run of
+       fixed-width members, if it has one."""
+    if member.runOffset:
+        return "ptr + %s" % member.runOffset
+    return "ptr"
+
+
+def encodedLenMacro(sd):
+    """Return the name of the macro that holds the encoded length of the
+       fixed-size structure 'sd'."""
+    return "%s_ENCODED_LEN" % sd.name.upper()
+
+
 def formatContextChecks(cg, contextList, onFail):
     """Using the code generator 'cg', emit code to call 'onFail' if
        any of the context objects in 'contextList' fails a check call."""
@@ -939,24 +1378,35 @@ class CodeGenerationVisitor(CodeGenerator):
        Iterates over all the structures in a file in a provided
        topologically sorted order, and then generates the functions
        for each.
+
+       If 'fused' is true, walk each structure's members only once, as
+       in generateFused.  That makes the same code, but hasn't proven any
+       faster, so it is off by default.
     """
 
-    def __init__(self, sort_order, f):
+    def __init__(self, sort_order, f, profiler=None, fused=False,
+                 chunks=None):
         CodeGenerator.__init__(self, f.write)
         self.f = f
         self.sort_order = sort_order
+        self.profiler = profiler
+        self.fused = fused
+        self.chunks = chunks or {}
         self.generators = [NewFnGenerator, FreeFnGenerator,
                            AccessorFnGenerator, CheckFnGenerator,
                            EncodedLenFnGenerator,
-                           EncodeFnGenerator, ParseFnGenerator]
+                           EncodeFnGenerator, ParseFnGenerator,
+                           ArenaParseFnGenerator, ValidateFnGenerator]
 
     def visitFile(self, f):
         for es in f.externStructs:
             n = es.name
             fakeStruct = trunnel.Grammar.StructDecl(n, es.contextList)
             self.w("typedef struct %s_st %s_t;" % (n, n))
-            PrototypeGenerationVisitor(
-                self.sort_order, self.f, docstrings=False).visit(fakeStruct)
+            v = PrototypeGenerationVisitor(
+                self.sort_order, self.f, docstrings=False)
+            v.setOptions(f.options)
+            v.visit(fakeStruct)
         f.visitChildrenSorted(self.sort_order, self)
 
     def visitConstDecl(self, cd):
@@ -965,11 +1415,69 @@ class CodeGenerationVisitor(CodeGenerator):
     def visitStructDecl(self, sd):
         # We invoke these sub-visitors for each structure independently, so
         # that all the methdos for a structure are produced together.
+        if sd.name in self.chunks:
+            self.w_(self.chunks[sd.name])
+            return
+        if self.fused and self.profiler is None:
+            self.generateFused(sd)
+            return
         for g in self.generators:
-            g(self.w).visit(sd)
+            if self.profiler is None:
+                g(self.w).visit(sd)
+            else:
+                with self.profiler.codegen(sd.name, g.__name__):
+                    g(self.w).visit(sd)
+
+    def generateFused(self, sd):
+        """As visitStructDecl, but walk over the members of 'sd' only once,
+           letting every generator handle each member in turn.  Each
+           generator writes into its own buffer, so that we can still
+           write its functions out in the usual order."""
+        buffers = []
+        active = []
+        for g in self.generators:
+            # Give each generator a writer that treats lines the same way
+            # as our own w() does.
+            buf = []
+            gen = g(CodeGenerator(buf.append).w)
+            buffers.append(buf)
+            if gen.beginStruct(sd):
+                active.append(gen)
+        for m in sd.members:
+            for gen in active:
+                gen.visit(m)
+        for gen in active:
+            gen.endStruct(sd)
+        self.w_("".join("".join(buf) for buf in buffers))
+
+
+class StructFnGenerator(CodeGenerator):
+
+    """Base class for the visitors that generate the functions for a
+       single structure.
+
+       Subclasses write whatever comes before the members in
+       beginStruct, and whatever comes after them in endStruct, so that
+       CodeGenerationVisitor can run several of them over the members of
+       a structure at once.
+    """
+
+    def visitStructDecl(self, sd):
+        if self.beginStruct(sd):
+            sd.visitChildren(self)
+            self.endStruct(sd)
 
+    def beginStruct(self, sd):
+        """Write the code that comes before the members of 'sd'.  Return
+           true if we should go on to visit its members."""
+        return True
+
+    def endStruct(self, sd):
+        """Write the code that comes after the members of 'sd'."""
+        pass
 
-class NewFnGenerator(CodeGenerator):
+
+class NewFnGenerator(StructFnGenerator):
 
     """Code-generating visitor to construct the 'typename_new' function
        for a structure.
@@ -977,12 +1485,19 @@ class NewFnGenerator(CodeGenerator):
        The generated function just constructs a new value, with all of
        its fields initialized to 0.  (This sets dynamic arrays to be
        empty, and we require that this sets pointers to NULL.)
+
+       For a structure with a typename_parse_arena() function, we also
+       generate a static typename_new_in_arena() function, which does the
+       same with memory from a trunnel_arena_t.
     """
+    #
+    # inits -- a list of the lines that set fields to their initial
+    #    values.
 
     def __init__(self, writefn):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
 
-    def visitStructDecl(self, sd):
+    def beginStruct(self, sd):
         name = sd.name
         self.format("""
            {0}_t *
@@ -992,7 +1507,28 @@ class NewFnGenerator(CodeGenerator):
              if (NULL == val)
                return NULL;""", name)
         self.pushIndent(2)
-        sd.visitChildren(self)
+        self.inits = []
+        return True
+
+    def endStruct(self, sd):
+        self.popIndent(2)
+        self.w("  return val;")
+        self.w("}\n\n")
+        if not sd.arena:
+            return
+        self.docstring("""As %s_new(), but allocate the new object from
+                          'arena'.""" % sd.name)
+        self.format("""
+           static {0}_t *
+           {0}_new_in_arena(trunnel_arena_t *arena)
+           {{
+             {0}_t *val = trunnel_arena_alloc(arena, sizeof({0}_t));
+             if (NULL == val)
+               return NULL;
+             memset(val, 0, sizeof({0}_t));""", sd.name)
+        self.pushIndent(2)
+        for line in self.inits:
+            self.w(line)
         self.popIndent(2)
         self.w("  return val;")
         self.w("}\n\n")
@@ -1003,10 +1539,12 @@ class NewFnGenerator(CodeGenerator):
     def visitSMInteger(self, smi):
         minval = smi.minimum()
         if minval != 0:
-            self.w("val->%s = %s;\n" % (smi.c_name, minval))
+            line = "val->%s = %s;\n" % (smi.c_name, minval)
+            self.inits.append(line)
+            self.w(line)
 
 
-class FreeFnGenerator(CodeGenerator):
+class FreeFnGenerator(StructFnGenerator):
 
     """Code-generating visitor to construct the 'typename_clear' and
        'typename_free' functions for a structure.
@@ -1020,9 +1558,9 @@ class FreeFnGenerator(CodeGenerator):
     """
 
     def __init__(self, writefn):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
 
-    def visitStructDecl(self, sd):
+    def beginStruct(self, sd):
         self.structName = name = sd.name
         self.docstring("""Release all storage held inside 'obj',
                           but do not free 'obj'.""")
@@ -1032,7 +1570,10 @@ class FreeFnGenerator(CodeGenerator):
              {{
                (void) obj;""", name)
         self.pushIndent(2)
-        sd.visitChildren(self)
+        return True
+
+    def endStruct(self, sd):
+        name = sd.name
         self.popIndent(2)
         self.format("""
              }}
@@ -1075,12 +1616,23 @@ class FreeFnGenerator(CodeGenerator):
                 sva.basetype, sva.c_name)
             iterateOverVarArray(self, sva, body)
 
+        # If the array points into the buffer we parsed it from, it
+        # isn't ours to free.
+        if sva.zeroCopy:
+            self.w("TRUNNEL_DYNARRAY_DISOWN(&obj->%s);\n" % (sva.c_name))
         self.w("TRUNNEL_DYNARRAY_WIPE(&obj->%s);\n" % (sva.c_name))
         self.w("TRUNNEL_DYNARRAY_CLEAR(&obj->%s);\n" % (sva.c_name))
 
     def visitSMString(self, ss):
         # To clear a string, we call trunnel_free() on it.  (We require that
-        # trunnel_free must handle NULL.)
+        # trunnel_free must handle NULL.)  If the string points into the
+        # buffer we parsed it from, it isn't ours to free.
+        if ss.zeroCopy:
+            self.format("""
+                if (obj->{0}_borrowed_) {{
+                  obj->{0} = NULL;
+                  obj->{0}_borrowed_ = 0;
+                }}""", ss.c_name)
         self.w("trunnel_wipestr(obj->%s);\n" % (ss.c_name))
         self.w("trunnel_free(obj->%s);\n" % (ss.c_name))
 
@@ -1106,7 +1658,7 @@ class FreeFnGenerator(CodeGenerator):
         pass
 
 
-class AccessorFnGenerator(CodeGenerator):
+class AccessorFnGenerator(StructFnGenerator):
 
     """Code-generating visitor that generates the accessors for structure
        members.  See function documentation for a description of every
@@ -1126,10 +1678,11 @@ class AccessorFnGenerator(CodeGenerator):
     """
 
     def __init__(self, writefn, prototypes_only=False):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
         self.prototypes_only = prototypes_only
         if self.prototypes_only:
             self.w = lambda *args: None
+            self.format = lambda *args, **kwargs: None
         else:
             self.docstring = lambda *args: None
 
@@ -1139,9 +1692,9 @@ class AccessorFnGenerator(CodeGenerator):
         else:
             self.w_real('%s\n%s\n' % (rv, decl))
 
-    def visitStructDecl(self, sd):
+    def beginStruct(self, sd):
         self.structName = sd.name
-        sd.visitChildren(self)
+        return True
 
     def visit_other(self, ast):
         pass
@@ -1456,8 +2009,15 @@ class AccessorFnGenerator(CodeGenerator):
                              % (st, nm, st, elttype))
             self.w("{\n")
 
+        if sva.zeroCopy:
+            self.w("  TRUNNEL_DYNARRAY_OWN(%s, &inp->%s, {});\n"
+                   % (elttype, nm))
         self.w("  TRUNNEL_DYNARRAY_SET(&inp->%s, idx, elt);\n" % nm)
         self.w("  return 0;\n")
+        if sva.zeroCopy:
+            self.w(" trunnel_alloc_failed:\n"
+                   "  TRUNNEL_SET_ERROR_CODE(inp);\n"
+                   "  return -1;\n")
         self.w("}\n")
 
         self.docstring("""Append a new element 'elt' to the dynamic array
@@ -1475,6 +2035,9 @@ class AccessorFnGenerator(CodeGenerator):
                #endif""",
                         c_name=sva.c_name, maxlen=maxlen)
 
+        if sva.zeroCopy:
+            self.w("  TRUNNEL_DYNARRAY_OWN(%s, &inp->%s, {});\n"
+                   % (elttype, nm))
         self.w("  TRUNNEL_DYNARRAY_ADD(%s, &inp->%s, elt, {});\n"
                "  return 0;\n"
                " trunnel_alloc_failed:\n"
@@ -1482,20 +2045,23 @@ class AccessorFnGenerator(CodeGenerator):
                "  return -1;\n"
                "}\n\n" % (elttype, nm))
 
-        self.docstring("""Return a pointer to the variable-length
-                          array field %s of 'inp'.""" % nm)
-        self.declaration("%s *" % elttype,
-                         "%s_getarray_%s(%s_t *inp)" % (st, nm, st))
-        self.w(("{\n"
-                "  return inp->%s.elts_;\n"
-                "}\n") % (sva.c_name))
-        self.docstring("As %s_get_%s, but take and return a const pointer"
-                       %(st,nm))
-        self.declaration("const %s %s *"%(elttype,extraconst),
-                         "%s_getconstarray_%s(const %s_t *inp)" % (st, nm, st))
-        self.w("{\n"
-               "  return (const %s %s *)%s_getarray_%s((%s_t*)inp);\n"
-               "}\n" %(elttype, extraconst, st, nm, st))
+        if sva.zeroCopy:
+            self.writeZeroCopyArrayAccessors(sva)
+        else:
+            self.docstring("""Return a pointer to the variable-length
+                              array field %s of 'inp'.""" % nm)
+            self.declaration("%s *" % elttype,
+                             "%s_getarray_%s(%s_t *inp)" % (st, nm, st))
+            self.w(("{\n"
+                    "  return inp->%s.elts_;\n"
+                    "}\n") % (sva.c_name))
+            self.docstring("As %s_get_%s, but take and return a const pointer"
+                           %(st,nm))
+            self.declaration("const %s %s *"%(elttype,extraconst),
+                             "%s_getconstarray_%s(const %s_t *inp)" % (st, nm, st))
+            self.w("{\n"
+                   "  return (const %s %s *)%s_getarray_%s((%s_t*)inp);\n"
+                   "}\n" %(elttype, extraconst, st, nm, st))
 
         if type(sva.basetype) == str:
             fill = "Fill extra elements with NULL; free removed elements."
@@ -1531,6 +2097,9 @@ class AccessorFnGenerator(CodeGenerator):
             else:
                 freefn = "(trunnel_free_fn_t) NULL"
 
+            if sva.zeroCopy:
+                self.w("TRUNNEL_DYNARRAY_OWN(%s, &inp->%s, {});\n"
+                       % (elttype, sva.c_name))
             self.format("""
                 newptr = trunnel_dynarray_setlen(&inp->{c_name}.allocated_,
                                &inp->{c_name}.n_, inp->{c_name}.elts_, newlen,
@@ -1551,6 +2120,46 @@ class AccessorFnGenerator(CodeGenerator):
         if str(sva.basetype) == 'char':
             self.writeVarArrayCharAccessors(sva, maxlen, if_overflow_possible)
 
+    def writeZeroCopyArrayAccessors(self, sva):
+        """For a variable-length array field 'FIELD' of uint8_t that we
+           parse in zero_copy mode, we generate these functions:
+               TYPE_getarray_FIELD(x)
+               TYPE_getconstarray_FIELD(x)
+
+           They behave as usual, except that the 'getarray' function,
+           which lets the caller change the array, first makes our own
+           copy of the array if it still points into the buffer we
+           parsed it from.  On allocation failure, it returns NULL.  The
+           'getconstarray' function never copies anything.
+        """
+        st = self.structName
+        nm = sva.c_fn_name
+
+        self.docstring("""Return a pointer to the variable-length
+                          array field %s of 'inp'.  If the array still
+                          points into the buffer that 'inp' was parsed
+                          from, copy it first.  Return NULL and set the
+                          error code on 'inp' on failure.""" % nm)
+        self.declaration("uint8_t *",
+                         "%s_getarray_%s(%s_t *inp)" % (st, nm, st))
+        self.format("""
+            {{
+              TRUNNEL_DYNARRAY_OWN(uint8_t, &inp->{c_name}, {{}});
+              return inp->{c_name}.elts_;
+             trunnel_alloc_failed:
+              TRUNNEL_SET_ERROR_CODE(inp);
+              return NULL;
+            }}""", c_name=sva.c_name)
+
+        self.docstring("""As %s_get_%s, but take and return a const
+                          pointer.  This may point into the buffer that
+                          'inp' was parsed from.""" % (st, nm))
+        self.declaration("const uint8_t *",
+                         "%s_getconstarray_%s(const %s_t *inp)" % (st, nm, st))
+        self.w("{\n"
+               "  return inp->%s.elts_;\n"
+               "}\n" % sva.c_name)
+
     def writeVarArrayCharAccessors(self, sva, maxlen, if_overflow_possible):
         """For a variable-length array field 'FIELD' of char in a structure
            called 'TYPE', we generate these functions:
@@ -1631,6 +2240,22 @@ class AccessorFnGenerator(CodeGenerator):
                        "error code on 'inp' on failure." % (nm, st))
         self.declaration(
             "int", "%s_set_%s(%s_t *inp, const char *val)" % (st, nm, st))
+        if sms.zeroCopy:
+            # Don't free the old value if it points into the buffer we
+            # parsed it from.
+            self.format("""
+                 {{
+                   if (inp->{c_name}_borrowed_)
+                     inp->{c_name}_borrowed_ = 0;
+                   else
+                     trunnel_free(inp->{c_name});
+                   if (NULL == (inp->{c_name} = trunnel_strdup(val))) {{
+                     TRUNNEL_SET_ERROR_CODE(inp);
+                     return -1;
+                   }}
+                   return 0;
+                 }}""", c_name=sms.c_name)
+            return
         self.format("""
              {{
                trunnel_free(inp->{c_name});
@@ -1702,7 +2327,7 @@ def iterateOverVarArray(generator, sva, body, extraDecl=""):
            }}""")
 
 
-class CheckFnGenerator(CodeGenerator):
+class CheckFnGenerator(StructFnGenerator):
 
     """Code-generating visitor to generate the 'typename_check' function
        for a given structure.
@@ -1715,11 +2340,11 @@ class CheckFnGenerator(CodeGenerator):
     """
 
     def __init__(self, writefn):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
 
-    def visitStructDecl(self, sd):
+    def beginStruct(self, sd):
         if sd.isContext():
-            return
+            return False
         contextFormals = formatContexts(sd.contextList, declaration=True)
         # To check a whole structure: check that the structure pointer
         # isn't NULL, then check the contents.
@@ -1732,7 +2357,9 @@ class CheckFnGenerator(CodeGenerator):
                'if (obj->trunnel_error_code_)\n'
                '  return "A set function failed on this object";\n')
         formatContextChecks(self, sd.contextList, 'return "Context was NULL";')
-        sd.visitChildren(self)
+        return True
+
+    def endStruct(self, sd):
         self.w("return NULL;\n")
         self.popIndent(2)
         self.w("}\n\n")
@@ -1876,20 +2503,35 @@ def arrayIsBytes(arry):
         return False
 
 
-class EncodedLenFnGenerator(CodeGenerator):
+class EncodedLenFnGenerator(StructFnGenerator):
 
     def __init__(self, writefn):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
         self.action = "Length of"
 
-    def visitStructDecl(self, sd):
+    def beginStruct(self, sd):
         if sd.isContext():
-            return
+            return False
 
         name = sd.name
         contextFormals = formatContexts(sd.contextList, declaration=True)
         contextArgs = formatContexts(sd.contextList, declaration=False)
 
+        if sd.encodedSize is not None:
+            # Every one of these is the same length, so there's nothing
+            # to add up.
+            self.format("""
+                       ssize_t
+                       {name}_encoded_len(const {name}_t *obj{args})
+                       {{
+                         if (NULL != {name}_check(obj{cargs}))
+                            return -1;
+
+                         return {macro};
+                       }}""", name=name, args=contextFormals,
+                        cargs=contextArgs, macro=encodedLenMacro(sd))
+            return False
+
         self.format("""
                        ssize_t
                        {name}_encoded_len(const {name}_t *obj{args})
@@ -1899,7 +2541,9 @@ class EncodedLenFnGenerator(CodeGenerator):
         self.pushIndent(2)
         self.w(('if (NULL != %s_check(obj%s))\n'
                 '   return -1;\n\n') % (sd.name, contextArgs))
-        sd.visitChildren(self)
+        return True
+
+    def endStruct(self, sd):
         self.popIndent(2)
         self.format("""
                       return result;
@@ -1980,7 +2624,7 @@ class EncodedLenFnGenerator(CodeGenerator):
         pass
 
 
-class EncodeFnGenerator(CodeGenerator):
+class EncodeFnGenerator(StructFnGenerator):
 
     """Code-generating visitor that generates the 'typename_encode()'
        function and 'typename_clear_errors()' function for a given structure.
@@ -2011,13 +2655,18 @@ class EncodeFnGenerator(CodeGenerator):
     # curStruct -- the current StructDecl
     # structName -- the name of the current structure
     # needTruncated -- true iff we need to generate a 'truncated' label.
+    # fixedSize -- true iff the current structure always has the same
+    #    length, so that we check for room for all of it at once.
 
     def __init__(self, writefn):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
         self.action = "Encode"
+        self.fixedSize = False
 
     def checkAvail_s(self, needed, member):
         self.needTruncated = True
+        if self.fixedSize:
+            return ""
         if member.after_leftover_field:
             return self.format_s("""
                trunnel_assert(written <= avail);
@@ -2038,9 +2687,23 @@ class EncodeFnGenerator(CodeGenerator):
     def checkAvail(self, needed, member):
         self.w(self.checkAvail_s(needed, member))
 
-    def visitStructDecl(self, sd):
+    def beginRun(self, member):
+        """If 'member' starts a run of fixed-width members, make sure that
+           there's room for the whole run."""
+        if member.runOffset == 0:
+            self.checkAvail(member.runLength, member)
+
+    def endRun(self, member):
+        """If 'member' ends a run of fixed-width members, advance past the
+           whole run."""
+        if member.endsRun:
+            self.format("""
+                written += {0}; ptr += {0};
+                """, member.runLength)
+
+    def beginStruct(self, sd):
         if sd.isContext():
-            return
+            return False
 
         self.structName = name = sd.name
         self.curStruct = sd
@@ -2087,8 +2750,15 @@ class EncodeFnGenerator(CodeGenerator):
         self.w("trunnel_assert(encoded_len >= 0);\n")
         self.w_("#endif\n")
         self.needTruncated = False
-        sd.visitChildren(self)
+        self.fixedSize = sd.encodedSize is not None
+        if self.fixedSize:
+            self.needTruncated = True
+            self.w('\nif (avail < %s)\n'
+                   '  goto truncated;\n' % encodedLenMacro(sd))
+        return True
 
+    def endStruct(self, sd):
+        contextArgs = formatContexts(sd.contextList, declaration=False)
         self.w('\n'
                '\ntrunnel_assert(ptr == output + written);\n')
 
@@ -2120,17 +2790,31 @@ class EncodeFnGenerator(CodeGenerator):
                "  return result;\n")
         self.w("}\n\n")
         self.curStruct = None
+        self.fixedSize = False
 
     def visitSMInteger(self, smi):
         # To encode an integer field, we delegate to encodeInteger.
         #
         # If the field is the length of a union, we remember the
         # current position in the output buffer.
+        #
+        # If the field is part of a run, we write it at its offset within
+        # the run instead, and only check for room and advance at the
+        # start and the end of the run.
         self.eltHeader(smi)
         if smi.c_name in self.curStruct.lengthFields:
-            self.w('backptr_%s = ptr;\n' % (smi.c_name))
-        self.w(
-            self.encodeInteger(smi, smi.inttype.width, "obj->%s" % (smi.c_name)))
+            self.w('backptr_%s = %s;\n' % (smi.c_name, runPointer(smi)))
+        if smi.runOffset is None:
+            self.w(self.encodeInteger(smi, smi.inttype.width,
+                                      "obj->%s" % (smi.c_name)))
+            return
+        width = smi.inttype.width
+        self.beginRun(smi)
+        self.format("""
+            trunnel_set_uint{width}({ptr}, {hton}(obj->{c_name}));
+            """, width=width, ptr=runPointer(smi), hton=HTON_FN[width],
+                    c_name=smi.c_name)
+        self.endRun(smi)
 
     def encodeInteger(self, member, width, element, forFormat=False):
         # To encode an integer field, we make sure we have enough
@@ -2150,9 +2834,26 @@ class EncodeFnGenerator(CodeGenerator):
 
     def visitSMStruct(self, sms):
         # To encode an structure field, we delegate to encodeStruct
+        #
+        # If the field is part of a run, we give the structure exactly
+        # the room it needs, at its offset within the run.  It can't fail
+        # there, since our typename_check() already checked it.
         self.eltHeader(sms)
-        self.w(self.encodeStruct(sms.structname, "obj->%s" % (sms.c_name),
-                                 sms.structDeclaration.contextList))
+        if sms.runOffset is None:
+            self.w(self.encodeStruct(sms.structname,
+                                     "obj->%s" % (sms.c_name),
+                                     sms.structDeclaration.contextList))
+            return
+        self.beginRun(sms)
+        self.format("""
+                result = {structtype}_encode({ptr}, {size}, obj->{c_name});
+                if (result < 0)
+                  goto fail;
+                trunnel_assert(result == {size});
+                """, structtype=sms.structname, ptr=runPointer(sms),
+                    size=sms.structDeclaration.encodedSize,
+                    c_name=sms.c_name)
+        self.endRun(sms)
 
     def encodeStruct(self, structtype, element_pointer, contextList):
         # To encode a struct, we delegate to that structure's typename_encode()
@@ -2181,8 +2882,15 @@ class EncodeFnGenerator(CodeGenerator):
         # To encode a fixed array of anything else, we iterate over
         # the array with a for loop, and encode each member as
         # appropriate (see encodeInteger and encodeStruct.)
+        #
+        # If the array is part of a run, we do the same thing at its
+        # offset within the run, but leave the checking for room and the
+        # advancing to the start and the end of the run.
 
         self.eltHeader(sfa)
+        if sfa.runOffset is not None:
+            self.encodeFixedArrayInRun(sfa)
+            return
         if arrayIsBytes(sfa):
             self.needTruncated = True
             if str(sfa.basetype) == 'char':
@@ -2211,6 +2919,31 @@ class EncodeFnGenerator(CodeGenerator):
             body = self.encodeInteger(sfa, sfa.basetype.width, "{ELEMENT}")
         iterateOverFixedArray(self, sfa, body)
 
+    def encodeFixedArrayInRun(self, sfa):
+        """Generate code to encode the fixed array of integers or char
+           'sfa', which is part of a run of fixed-width members."""
+        ptr = runPointer(sfa)
+        self.beginRun(sfa)
+        if str(sfa.basetype) == 'char':
+            self.format("""
+                    {{
+                      size_t len = strlen(obj->{c_name});
+                      trunnel_assert(len <= {width});
+                      memcpy({ptr}, obj->{c_name}, len);
+                      memset({ptr} + len, 0, {width} - len);
+                    }}
+                    """, c_name=sfa.c_name, width=sfa.width, ptr=ptr)
+        elif sfa.basetype.width == 8:
+            self.format("""
+                    memcpy({ptr}, obj->{c_name}, {width});
+                    """, c_name=sfa.c_name, width=sfa.width, ptr=ptr)
+        else:
+            width = sfa.basetype.width
+            iterateOverFixedArray(
+                self, sfa, "trunnel_set_uint%s(%s + %s * idx, %s({ELEMENT}));"
+                % (width, ptr, width // 8, HTON_FN[width]))
+        self.endRun(sfa)
+
     def visitSMVarArray(self, sva):
         # To encode a variable-length array of bytes, we double-check
         # consistency of the length value, ensure that we have enough
@@ -2378,7 +3111,7 @@ def intConstraintExpression(v, ranges, width):
     return "(%s)" % (" || ".join(tests))
 
 
-class ParseFnGenerator(CodeGenerator):
+class ParseFnGenerator(StructFnGenerator):
 
     """Code-generating visitor that generates the 'typename_parse()' and
        'typename_parse_into()' functions for a given structure.
@@ -2417,37 +3150,89 @@ class ParseFnGenerator(CodeGenerator):
     #    input truncated.  This is usually 'truncated', but see below.
     # structFailLabel -- the label that we should goto if we find the
     #    input truncated.  This is usually 'relay_fail', but see below.
+    # arena -- true iff we allocate everything from the trunnel_arena_t
+    #    in 'arena'.  (See ArenaParseFnGenerator.)
+    # validateOnly -- true iff we only check the input, without storing
+    #    anything but integers.  (See ValidateFnGenerator.)
+    # fixedSize -- true iff the current structure always has the same
+    #    length, so that we check the length of the input only once.
 
     def __init__(self, writefn):
-        CodeGenerator.__init__(self, writefn)
+        StructFnGenerator.__init__(self, writefn)
         self.action = "Parse"
+        self.arena = False
+        self.validateOnly = False
+        self.fixedSize = False
 
-    def visitStructDecl(self, sd):
-        if sd.isContext():
-            return
+    def beginStruct(self, sd):
+        if sd.isContext() or (self.arena and not sd.arena):
+            return False
 
         contextFormals = formatContexts(sd.contextList, declaration=True)
-        contextArgs = formatContexts(sd.contextList, declaration=False)
         self.structName = name = sd.name
-        self.docstring("""As %s_parse(), but do not allocate the
-                          output object.""" % name)
+        self.needLabels = set()
+        self.truncatedLabel = "truncated"
+        self.structFailLabel = "relay_fail"
+        self.fixedSize = False
+        if self.validateOnly:
+            # We keep the integer fields in a structure on the stack, so
+            # that we can refer to them just as we do when parsing.
+            self.format("""
+                ssize_t
+                {name}_validate(const uint8_t *input, const size_t len_in{formals})
+                {{
+                  const uint8_t *ptr = input;
+                  size_t remaining = len_in;
+                  ssize_t result = 0;
+                  {name}_t obj_;
+                  {name}_t *obj = &obj_;
+                  (void)result;
+                  (void)obj;
+                """, name=name, formals=contextFormals)
+            self.pushIndent(2)
+            formatContextChecks(self, sd.contextList, 'return -1;')
+            return True
+        if self.arena:
+            fn = "parse_into_arena"
+            contextFormals = ", trunnel_arena_t *arena" + contextFormals
+            self.docstring("""As %s_parse_arena(), but do not allocate
+                              the output object.""" % name)
+        else:
+            fn = "parse_into"
+            self.docstring("""As %s_parse(), but do not allocate the
+                              output object.""" % name)
         self.format("""
             static ssize_t
-            {name}_parse_into({name}_t *obj, const uint8_t *input, const size_t len_in{formals})
+            {name}_{fn}({name}_t *obj, const uint8_t *input, const size_t len_in{formals})
             {{
               const uint8_t *ptr = input;
               size_t remaining = len_in;
               ssize_t result = 0;
               (void)result;
-            """, name=name, formals=contextFormals)
+            """, name=name, fn=fn, formals=contextFormals)
         self.pushIndent(2)
+        if self.arena:
+            self.w("(void)arena;\n")
 
         formatContextChecks(self, sd.contextList, 'return -1;')
 
-        self.needLabels = set()
-        self.truncatedLabel = "truncated"
-        self.structFailLabel = "relay_fail"
-        sd.visitChildren(self)
+        if sd.encodedSize is not None:
+            # We only need to check the length once.  If the input is too
+            # short, we let typename_validate() find out whether to say
+            # that it's truncated or invalid.
+            self.fixedSize = True
+            self.format("""
+                if (remaining < {macro})
+                  return {name}_validate(input, len_in{args});
+                """, macro=encodedLenMacro(sd), name=name,
+                        args=formatContexts(sd.contextList,
+                                            declaration=False))
+        return True
+
+    def endStruct(self, sd):
+        name = sd.name
+        contextFormals = formatContexts(sd.contextList, declaration=True)
+        contextArgs = formatContexts(sd.contextList, declaration=False)
 
         self.w('trunnel_assert(ptr + remaining == input + len_in);\n')
 
@@ -2465,6 +3250,26 @@ class ParseFnGenerator(CodeGenerator):
             self.w(' fail:\n  result = -1;\n  return result;\n')
         self.w("}\n\n")
 
+        if self.validateOnly:
+            return
+
+        if self.arena:
+            self.format("""
+              ssize_t
+              {name}_parse_arena({name}_t **output, const uint8_t *input, const size_t len_in, trunnel_arena_t *arena{formals})
+              {{
+                ssize_t result;
+                *output = {name}_new_in_arena(arena);
+                if (NULL == *output)
+                  return -1;
+                result = {name}_parse_into_arena(*output, input, len_in, arena{args});
+                if (result < 0)
+                  *output = NULL;
+                return result;
+              }}
+              """, name=name, formals=contextFormals, args=contextArgs)
+            return
+
         self.format("""
               ssize_t
               {name}_parse({name}_t **output, const uint8_t *input, const size_t len_in{formals})
@@ -2489,7 +3294,7 @@ class ParseFnGenerator(CodeGenerator):
 
         self.eltHeader(smi)
         v = "obj->%s" % (smi.c_name)
-        self.parseInteger(smi.inttype.width, v)
+        self.parseInteger(smi.inttype.width, v, smi)
 
         if smi.constraints is not None:
             expr = intConstraintExpression(
@@ -2499,45 +3304,110 @@ class ParseFnGenerator(CodeGenerator):
             self.w(('if (! %s)\n'
                     '  goto fail;\n') % (expr))
 
-    def parseInteger(self, width, element):
-        """Generate code to parse a width-bit integer into element."""
+    def parseInteger(self, width, element, member=None):
+        """Generate code to parse a width-bit integer into element.  If
+           the integer is the struct member 'member', and that's part of
+           a run, parse it from its place in the run."""
         # First, check whether we have enough bytes left.  If we do, use
         # the appropriate ntoh function and get_uint function to read from
         # the input, and adjust 'remaining' and 'ptr' appropriately.
         nbytes = width // 8
         ntoh = NTOH_FN[width]
-        self.needLabels.add(self.truncatedLabel)
-        self.format("""
+        if member is not None and member.runOffset is not None:
+            self.beginRun(member)
+            self.format("""
+                {element} = {ntoh}(trunnel_get_uint{width}({ptr}));
+                """, ntoh=ntoh, width=width, element=element,
+                        ptr=runPointer(member))
+            self.endRun(member)
+            return
+        if not self.fixedSize:
+            self.needLabels.add(self.truncatedLabel)
+            self.format("""
                 CHECK_REMAINING({nbytes}, {truncated});
+                """, nbytes=nbytes, truncated=self.truncatedLabel)
+        self.format("""
                 {element} = {ntoh}(trunnel_get_uint{width}(ptr));
                 remaining -= {nbytes}; ptr += {nbytes};
-                """, nbytes=nbytes, truncated=self.truncatedLabel,
-                    ntoh=ntoh, width=width, element=element)
+                """, nbytes=nbytes, ntoh=ntoh, width=width,
+                    element=element)
+
+    def beginRun(self, member):
+        """If 'member' starts a run of fixed-width members, make sure that
+           the input holds the whole run."""
+        if member.runOffset == 0 and not self.fixedSize:
+            self.needLabels.add(self.truncatedLabel)
+            self.format("""
+                CHECK_REMAINING({0}, {1});
+                """, member.runLength, self.truncatedLabel)
+
+    def endRun(self, member):
+        """If 'member' ends a run of fixed-width members, advance past the
+           whole run."""
+        if member.endsRun:
+            self.format("""
+                remaining -= {0}; ptr += {0};
+                """, member.runLength)
+
+    def dynarrayMacro(self, op):
+        """Return the name of the macro that we use to do 'op' (EXPAND or
+           ADD) to a dynamic array."""
+        if self.arena:
+            return "TRUNNEL_ARENA_DYNARRAY_%s(arena, " % op
+        return "TRUNNEL_DYNARRAY_%s(" % op
 
     def visitSMStruct(self, sms):
         # To generate code to parse a struture, delegate to parseStruct
+        #
+        # If the field is part of a run, parse it from its place in the
+        # run, giving it exactly the input it needs.
         self.eltHeader(sms)
-        self.w(self.parseStructInto(sms.structname, "obj->%s" %
-               (sms.c_name), sms.structDeclaration.contextList))
+        if sms.runOffset is None:
+            self.w(self.parseStructInto(sms.structname, "obj->%s" %
+                   (sms.c_name), sms.structDeclaration.contextList))
+            return
+        self.beginRun(sms)
+        size = sms.structDeclaration.encodedSize
+        self.w(self.parseStructInto(sms.structname, "obj->%s" % sms.c_name,
+                                    [], runPointer(sms), size))
+        self.format("""
+                trunnel_assert(result == {0});
+                """, size)
+        self.endRun(sms)
 
-    def parseStructInto(self, structtype, target_pointer, contextList):
+    def parseStructInto(self, structtype, target_pointer, contextList,
+                        ptr="ptr", length=None):
         """Generate code to parse a structure from the input into
-           structure pointer.
+           structure pointer.  If 'length' is given, parse exactly that
+           many bytes from 'ptr', and leave it to the caller to advance
+           past them.
         """
         # Recursively call the appropriate parse() function, and
         # see whether it gave us an error.  If not, adjust 'remaining'
         # and 'ptr' appropriately.
 
         args = formatContexts(contextList, declaration=False)
+        avail = "remaining" if length is None else length
+        if self.validateOnly:
+            call = "%s_validate(%s, %s%s)" % (structtype, ptr, avail, args)
+        elif self.arena:
+            call = "%s_parse_arena(&%s, %s, %s, arena%s)" % (
+                structtype, target_pointer, ptr, avail, args)
+        else:
+            call = "%s_parse(&%s, %s, %s%s)" % (
+                structtype, target_pointer, ptr, avail, args)
         self.needLabels.add(self.structFailLabel)
-        return self.format_s("""
-                result = {structtype}_parse(&{target}, ptr, remaining{args});
+        code = self.format_s("""
+                result = {call};
                 if (result < 0)
                   goto {fail};
+                """, call=call, fail=self.structFailLabel)
+        if length is not None:
+            return code
+        return code + self.format_s("""
                 trunnel_assert((size_t)result <= remaining);
                 remaining -= result; ptr += result;
-                """, structtype=structtype, target=target_pointer,
-                             fail=self.structFailLabel, args=args)
+                """)
 
     def visitSMFixedArray(self, sfa):
         # To parse a fixed array of non-struct, we can precompute its
@@ -2554,22 +3424,35 @@ class ParseFnGenerator(CodeGenerator):
         # (We assume that the compiler will catch it if we make any
         # fixed array too big to fit into a size_t.  Also, don't do that;
         # what kind of protocol are you implementing?)
+        #
+        # If the array is part of a run, we copy it from its place in the
+        # run, and leave the checking and advancing to the start and the
+        # end of the run.
 
         self.eltHeader(sfa)
         if type(sfa.basetype) != str:
-            self.needLabels.add(self.truncatedLabel)
             bytesPerElt = 1
             multiplier = ""
             if type(sfa.basetype) == trunnel.Grammar.IntType:
                 bytesPerElt = sfa.basetype.width // 8
                 if bytesPerElt > 1:
                     multiplier = "%s * " % bytesPerElt
-            self.format("""
+            inRun = sfa.runOffset is not None
+            if inRun:
+                self.beginRun(sfa)
+            elif not self.fixedSize:
+                self.needLabels.add(self.truncatedLabel)
+                self.format("""
                         CHECK_REMAINING({multiplier}{width}, {truncated});
-                        memcpy(obj->{c_name}, ptr, {multiplier}{width});
+                        """, multiplier=multiplier, width=sfa.width,
+                        truncated=self.truncatedLabel)
+            if not self.validateOnly:
+                self.format("""
+                        memcpy(obj->{c_name}, {ptr}, {multiplier}{width});
                         """, c_name=sfa.c_name, multiplier=multiplier,
-                        width=sfa.width, truncated=self.truncatedLabel)
-            if type(sfa.basetype) == trunnel.Grammar.IntType and sfa.basetype.width > 8:
+                            width=sfa.width, ptr=runPointer(sfa))
+            if (type(sfa.basetype) == trunnel.Grammar.IntType and
+                    sfa.basetype.width > 8 and not self.validateOnly):
                 self.format("""
                          {{
                            unsigned idx;
@@ -2578,8 +3461,11 @@ class ParseFnGenerator(CodeGenerator):
                          }}""", width=sfa.width, c_name=sfa.c_name,
                             ntoh=NTOH_FN[sfa.basetype.width])
 
-            self.format("remaining -= {0}{1}; ptr += {0}{1};", multiplier,
-                        sfa.width)
+            if inRun:
+                self.endRun(sfa)
+            else:
+                self.format("remaining -= {0}{1}; ptr += {0}{1};",
+                            multiplier, sfa.width)
             return
 
         else:
@@ -2634,39 +3520,74 @@ class ParseFnGenerator(CodeGenerator):
 
             self.needLabels.add(self.truncatedLabel)
 
-            if str(sva.basetype) == 'char':
+            if self.validateOnly:
+                pass
+
+            elif str(sva.basetype) == 'char' and self.arena:
+                self.needLabels.add('fail')
+                self.w(("if (trunnel_arena_string_setstr0(arena, &obj->%s, "
+                        "(const char*)ptr, %s))\n"
+                        "  goto fail;") % (sva.c_name, w))
+
+            elif str(sva.basetype) == 'char':
                 tp = "char"
                 self.needLabels.add('fail')
                 self.w(("if (%s_setstr0_%s(obj, (const char*)ptr, %s))\n"
                         "  goto fail;") % (self.structName, sva.c_fn_name, w))
 
+            elif sva.zeroCopy:
+                self.w('TRUNNEL_DYNARRAY_BORROW(&obj->%s, ptr, %s);\n' % (
+                    sva.c_name, w))
+
             else:
                 tp = "uint8_t"
                 self.needLabels.add('trunnel_alloc_failed')
                 self.format("""
-                    TRUNNEL_DYNARRAY_EXPAND({tp}, &obj->{c_name}, {w}, {{}});
+                    {expand}{tp}, &obj->{c_name}, {w}, {{}});
                     obj->{c_name}.n_ = {w};
                     if ({w})
                       memcpy({elt}, ptr, {w});
-                    """, w=w, elt=elt, tp=tp, c_name=sva.c_name)
+                    """, w=w, elt=elt, tp=tp, c_name=sva.c_name,
+                            expand=self.dynarrayMacro("EXPAND"))
 
             self.format('ptr += {w}; remaining -= {w};\n', w=w)
             return
 
-        else:
-            self.needLabels.add('trunnel_alloc_failed')
+        elif self.validateOnly and type(sva.basetype) != str:
+            # To validate an array of integers, we only need to know
+            # whether there is room for all of them.
+            nbytes = sva.basetype.width // 8
+            if sva.widthfield is not None:
+                self.needLabels.add(self.truncatedLabel)
+                self.format("""
+                    if (remaining / {nbytes} < {w})
+                      goto {truncated};
+                    remaining -= {nbytes} * (size_t){w}; ptr += {nbytes} * (size_t){w};
+                    """, nbytes=nbytes, w=w, truncated=self.truncatedLabel)
+            else:
+                self.needLabels.add('fail')
+                self.format("""
+                    if (remaining % {nbytes})
+                      goto fail;
+                    ptr += remaining; remaining = 0;
+                    """, nbytes=nbytes)
 
+        else:
             if type(sva.basetype) == str:
                 elttype = "%s_t *" % sva.basetype
             else:
                 elttype = "uint%d_t" % sva.basetype.width
 
-            if sva.widthfield is not None:
-                self.w('TRUNNEL_DYNARRAY_EXPAND(%s, &obj->%s, %s, {});\n'
-                       % (elttype, sva.c_name, w))
-
-            self.w('{\n'
-                   '  %s elt;\n' % (elttype))
+            if self.validateOnly:
+                self.w('{\n')
+            else:
+                self.needLabels.add('trunnel_alloc_failed')
+                if sva.widthfield is not None:
+                    self.w('%s%s, &obj->%s, %s, {});\n'
+                           % (self.dynarrayMacro("EXPAND"), elttype,
+                              sva.c_name, w))
+                self.w('{\n'
+                       '  %s elt;\n' % (elttype))
             if sva.widthfield is not None:
                 self.w('  unsigned idx;\n')
                 self.w('  for (idx = 0; idx < %s; ++idx) {\n' % w)
@@ -2687,12 +3608,16 @@ class ParseFnGenerator(CodeGenerator):
                 self.w(self.parseStructInto(
                     sva.basetype, "elt", sva.structDeclaration.contextList))
                 on_fail = "{%s_free(elt);}" % sva.basetype
+                if self.arena:
+                    on_fail = "{}"
             else:
                 self.parseInteger(sva.basetype.width, "elt")
                 on_fail = "{}"
 
-            self.w("TRUNNEL_DYNARRAY_ADD(%s, &obj->%s, elt, %s);" %
-                   (elttype, sva.c_name, on_fail))
+            if not self.validateOnly:
+                self.w("%s%s, &obj->%s, elt, %s);" %
+                       (self.dynarrayMacro("ADD"), elttype, sva.c_name,
+                        on_fail))
 
             self.popIndent(2)
             self.w('}\n')
@@ -2708,9 +3633,37 @@ class ParseFnGenerator(CodeGenerator):
         # NUL in the input.  If there is no NUL, we're truncated.  We assert
         # that we're not about to overflow size_t by allocating too much,
         # and then use malloc and memcpy to grab the nul-terminated string.
-        # finally, we advance the remaining and ptr variables.
+        # finally, we advance the remaining and ptr variables.  In
+        # zero_copy mode, we point into the input instead of copying it.
+        # (When parsing into an arena, we allocate from the arena.)
         self.eltHeader(ss)
         self.needLabels.add(self.truncatedLabel)
+        if self.validateOnly:
+            self.format("""
+                {{
+                  const uint8_t *eos = (const uint8_t*)memchr(ptr, 0, remaining);
+                  size_t memlen;
+                  if (eos == NULL)
+                    goto {truncated};
+                  trunnel_assert(eos >= ptr);
+                  memlen = ((size_t)(eos - ptr)) + 1;
+                  remaining -= memlen; ptr += memlen;
+                }}""", truncated=self.truncatedLabel)
+            return
+        if ss.zeroCopy:
+            self.format("""
+                {{
+                  uint8_t *eos = (uint8_t*)memchr(ptr, 0, remaining);
+                  size_t memlen;
+                  if (eos == NULL)
+                    goto {truncated};
+                  trunnel_assert(eos >= ptr);
+                  memlen = ((size_t)(eos - ptr)) + 1;
+                  obj->{c_name} = (char *)ptr;
+                  obj->{c_name}_borrowed_ = 1;
+                  remaining -= memlen; ptr += memlen;
+                }}""", c_name=ss.c_name, truncated=self.truncatedLabel)
+            return
         self.needLabels.add('fail')
         self.format("""
                 {{
@@ -2721,14 +3674,17 @@ class ParseFnGenerator(CodeGenerator):
                   trunnel_assert(eos >= ptr);
                   trunnel_assert((size_t)(eos - ptr) < SIZE_MAX - 1);
                   memlen = ((size_t)(eos - ptr)) + 1;
-                  if (!(obj->{c_name} = trunnel_malloc(memlen)))
+                  if (!(obj->{c_name} = {alloc}))
                     goto fail;
                   memcpy(obj->{c_name}, ptr, memlen);
                   remaining -= memlen; ptr += memlen;
-                }}""", c_name=ss.c_name, truncated=self.truncatedLabel)
+                }}""", c_name=ss.c_name, truncated=self.truncatedLabel,
+                    alloc=("trunnel_arena_alloc(arena, memlen)" if self.arena
+                           else "trunnel_malloc(memlen)"))
 
     def visitSMPosition(self, smp):
-        self.format("obj->{c_name} = ptr;", c_name=smp.c_name);
+        if not self.validateOnly:
+            self.format("obj->{c_name} = ptr;", c_name=smp.c_name);
 
     def visitSMLenConstrained(self, sml):
         # To parse a length-constrained region, make sure that at
@@ -2820,6 +3776,50 @@ class ParseFnGenerator(CodeGenerator):
         self.w('/* Skip to end of union */\n')
         self.w('ptr += remaining; remaining = 0;\n')
 
+
+class ArenaParseFnGenerator(ParseFnGenerator):
+
+    """Code-generating visitor that generates the 'typename_parse_arena()'
+       and 'typename_parse_into_arena()' functions for a structure in a
+       file that uses the 'arena' option.
+
+       These behave as typename_parse() and typename_parse_into(), except
+       that they allocate the new object, and everything inside it, from
+       the trunnel_arena_t that they are given: nested structures are
+       parsed with their own typename_parse_arena() functions.  Nothing
+       that they allocate is ever freed on its own; it all goes away when
+       the arena is reset or destroyed.  On failure, whatever they
+       allocated stays in the arena until then.
+    """
+
+    def __init__(self, writefn):
+        ParseFnGenerator.__init__(self, writefn)
+        self.arena = True
+
+
+class ValidateFnGenerator(ParseFnGenerator):
+
+    """Code-generating visitor that generates the 'typename_validate()'
+       function for a given structure.
+
+       The typename_validate(const uint8_t *, size_t) function checks
+       whether its input begins with a valid encoded typename, without
+       allocating anything.  It makes the same checks as typename_parse(),
+       and returns the same values: the number of bytes that a typename
+       would use, -2 if the input appears truncated, and -1 if it is
+       otherwise invalid.  (The only difference is that it can't run out
+       of memory.)
+
+       The generated function is the same as typename_parse_into(),
+       except that it keeps its integer fields in an object on the stack,
+       skips over everything else without storing it, and recursively
+       calls the validate functions for nested structures.
+    """
+
+    def __init__(self, writefn):
+        ParseFnGenerator.__init__(self, writefn)
+        self.validateOnly = True
+
 HEADER_BOILERPLATE = """\
 /* %(h_fname)s -- generated by Trunnel v%(version)s.
  * https://gitweb.torproject.org/trunnel.git
@@ -2872,62 +3872,520 @@ int %(csafe_fname)s_deadcode_dummy__ = 0;
 """
 
 
-def generate_code(input_fname, extra_options=[], target_dir=None):
-    """Read a trunnel file from 'input_fname' and write the result to
-       appropriate output files.  If 'extra_options' is set, add those
-       options as though they had been specified in the file with
-       "trunnel options ..."
+# Used to make names for AtomicFile's temporary files.
+_tmpfileCounter = itertools.count()
+
+
+class AtomicFile(object):
+
+    """A file opened for writing that nobody else can see until we close
+       it.  We write to a temporary file in the same directory, and rename
+       it over the real one when we're done.  Use it in a 'with' block: if
+       the block raises an exception, we throw the temporary file away.
+
+       If 'only_if_changed' is true, and the real file already holds
+       exactly what we wrote, leave it alone (and keep its mtime).
     """
+    #
+    # changed -- after we're done: true iff we replaced the real file.
+
+    def __init__(self, fname, only_if_changed=False):
+        self.fname = fname
+        self.tmpname = "%s.tmp-%d-%d" % (fname, os.getpid(),
+                                         next(_tmpfileCounter))
+        self.only_if_changed = only_if_changed
+        self.changed = False
+        self.f = open(self.tmpname, 'w')
+        self.write = self.f.write
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.f.close()
+        if exc_type is None and not (
+                self.only_if_changed and os.path.exists(self.fname) and
+                filecmp.cmp(self.tmpname, self.fname, shallow=False)):
+            os.replace(self.tmpname, self.fname)
+            self.changed = True
+        else:
+            os.unlink(self.tmpname)
+
+
+def output_fnames(input_fname, target_dir=None):
+    """Return a tuple of the names of the .c and .h files that we generate
+       from the trunnel file 'input_fname'."""
     basename = input_fname
     if basename.endswith(".trunnel"):
         basename = basename[:-len(".trunnel")]
     if target_dir != None:
         basename = os.path.join(target_dir, os.path.split(basename)[1])
+    return (basename + ".c", basename + ".h")
+
+
+class Compiler(object):
+
+    """Generates code for any number of trunnel files, sharing a single
+       lexer and parser among them.  Setting up a parser costs more than
+       parsing most input files, so use one of these if you have many
+       files to compile.
+    """
+    #
+    # extra_options, target_dir, incremental -- as for generate_code.
+    # profiler -- a trunnel.Profile.Profiler to record where we spend our
+    #    time, or None.
+    # struct_jobs -- the number of processes to use when generating code
+    #    for the structures in each file.  We only use more than one if
+    #    we aren't profiling.
+    # lexer -- a trunnel.Grammar.Lexer.
+    # parser -- a parser from trunnel.Grammar.getParser.
+    # interfaces -- a trunnel.Interface.InterfaceLoader, to find the files
+    #    that our input files import.
+    # manifests -- a map from output directory to the trunnel.Manifest
+    #    we loaded for it.  We reload a manifest if anybody saves it,
+    #    including finish().
+    # manifest_updates -- a list of (directory, name, entry) tuples for
+    #    trunnel.Manifest.recordAll, describing what we have generated
+    #    since the last time we called finish().
+
+    def __init__(self, extra_options=(), target_dir=None,
+                 parser_engine="earley", incremental=False, profiler=None,
+                 struct_jobs=1):
+        self.extra_options = list(extra_options)
+        self.target_dir = target_dir
+        self.incremental = incremental
+        self.profiler = profiler
+        self.struct_jobs = struct_jobs
+        self.lexer = trunnel.Grammar.Lexer()
+        self.parser = trunnel.Grammar.getParser(parser_engine)
+        self.interfaces = trunnel.Interface.InterfaceLoader(self.lexer,
+                                                            self.parser)
+        self.manifests = {}
+        self.manifest_updates = []
+
+    def compile(self, input_fname):
+        """Read a trunnel file from 'input_fname' and write the result to
+           appropriate output files, as generate_code does.  Return a list
+           of (phase, seconds) tuples, saying how long we spent parsing,
+           checking, and generating code.  In incremental mode, if the
+           manifest says the output is up to date, just return
+           [("up-to-date", seconds)].
+        """
+        t0 = time.time()
+        c_fname, h_fname = output_fnames(input_fname, self.target_dir)
+        basename = c_fname[:-len(".c")]
+
+        inp = open(input_fname, 'r')
+        text = inp.read()
+        inp.close()
+
+        if self.incremental:
+            outdir, name = os.path.split(basename)
+            outdir = outdir or "."
+            key = trunnel.Manifest.inputDigest(text, self.extra_options)
+            manifest = self.manifests.get(outdir)
+            if manifest is None or manifest.changedOnDisk():
+                manifest = trunnel.Manifest.Manifest(outdir)
+                self.manifests[outdir] = manifest
+            if manifest.isCurrent(name, key) and \
+                    self.interfaces.isCurrent(manifest.importsOf(name)):
+                return [("up-to-date", time.time() - t0)]
+
+        t1 = time.time()
+        h_text, c_text, timings = self._generate(
+            text, os.path.split(basename)[1], input_fname,
+            os.path.dirname(input_fname))
+        t2 = time.time()
+
+        with self._profiler().phase("write"):
+            with AtomicFile(h_fname, self.incremental) as out_h:
+                out_h.write(h_text)
+            with AtomicFile(c_fname, self.incremental) as out_c:
+                out_c.write(c_text)
+
+        if self.incremental:
+            outputs = [os.path.split(fn)[1] for fn in (c_fname, h_fname)]
+            iface = self.interfaces.byKey[
+                trunnel.Interface.interfaceKey(
+                    text, os.path.dirname(input_fname))]
+            entry = trunnel.Manifest.makeEntry(input_fname, key, outdir,
+                                               outputs, iface.imports)
+            self.manifest_updates.append((outdir, name, entry))
+
+        # Count reading and writing files as part of parsing and
+        # generating, respectively.
+        (_, t_parse), check, (_, t_generate) = timings
+        return [("parse", t1 - t0 + t_parse), check,
+                ("generate", t_generate + time.time() - t2)]
+
+    def compile_string(self, text, basename="trunnel", import_dir=""):
+        """Generate code from the trunnel source in 'text', without
+           writing any files, and return a tuple of the contents of the
+           header file and the C file.  Generate them as though they
+           were going to be called 'basename'.h and 'basename'.c.  Look
+           for any files that 'text' imports relative to 'import_dir'.
+        """
+        h_text, c_text, _ = self._generate(text, basename, "<string>",
+                                           import_dir)
+        return h_text, c_text
+
+    def check(self, input_fname):
+        """Read a trunnel file from 'input_fname', and parse and check it
+           as compile does, but don't generate any code or write anything.
+           Raise an exception if the file is invalid.  Otherwise, return a
+           list of (phase, seconds) tuples, saying how long we spent
+           parsing and checking.
+        """
+        t0 = time.time()
+        with open(input_fname, 'r') as inp:
+            text = inp.read()
+        t1 = time.time()
+        _, _, timings = self._analyze(text, input_fname,
+                                      os.path.dirname(input_fname))
+        (_, t_parse), check = timings
+        return [("parse", t1 - t0 + t_parse), check]
+
+    def _profiler(self):
+        if self.profiler is None:
+            return _NullProfiler()
+        return self.profiler
+
+    def _analyze(self, text, input_name, import_dir):
+        """Helper for check and _generate: parse, check, and annotate the
+           trunnel source in 'text'.  Return a tuple of the annotated
+           File, the Checker we used on it, and a list of (phase, seconds)
+           tuples for parsing and checking.  'input_name' names the input,
+           for the profiler.  Look for imported files relative to
+           'import_dir'."""
+        t0 = time.time()
+        profiler = self._profiler()
+        profiler.beginFile(input_name)
+
+        tokens = self.lexer.itertokens(text)
+        if self.profiler is not None:
+            # Lex everything up front, so we can tell lexing and parsing
+            # apart.
+            with profiler.phase("lex"):
+                tokens = list(tokens)
+        with profiler.phase("parse"):
+            parsed = self.parser.parse(tokens)
+        parsed.options.extend(self.extra_options)
+        t1 = time.time()
+
+        with profiler.phase("imports"):
+            self.interfaces.resolve(parsed, import_dir, self.target_dir)
+
+        c = Checker()
+        with profiler.phase("check"):
+            c.visit(parsed)
+
+        with profiler.phase("annotate"):
+            Annotator(c.constValues).visit(parsed)
+            self.interfaces.remember(trunnel.Interface.makeInterface(
+                parsed, c, trunnel.Interface.interfaceKey(text, import_dir)))
+        t2 = time.time()
+
+        return parsed, c, [("parse", t1 - t0), ("check", t2 - t1)]
+
+    def _generate(self, text, basename, input_name, import_dir):
+        """Helper for compile and compile_string: return a tuple of the
+           header text, the C text, and a list of (phase, seconds) tuples
+           as for compile.  'input_name' and 'import_dir' are as for
+           _analyze."""
+        h_fname = basename + ".h"
+        c_fname = basename + ".c"
+        csafe_fname = re.sub(r'[^a-zA-Z]', '', basename)
+
+        parsed, c, timings = self._analyze(text, input_name, import_dir)
+        profiler = self._profiler()
+        t2 = time.time()
+
+        chunks = [None] * 4
+        if (self.struct_jobs > 1 and self.profiler is None and
+                len(c.sortedStructs) > 1):
+            chunks = generateStructChunksInParallel(
+                parsed, c.sortedStructs, self.struct_jobs)
+        decl_chunks, proto_chunks, c_decl_chunks, code_chunks = chunks
+
+        guard_macro = "TRUNNEL_" + h_fname.upper().replace(".", "_")
+        expose_definitions = []
+        if "opaque" in parsed.options:
+            for n in c.sortedStructs:
+                expose_definitions.append(
+                    "#define TRUNNEL_EXPOSE_%s_\n" % (n.upper()))
+        boilerplate_vars = {
+            'guard_macro': guard_macro,
+            'h_fname': h_fname,
+            'c_fname': c_fname,
+            'csafe_fname': csafe_fname,
+            'expose_definitions': "".join(expose_definitions),
+            'version': trunnel.__version__
+        }
+
+        h_buf = io.StringIO()
+        out_h = profiler.counted(h_buf)
+        out_h.write(HEADER_BOILERPLATE % boilerplate_vars)
+        with profiler.phase("declarations"):
+            DeclarationGenerationVisitor(
+                c.sortedStructs, out_h, chunks=decl_chunks).visit(parsed)
+        with profiler.phase("prototypes"):
+            PrototypeGenerationVisitor(
+                c.sortedStructs, out_h, chunks=proto_chunks).visit(parsed)
+        out_h.write(HEADER_FOOTER)
+
+        c_buf = io.StringIO()
+        out_c = profiler.counted(c_buf)
+        out_c.write(MODULE_BOILERPLATE % boilerplate_vars)
+        if "very_opaque" in parsed.options:
+            with profiler.phase("declarations (in .c)"):
+                DeclarationGenerationVisitor(
+                    c.sortedStructs, out_c, inCFile=True,
+                    chunks=c_decl_chunks).visit(parsed)
+        with profiler.phase("code"):
+            CodeGenerationVisitor(c.sortedStructs, out_c, self.profiler,
+                                  chunks=code_chunks).visit(parsed)
+        t3 = time.time()
+
+        return (h_buf.getvalue(), c_buf.getvalue(),
+                timings + [("generate", t3 - t2)])
+
+    def finish(self):
+        """Save any changes to the manifests for the files we've compiled."""
+        for outdir in trunnel.Manifest.recordAll(self.manifest_updates):
+            self.manifests.pop(outdir, None)
+        self.manifest_updates = []
+
+
+class _NullProfiler(object):
+
+    """Stands in for a trunnel.Profile.Profiler when we aren't profiling."""
 
-    c_fname = basename + ".c"
-    h_fname = basename + ".h"
-    csafe_fname = re.sub(r'[^a-zA-Z]', '', os.path.split(basename)[1])
-
-    inp = open(input_fname, 'r')
-    t = trunnel.Grammar.Lexer().tokenize(inp.read())
-    inp.close()
-    parsed = trunnel.Grammar.Parser().parse(t)
-    parsed.options.extend(extra_options)
-    c = Checker()
-    c.visit(parsed)
-
-    Annotator().visit(parsed)
-
-    guard_macro = "TRUNNEL_" + \
-        os.path.split(h_fname)[1].upper().replace(".", "_")
-    expose_definitions = []
-    if "opaque" in parsed.options:
-        for n in c.sortedStructs:
-            expose_definitions.append(
-                "#define TRUNNEL_EXPOSE_%s_\n" % (n.upper()))
-    boilerplate_vars = {
-        'guard_macro': guard_macro,
-        'h_fname': os.path.split(h_fname)[1],
-        'c_fname': os.path.split(c_fname)[1],
-        'csafe_fname': csafe_fname,
-        'expose_definitions': "".join(expose_definitions),
-        'version': trunnel.__version__
-    }
-
-    out_h = open(h_fname, 'w')
-    out_h.write(HEADER_BOILERPLATE % boilerplate_vars)
-    DeclarationGenerationVisitor(c.sortedStructs, out_h).visit(parsed)
-    PrototypeGenerationVisitor(c.sortedStructs, out_h).visit(parsed)
-    out_h.write(HEADER_FOOTER)
-    out_h.close()
-
-    out_c = open(c_fname, 'w')
-    out_c.write(MODULE_BOILERPLATE % boilerplate_vars)
-    if "very_opaque" in parsed.options:
-        DeclarationGenerationVisitor(
-            c.sortedStructs, out_c, inCFile=True).visit(parsed)
-    CodeGenerationVisitor(c.sortedStructs, out_c).visit(parsed)
-    out_c.close()
+    def beginFile(self, input_fname):
+        pass
+
+    def counted(self, f):
+        return f
+
+    def phase(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+def generateStructChunks(parsed, names):
+    """Generate the code for each structure in 'names', from the checked
+       and annotated File 'parsed'.  Return a list with a tuple for each
+       structure, holding what DeclarationGenerationVisitor,
+       PrototypeGenerationVisitor, DeclarationGenerationVisitor with
+       inCFile set, and CodeGenerationVisitor would write for it.  (The
+       third item is None unless the file is very_opaque.)
+
+       The code for each structure doesn't depend on any other
+       structure's code, so we can do this in several processes at once.
+    """
+    veryOpaque = "very_opaque" in parsed.options
+    results = []
+    for name in names:
+        sd = parsed.declarationsByName[name]
+        decl, proto, c_decl, code = [io.StringIO() for _ in range(4)]
+
+        v = DeclarationGenerationVisitor(names, decl)
+        v.setOptions(parsed.options)
+        v.visit(sd)
+        v = PrototypeGenerationVisitor(names, proto)
+        v.setOptions(parsed.options)
+        v.visit(sd)
+        if veryOpaque:
+            v = DeclarationGenerationVisitor(names, c_decl, inCFile=True)
+            v.setOptions(parsed.options)
+            v.visit(sd)
+        CodeGenerationVisitor(names, code).visit(sd)
+
+        results.append((decl.getvalue(), proto.getvalue(),
+                        c_decl.getvalue() if veryOpaque else None,
+                        code.getvalue()))
+    return results
+
+# A map from (extra_options, parser_engine) to the Compiler that
+# compile_string uses for them.
+_stringCompilers = {}
+
+
+def compile_string(source, options=(), basename="trunnel",
+                   parser_engine="earley", import_dir=""):
+    """Generate code from the trunnel source in 'source', with the extra
+       options in 'options', and return a tuple of the text of the header
+       file and the C file, as they would be called 'basename'.h and
+       'basename'.c.  Don't write any files.  If 'source' imports other
+       trunnel files, look for them relative to 'import_dir' (by default,
+       the current directory).
+
+       We keep the parser around between calls, so calling this many
+       times is cheap.  Don't call it from more than one thread at once.
+    """
+    key = (tuple(options), parser_engine)
+    compiler = _stringCompilers.get(key)
+    if compiler is None:
+        compiler = _stringCompilers[key] = Compiler(
+            options, parser_engine=parser_engine)
+    return compiler.compile_string(source, basename, import_dir)
+
+
+def generate_code(input_fname, extra_options=[], target_dir=None,
+                  parser_engine="earley", incremental=False, struct_jobs=1):
+    """Read a trunnel file from 'input_fname' and write the result to
+       appropriate output files.  If 'extra_options' is set, add those
+       options as though they had been specified in the file with
+       "trunnel options ...".  'parser_engine' selects a parser; see
+       trunnel.Grammar.getParser.
+
+       If 'incremental' is true, don't regenerate output that the
+       manifest in the output directory says is up to date, and don't
+       replace output files whose contents would not change.  See
+       trunnel.Manifest.
+
+       If 'struct_jobs' is more than 1, generate the code for the
+       structures in the file with that many worker processes.  The
+       output is the same either way.
+    """
+    compiler = Compiler(extra_options, target_dir, parser_engine,
+                        incremental, struct_jobs=struct_jobs)
+    compiler.compile(input_fname)
+    compiler.finish()
+
+
+def generate_code_batch(input_fnames, extra_options=[], target_dir=None,
+                        parser_engine="earley", jobs=1, incremental=False,
+                        check_only=False):
+    """As generate_code, but for every file in 'input_fnames'.  Unlike
+       generate_code, keep going when a file can't be compiled.  If
+       'check_only' is true, only check the files, with Compiler.check.
+
+       If 'jobs' is 1, compile the files one after another with a single
+       Compiler.  Otherwise, spread them over a pool of 'jobs' worker
+       processes, each with its own Compiler.  (The output is the same
+       either way.)
+
+       Return a tuple of the seconds we spent setting up, and a list of
+       (input_fname, timings, error) tuples, one for each file, in the
+       same order as 'input_fnames'.  'timings' is as returned by
+       Compiler.compile or Compiler.check, or None if we failed; 'error'
+       is None, or the exception that made us fail.
+    """
+    t0 = time.time()
+    if jobs == 1:
+        compiler = Compiler(extra_options, target_dir, parser_engine,
+                            incremental)
+        setup_time = time.time() - t0
+        results = [_compileOne(compiler, fname, check_only)
+                   for fname in input_fnames]
+        compiler.finish()
+        return setup_time, results
+
+    pool = multiprocessing.Pool(jobs, _initWorker,
+                                (extra_options, target_dir, parser_engine,
+                                 incremental, check_only))
+    setup_time = time.time() - t0
+    try:
+        worker_results = pool.map(_compileInWorker, input_fnames,
+                                  chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Only this process writes the manifests, so the workers can't
+    # clobber one another's changes.
+    results = []
+    updates = []
+    for fname, timings, err, manifest_updates in worker_results:
+        results.append((fname, timings, err))
+        updates.extend(manifest_updates)
+    trunnel.Manifest.recordAll(updates)
+    return setup_time, results
+
+
+def _compileOne(compiler, fname, check_only=False):
+    """Helper for generate_code_batch: compile 'fname' with 'compiler'
+       (or just check it, if 'check_only' is true), and return an
+       (input_fname, timings, error) tuple."""
+    try:
+        if check_only:
+            return (fname, compiler.check(fname), None)
+        return (fname, compiler.compile(fname), None)
+    except Exception as e:
+        return (fname, None, e)
+
+# In a worker process for generate_code_batch, the Compiler to use, and
+# whether we're only checking files.
+_workerCompiler = None
+_workerCheckOnly = False
+
+
+def _initWorker(extra_options, target_dir, parser_engine, incremental,
+                check_only):
+    global _workerCompiler, _workerCheckOnly
+    _workerCompiler = Compiler(extra_options, target_dir, parser_engine,
+                               incremental)
+    _workerCheckOnly = check_only
+
+
+def _compileInWorker(fname):
+    """As _compileOne, but also return (and forget) the manifest updates
+       for the file we compiled."""
+    fname, timings, err = _compileOne(_workerCompiler, fname,
+                                      _workerCheckOnly)
+    if err is not None:
+        try:
+            pickle.dumps(err)
+        except Exception:
+            # We have to send this back to the parent process somehow.
+            err = Exception(str(err))
+    updates = _workerCompiler.manifest_updates
+    _workerCompiler.manifest_updates = []
+    return (fname, timings, err, updates)
+
+
+def generateStructChunksInParallel(parsed, names, jobs):
+    """As generateStructChunks, but spread the work over a pool of 'jobs'
+       worker processes.  Return a list of four maps, one for each item
+       in generateStructChunks' tuples, from structure name to its code.
+       (The third is None unless the file is very_opaque.)"""
+    # Use a few pieces for each worker, so that one slow piece doesn't
+    # hold everybody up.
+    size = max(1, -(-len(names) // (jobs * 4)))
+    pieces = [names[i:i + size] for i in range(0, len(names), size)]
+    pool = multiprocessing.Pool(jobs, _initStructWorker, (parsed,))
+    try:
+        pieceResults = pool.map(_generateStructsInWorker, pieces)
+    finally:
+        pool.close()
+        pool.join()
+
+    chunks = [{}, {}, {}, {}]
+    for piece, results in zip(pieces, pieceResults):
+        for name, texts in zip(piece, results):
+            for m, text in zip(chunks, texts):
+                m[name] = text
+    if "very_opaque" not in parsed.options:
+        chunks[2] = None
+    return chunks
+
+# In a worker process for generateStructChunksInParallel, the File we're
+# generating code for.
+_workerFile = None
+
+
+def _initStructWorker(parsed):
+    global _workerFile
+    _workerFile = parsed
+
+
+def _generateStructsInWorker(names):
+    return generateStructChunks(_workerFile, names)
 
 __license__ = """
 Copyright 2014  The Tor Project, Inc.
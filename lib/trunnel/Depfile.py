@@ -0,0 +1,108 @@
+# Depfile.py -- dependency files for make and ninja.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Write Makefile-style dependency files, so that a build system knows
+   exactly which files each piece of trunnel output depends on.
+"""
+
+import os
+
+import trunnel.Boilerplate
+import trunnel.CodeGen
+import trunnel.Grammar
+import trunnel.Interface
+
+
+def generatorFiles():
+    """Return a sorted list of the files that make up trunnel itself: the
+       modules in the trunnel package, and the templates in trunnel/data."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    datadir = os.path.join(directory, "data")
+    result = [os.path.join(directory, fname)
+              for fname in os.listdir(directory) if fname.endswith(".py")]
+    result.extend(os.path.join(datadir, fname)
+                  for fname in trunnel.Boilerplate.FILES)
+    return sorted(result)
+
+
+def escape(fname):
+    """Return 'fname', quoted for use as a target or prerequisite in a
+       Makefile rule."""
+    out = []
+    for ch in fname:
+        if ch == '$':
+            out.append('$$')
+        elif ch in ' #':
+            out.append('\\' + ch)
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def makeRules(input_fnames, target_dir=None, write_c_files=False):
+    """Return a list of (targets, prerequisites) tuples, one for every
+       pair of output files that we generate from 'input_fnames', and one
+       for the support files if 'write_c_files' is true.  The output for
+       each input file also depends on every file that it imports."""
+    common = generatorFiles()
+    interfaces = trunnel.Interface.InterfaceLoader(
+        trunnel.Grammar.Lexer(), trunnel.Grammar.getParser("rd"))
+    rules = []
+    for fname in input_fnames:
+        targets = list(trunnel.CodeGen.output_fnames(fname, target_dir))
+        imported = trunnel.Interface.importedFiles(interfaces, [fname])
+        rules.append((targets, [fname] + imported + common))
+    if write_c_files:
+        targets = [os.path.join(target_dir or ".", fname)
+                   for fname in trunnel.Boilerplate.FILES]
+        rules.append((targets, common))
+    return rules
+
+
+def write_depfile(depfile, input_fnames, target_dir=None,
+                  write_c_files=False, only_if_changed=False):
+    """Write a dependency file to 'depfile', saying which files the output
+       for 'input_fnames' depends on.  The arguments are as for
+       trunnel.CodeGen.generate_code_batch and trunnel.Boilerplate.emit.
+    """
+    with trunnel.CodeGen.AtomicFile(depfile, only_if_changed) as out:
+        for targets, prereqs in makeRules(input_fnames, target_dir,
+                                          write_c_files):
+            out.write("%s:" % " ".join(escape(t) for t in targets))
+            for p in prereqs:
+                out.write(" \\\n  %s" % escape(p))
+            out.write("\n")
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
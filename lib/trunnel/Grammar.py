@@ -10,6 +10,11 @@
 
 """
 
+import pickle
+import re
+import sys
+
+import trunnel.Cache
 import trunnel.spark
 pattern = trunnel.spark.pattern
 rule = trunnel.spark.rule
@@ -27,6 +32,9 @@ class Token(object):
     """Base class for tokens. The 'type' is a string that represents the
        type of the string; the token appears on 'lineno'.
     """
+    # We make a great many tokens, so we use __slots__ for them, and for
+    # the AST types below.
+    __slots__ = ("type", "lineno")
 
     def __init__(self, type, lineno):
         self.type = type
@@ -39,6 +47,7 @@ class Token(object):
 class Identifier(Token):
 
     """A non-const C identifier"""
+    __slots__ = ("value",)
 
     def __init__(self, value, lineno):
         Token.__init__(self, "ID", lineno)
@@ -51,6 +60,7 @@ class Identifier(Token):
 class ConstIdentifier(Token):
 
     """A const C identifier"""
+    __slots__ = ("value",)
 
     def __init__(self, value, lineno):
         Token.__init__(self, "CONST_ID", lineno)
@@ -63,15 +73,31 @@ class ConstIdentifier(Token):
 class IntLiteral(Token):
 
     """An integer literal"""
+    __slots__ = ("value",)
 
     def __init__(self, value, lineno):
         Token.__init__(self, "INT", lineno)
         self.value = int(value, 0)
 
 
+class StringLiteral(Token):
+
+    """A string literal, in double quotes.  'value' holds the string
+       without its quotes."""
+    __slots__ = ("value",)
+
+    def __init__(self, value, lineno):
+        Token.__init__(self, "STRING", lineno)
+        self.value = value[1:-1]
+
+    def __str__(self):
+        return self.value
+
+
 class Annotation(Token):
 
     """A doxygen-style comment."""
+    __slots__ = ("value",)
 
     def __init__(self, value, lineno):
         Token.__init__(self, "ANNOTATION", lineno)
@@ -88,6 +114,16 @@ KEYWORDS = set("""
 """.split())
 
 
+def idToken(s, lineno):
+    """Return a token for the identifier or keyword 's'."""
+    if s in KEYWORDS:
+        return Token(s, lineno)
+    elif s.isupper():
+        return ConstIdentifier(s, lineno)
+    else:
+        return Identifier(s, lineno)
+
+
 #
 #
 # Lexer
@@ -100,18 +136,67 @@ class Lexer(trunnel.spark.GenericScanner, object):
     """Scanner class based on trunnel.spark.GenericScanner.  Its job is to turn
        a string into a list of Token.
 
-       Note that spark does most of the work for us here: under the
+       Note that spark does much of the work for us here: under the
        hood, it builds a big regex out of all the @pattern decorations
-       for the t_* methods, and uses that to do the scanning and
-       decide which function to invoke.
-
+       for the t_* methods.  We do the scanning ourselves, though, in
+       itertokens(): the t_* method for each match tells us which
+       token to generate.
     """
 
+    # Groups in our regex that never produce tokens.
+    SKIP_GROUPS = frozenset(["space", "newline", "comment1", "comment2"])
+
     def tokenize(self, input):
-        self.rv = []
-        self.lineno = 1
-        trunnel.spark.GenericScanner.tokenize(self, input)
-        return self.rv
+        return list(self.itertokens(input))
+
+    def streamRE(self):
+        """Return a regex that matches any amount of whitespace and
+           comments, followed by a single token (or the end of the input).
+           The token's group has the same name as in spark's regex."""
+        if getattr(self, "_streamRE", None) is None:
+            names = sorted(self.re.groupindex, key=self.re.groupindex.get)
+            skip = ["(?:%s)" % getattr(self, "t_" + name).pattern
+                    for name in names if name in self.SKIP_GROUPS]
+            toks = ["(?P<%s>%s)" % (name, getattr(self, "t_" + name).pattern)
+                    for name in names if name not in self.SKIP_GROUPS]
+            # Nothing that can follow the skipped part can also start it,
+            # so the greedy match for that part never needs to backtrack.
+            pat = "(?:%s)*(?:%s|(?P<end>\\Z))" % ("|".join(skip),
+                                                  "|".join(toks))
+            self._streamRE = re.compile(pat, re.VERBOSE)
+        return self._streamRE
+
+    def itertokens(self, input):
+        """Yield the tokens in 'input' one at a time.
+
+           Rather than having spark try every group in the regex after
+           each match, we dispatch on the name of the group that matched,
+           and build the token directly if it's in TOKEN_MAKERS.  We never
+           see whitespace or comments (see streamRE): instead, we count
+           the newlines between the start of each token and the start of
+           the one before it.
+        """
+        self.rv = rv = []
+        self.lineno = lineno = 1
+        makers = self.TOKEN_MAKERS
+        count = input.count
+        pos = 0
+
+        for m in self.streamRE().finditer(input):
+            kind = m.lastgroup
+            if kind == "end":
+                break
+            start = m.start(kind)
+            lineno += count("\n", pos, start)
+            pos = start
+            if kind in makers:
+                yield makers[kind](m.group(kind), lineno)
+                continue
+            self.lineno = lineno
+            getattr(self, "t_" + kind)(m.group(kind))
+            for tok in rv:
+                yield tok
+            del rv[:]
 
     @pattern(r"(?:[;{}@\[\]\-=,:]|\.\.\.|\.\.|\.)")
     def t_punctuation(self, s):
@@ -119,17 +204,16 @@ class Lexer(trunnel.spark.GenericScanner, object):
 
     @pattern(r"[a-zA-Z_][a-zA-Z_0-9]*")
     def t_id(self, s):
-        if s in KEYWORDS:
-            self.rv.append(Token(s, self.lineno))
-        elif s.isupper():
-            self.rv.append(ConstIdentifier(s, self.lineno))
-        else:
-            self.rv.append(Identifier(s, self.lineno))
+        self.rv.append(idToken(s, self.lineno))
 
     @pattern(r"0x[0-9a-fA-F]+ | [0-9]+ ")
     def t_int(self, s):
         self.rv.append(IntLiteral(s, self.lineno))
 
+    @pattern(r'"[^"\n]*"')
+    def t_string(self, s):
+        self.rv.append(StringLiteral(s, self.lineno))
+
     @pattern(r"[ \t]+")
     def t_space(self, s):
         pass
@@ -155,6 +239,17 @@ class Lexer(trunnel.spark.GenericScanner, object):
     def t_default(self, s):
         raise ValueError("unmatched input: %r on line %r" % (s, self.lineno))
 
+# Map from the names of Lexer's regex groups to functions that take the
+# matched text and its line number, and return a single token.  Lexer uses
+# these instead of the corresponding t_* methods when it can.
+Lexer.TOKEN_MAKERS = {
+    "punctuation": Token,
+    "id": idToken,
+    "int": IntLiteral,
+    "string": StringLiteral,
+    "annotation": Annotation,
+}
+
 #
 #
 # AST types
@@ -166,6 +261,7 @@ class AST(object):
 
     """Abstract type. Base type for our abstract syntax tree structure.
     """
+    __slots__ = ()
 
     def visitChildren(self, visitor, *args):
         """Invokes a visitor recursively on every sub-element of this AST
@@ -183,6 +279,9 @@ class File(AST):
     # constsnts -- a list of ConstDecl.
     # declarations -- a list of StructDecl
     # declarationsByName -- a map from name to StructDecl.
+    # imports -- a list of ImportDecl.
+    __slots__ = ("constants", "declarations", "declarationsByName",
+                 "externsByName", "externStructs", "options", "imports")
 
     def __init__(self, members):
         self.constants = []
@@ -191,6 +290,7 @@ class File(AST):
         self.externsByName = {}  # XXXX
         self.externStructs = []
         self.options = []
+        self.imports = []
         for m in members:
             self.add(m)
 
@@ -202,6 +302,8 @@ class File(AST):
             self.externsByName[m.name] = m
         elif isinstance(m, TrunnelOptionsDecl):
             self.options.extend(m.options)
+        elif isinstance(m, ImportDecl):
+            self.imports.append(m)
         else:
             self.declarations.append(m)
             self.declarationsByName[m.name] = m
@@ -230,6 +332,9 @@ class File(AST):
             return self.declarationsByName[name]
         except KeyError:
             pass
+        for imp in self.imports:
+            if imp.interface is not None and name in imp.interface.structs:
+                return imp.interface.structs[name]
         return self.externsByName[name]
 
 
@@ -248,7 +353,15 @@ class StructDecl(AST):
     #   has_leftover_field -- boolean: true iff this struct contains
     #     an SMLenConstrained.
     #   constrainedIntFields -- set: names of integer fields that
-    #     are referenced elsewhere in the structure.
+    #     are referenced elsewhere in the structure.  (Set by
+    #     CodeGen.Checker.)
+    #   arena -- boolean: true iff we generate a typename_parse_arena()
+    #     function for this struct.
+    #   encodedSize -- the number of bytes that this structure always
+    #     takes when encoded, or None if that can vary.
+    __slots__ = ("name", "members", "annotation", "contextList",
+                 "_isContext", "lengthFields", "has_leftover_field",
+                 "constrainedIntFields", "arena", "encodedSize")
 
     def __init__(self, name, members, contextList=(), isContext=False):
         self.name = name
@@ -256,6 +369,11 @@ class StructDecl(AST):
         self.annotation = None
         self.contextList = list(contextList)
         self._isContext = isContext
+        self.lengthFields = None
+        self.has_leftover_field = False
+        self.constrainedIntFields = None
+        self.arena = False
+        self.encodedSize = None
 
     def visitChildren(self, v, *args):
         for m in self.members:
@@ -273,6 +391,7 @@ class ConstDecl(AST):
     # value -- the integer value of this constant.
     # annotation -- None, or a string holding a doxygen comment describing
     #   this constant.
+    __slots__ = ("name", "value", "annotation")
 
     def __init__(self, name, value):
         self.name = name
@@ -283,15 +402,43 @@ class ConstDecl(AST):
 class ExternStructDecl(AST):
 
     """Declaration that a Trunnel structure is available elsewhere."""
+    #
+    # size -- the number of bytes that the structure always takes when
+    #    encoded, if we know it, or None.  We only know this for
+    #    structures from imported files.
+    __slots__ = ("name", "contextList", "size")
 
-    def __init__(self, name, contextList=()):
+    def __init__(self, name, contextList=(), size=None):
         self.name = str(name)
         self.contextList = list(contextList)
+        self.size = size
+
+
+class ImportDecl(AST):
+
+    """Declaration that we use the structures, contexts, and constants
+       defined in another trunnel file."""
+    #
+    # fname -- the name of the file to import, relative to the directory
+    #    of the file that imports it.
+    # Set elsewhere (by trunnel.Interface.InterfaceLoader):
+    #    path -- the absolute name of the file to import.
+    #    interface -- a trunnel.Interface.Interface for the imported file.
+    #    header -- the name to use when including its header file.
+    __slots__ = ("fname", "lineno", "path", "interface", "header")
+
+    def __init__(self, fname, lineno):
+        self.fname = fname
+        self.lineno = lineno
+        self.path = None
+        self.interface = None
+        self.header = None
 
 
 class TrunnelOptionsDecl(AST):
 
     """Pragma options to change the behavior of the trunnel code generator."""
+    __slots__ = ("options", "lineno")
 
     def __init__(self, options, lineno):
         self.options = options
@@ -308,12 +455,29 @@ class StructMember(AST):
     #    name -- the member id of this object.
     #    c_name -- the member id of this object, as mangled for the generated
     #       C.
-    #    c_name -- the member id of this object, as mangled for function names
-    #       in the generated C.
+    #    c_fn_name -- the member id of this object, as mangled for function
+    #       names in the generated C.
+    #    after_leftover_field -- true iff this member comes after an
+    #       SMLenConstrained that uses the 'leftover bytes' feature.
+    #    runOffset, runLength -- if this member is part of a run of
+    #       fixed-width members that we check for and advance over all at
+    #       once, the number of bytes in the run before this member, and
+    #       the number of bytes in the whole run.  Otherwise None.
+    #    endsRun -- true iff this member is the last one in its run.
+    #    (These last six are set by CodeGen.Annotator.)
+    __slots__ = ("annotation", "name", "c_name", "c_fn_name",
+                 "after_leftover_field", "runOffset", "runLength",
+                 "endsRun")
 
     def __init__(self, name=None):
         self.annotation = None
         self.name = name
+        self.c_name = None
+        self.c_fn_name = None
+        self.after_leftover_field = False
+        self.runOffset = None
+        self.runLength = None
+        self.endsRun = False
 
     def getName(self):
         """Return the name of this item as it will appear in C."""
@@ -325,6 +489,7 @@ class IntType(AST):
     """A fixed-width unsigned integer type."""
     #
     # width -- the width of this type in bits. Must be 8, 16, 32, or 64.
+    __slots__ = ("width",)
 
     def __init__(self, width):
         self.width = width
@@ -340,6 +505,7 @@ class IntConstraint(AST):
     # ranges -- a list of (lo,hi) tuples such that any integer conforming to
     #   this constraint has lo <= i <= hi for some tuple in the list.
     #   Sorted after we validate the containing inttype.
+    __slots__ = ("ranges",)
 
     def __init__(self, ranges):
         self.ranges = ranges
@@ -359,6 +525,7 @@ class SMInteger(StructMember):
     """An unsigned integer member of a structure"""
     #
     # constraints -- an IntConstraints, or None
+    __slots__ = ("inttype", "constraints")
 
     def __init__(self, inttype, name, constraints):
         StructMember.__init__(self, name)
@@ -401,6 +568,7 @@ class SMStruct(StructMember):
     # structname -- the name of the structure type for this structure.
     # structDeclaration -- the StructDecl for the struct that this refers to.
     #     Set by Annotator.
+    __slots__ = ("structname", "structDeclaration")
 
     def __init__(self, structname, name):
         StructMember.__init__(self, name)
@@ -414,9 +582,15 @@ class SMStruct(StructMember):
 class SMString(StructMember):
 
     """A nul-terminated string member of a structure"""
+    #
+    # Set elsewhere (in CodeGen.Annotator):
+    #   zeroCopy -- true iff we should parse this string by pointing into
+    #     the input, rather than copying it.
+    __slots__ = ("zeroCopy",)
 
     def __init__(self, name):
         StructMember.__init__(self, name)
+        self.zeroCopy = False
 
     def __str__(self):
         return "nulterm %s" % self.getName()
@@ -434,6 +608,7 @@ class SMFixedArray(StructMember):
     # Set elsewhere (in CodeGen.Annotator):
     # structDeclaration -- the StructDecl for the struct that this
     #     refers to, if any.  Set by Annotator.
+    __slots__ = ("basetype", "width", "structDeclaration")
 
     def __init__(self, basetype, name, width):
         StructMember.__init__(self, name)
@@ -464,12 +639,18 @@ class SMVarArray(StructMember):
     #     widthfield, or None if lengthfield is None
     # structDeclaration -- the StructDecl for the struct that this
     #     refers to, if any.  Set by Annotator.
+    #   zeroCopy -- true iff this is an array of uint8_t that we should
+    #     parse by pointing into the input, rather than copying it.
+    __slots__ = ("basetype", "widthfield", "structDeclaration",
+                 "widthfieldmember", "zeroCopy")
 
     def __init__(self, basetype, name, widthfield):
         StructMember.__init__(self, name)
         self.basetype = basetype
         self.widthfield = widthfield
         self.structDeclaration = None
+        self.widthfieldmember = None
+        self.zeroCopy = False
 
     def __str__(self):
         struct = width = ""
@@ -497,12 +678,15 @@ class SMLenConstrained(StructMember):
     # Set elsewhere (in CodeGen.Annotator):
     #   lengthfieldmember -- The StructMember corresponding to the named
     #     lengthfield, or None if lengthfield is None
+    __slots__ = ("lengthfield", "members", "leftoverbytes",
+                 "lengthfieldmember")
 
     def __init__(self, lengthfield, members, leftoverbytes=None):
         StructMember.__init__(self)
         self.lengthfield = lengthfield
         self.members = members
         self.leftoverbytes = leftoverbytes
+        self.lengthfieldmember = None
 
     def visitChildren(self, v, *args):
         for m in self.members:
@@ -519,11 +703,13 @@ class SMUnion(StructMember):
     # Set elsewhere (in CodeGen.Annotator):
     #   tagfieldmember -- The StructMember corresponding to the named
     #     tagfield.
+    __slots__ = ("tagfield", "members", "tagfieldmember")
 
     def __init__(self, name, tagfield, members):
         StructMember.__init__(self, name)
         self.tagfield = tagfield
         self.members = members
+        self.tagfieldmember = None
 
     def __str__(self):
         return "union %s[%s]" % (self.getName(), self.tagfield)
@@ -541,6 +727,7 @@ class UnionMember(AST):
     #    member, or None if this is a default case.
     # decls -- an array of StructMember.
     # is_default -- true iff this is a defautl case.
+    __slots__ = ("tagvalue", "decls", "is_default")
 
     def __init__(self, tagvalue, decls):
         self.tagvalue = tagvalue
@@ -557,24 +744,26 @@ class SMFail(StructMember):
     """A struct member: denotes that parsing should never succeed on a given
        union tag.
     """
-    pass
+    __slots__ = ()
 
 
 class SMEos(StructMember):
 
     """A struct member: denotes that additional data is not allowed."""
-    pass
+    __slots__ = ()
 
 
 class SMIgnore(StructMember):
 
     """A struct member: denotes that additional data should be consumed and
        ignored."""
-    pass
+    __slots__ = ()
 
 class SMPosition(StructMember):
     """ A struct member: notes that we should store a pointer to this point
         in the input when we """
+    __slots__ = ()
+
     def __init__(self, name):
         StructMember.__init__(self, name)
 
@@ -587,6 +776,7 @@ class IDReference(AST):
     """A reference to an identity in a given context."""
     # context -- the name of the context
     # ident -- the name within the context
+    __slots__ = ("context", "ident")
 
     def __init__(self, context, ident):
         self.context = context
@@ -625,6 +815,12 @@ class Parser(trunnel.spark.GenericParser, object):
         trunnel.spark.GenericParser.__init__(self, "File")
         self.lingering_structs = []
 
+    def parse(self, tokens):
+        self.lingering_structs = []
+        # GenericParser needs to index into its input, so we can't hand it
+        # a generator.
+        return trunnel.spark.GenericParser.parse(self, list(tokens))
+
     def typestring(self, token):
         return token.type
 
@@ -683,6 +879,14 @@ class Parser(trunnel.spark.GenericParser, object):
                              % opt.lineno)
         return TrunnelOptionsDecl(options, opt.lineno)
 
+    @rule(" Declaration ::= ID STRING ; ")
+    def p_Decl_6(self, info):
+        kwd, fname, _ = info
+        if str(kwd) != "import":
+            raise ValueError("Bad syntax for 'import' on line %d"
+                             % kwd.lineno)
+        return ImportDecl(str(fname), kwd.lineno)
+
     @rule(" IDList ::= ID ")
     def p_IDList_1(self, info):
         return [str(info[0])]
@@ -1046,6 +1250,491 @@ class Parser(trunnel.spark.GenericParser, object):
             raise SyntaxError("Expected 'ptr' at %s" % info[0].lineno)
         return None
 
+
+class RecursiveDescentParser(object):
+
+    """A deterministic parser for trunnel's grammar, running in linear time.
+
+       It accepts exactly the language that Parser accepts, and builds
+       exactly the same AST -- down to the order in which it lifts out
+       nested structure declarations, and the token it blames for a
+       syntax error.  Parser's @rule decorations remain the definition of
+       the grammar; each parseX method here notes the rules it implements.
+    """
+    #
+    # tokens -- an iterator over the tokens we have not yet looked at.
+    # cur -- the next token to consume, or None at the end of the input.
+    # ahead -- the token after 'cur', or None.
+    # prev, prev2 -- the last two tokens that we consumed, or None.
+    # lingering_structs -- as in Parser, except that we keep these in
+    #    the order in which we started parsing them.
+    # deferred_error -- None, or an exception to raise once we have parsed
+    #    the entire input.  Parser checks keywords like 'length' and 'ptr'
+    #    in its reduction actions, which only run after a successful parse,
+    #    from right to left: so it reports the last bad keyword.  So do we.
+
+    INT_TYPES = ("u8", "u16", "u32", "u64")
+
+    def __init__(self):
+        self.lingering_structs = []
+
+    def parse(self, tokens):
+        self.tokens = iter(tokens)
+        self.prev = self.prev2 = None
+        self.cur = next(self.tokens, None)
+        self.ahead = next(self.tokens, None)
+        self.lingering_structs = []
+        self.deferred_error = None
+
+        # File ::= Declarations
+        decls = [self.parseDeclaration()]
+        while self.cur is not None:
+            decls.append(self.parseDeclaration())
+
+        if self.deferred_error is not None:
+            raise self.deferred_error
+
+        # Parser reduces inner declarations before outer ones, and later
+        # declarations before earlier ones.
+        self.lingering_structs.reverse()
+        decls.extend(self.lingering_structs)
+        return File(decls)
+
+    def error(self, token):
+        raise SyntaxError("%s at %s" % (token, token.lineno))
+
+    def syntaxError(self):
+        """Report a syntax error at the current token.  Parser blames the
+           next-to-last token when the input ends too soon, or when the
+           last token is the bad one; we do the same."""
+        if self.cur is None:
+            tok = self.prev2 if self.prev2 is not None else self.prev
+        elif self.ahead is None:
+            tok = self.prev if self.prev is not None else self.cur
+        else:
+            tok = self.cur
+        self.error(tok)
+
+    def at(self, *types):
+        return self.cur is not None and self.cur.type in types
+
+    def advance(self):
+        tok = self.cur
+        self.prev2, self.prev = self.prev, tok
+        self.cur, self.ahead = self.ahead, next(self.tokens, None)
+        return tok
+
+    def accept(self, ttype):
+        if self.at(ttype):
+            return self.advance()
+        return None
+
+    def expect(self, ttype):
+        if not self.at(ttype):
+            self.syntaxError()
+        return self.advance()
+
+    def parseDeclaration(self):
+        # Declaration ::= extern struct ID OptWithContext ;
+        if self.accept("extern"):
+            self.expect("struct")
+            name = self.expect("ID")
+            contexts = self.parseOptWithContext()
+            self.expect(";")
+            return ExternStructDecl(name, contexts)
+
+        # Declaration ::= trunnel ID IDList ;
+        if self.accept("trunnel"):
+            opt = self.expect("ID")
+            options = self.parseIDList()
+            self.expect(";")
+            if str(opt) not in ("option", "options"):
+                self.deferred_error = ValueError(
+                    "Bad syntax for 'trunnel options' on line %d" % opt.lineno)
+            return TrunnelOptionsDecl(options, opt.lineno)
+
+        # Declaration ::= ID STRING ;
+        kwd = self.accept("ID")
+        if kwd:
+            fname = self.expect("STRING")
+            self.expect(";")
+            if str(kwd) != "import":
+                self.deferred_error = ValueError(
+                    "Bad syntax for 'import' on line %d" % kwd.lineno)
+            return ImportDecl(str(fname), kwd.lineno)
+
+        # Declaration ::= OptAnnotation ConstDecl
+        # Declaration ::= OptAnnotation StructDecl OptSemi
+        # Declaration ::= OptAnnotation ContextDecl OptSemi
+        a = self.accept("ANNOTATION")
+        if self.at("const"):
+            d = self.parseConstDecl()
+        elif self.at("struct"):
+            self.advance()
+            d = self.parseStructDecl(self.expect("ID"))
+            self.accept(";")
+        elif self.at("context"):
+            d = self.parseContextDecl()
+            self.accept(";")
+        else:
+            self.syntaxError()
+        if a:
+            d.annotation = str(a)
+        return d
+
+    def parseOptWithContext(self):
+        # OptWithContext ::= | with context IDList
+        if self.accept("with"):
+            self.expect("context")
+            return self.parseIDList()
+        return ()
+
+    def parseIDList(self):
+        # IDList ::= ID | IDList , ID
+        lst = [str(self.expect("ID"))]
+        while self.accept(","):
+            lst.append(str(self.expect("ID")))
+        return lst
+
+    def parseConstDecl(self):
+        # ConstDecl ::= const CONST_ID = INT ;
+        self.expect("const")
+        name = self.expect("CONST_ID")
+        self.expect("=")
+        val = self.expect("INT")
+        self.expect(";")
+        return ConstDecl(str(name), val)
+
+    def parseContextDecl(self):
+        # ContextDecl ::= context ID { ContextMembers }
+        # ContextMembers ::= | ContextMembers OptAnnotation ContextMember
+        # ContextMember ::= IntType ID ;
+        self.expect("context")
+        name = self.expect("ID")
+        self.expect("{")
+        members = []
+        while not self.at("}"):
+            a = self.accept("ANNOTATION")
+            inttype = self.parseIntType()
+            m = SMInteger(inttype, str(self.expect("ID")), None)
+            self.expect(";")
+            if a:
+                m.annotation = str(a)
+            members.append(m)
+        self.advance()
+        return StructDecl(str(name), members, isContext=True)
+
+    def parseStructDecl(self, name):
+        """Parse the rest of a StructDecl, after 'struct ID'."""
+        # StructDecl ::= struct ID OptWithContext
+        #                  { StructMembers StructEnding }
+        # StructMembers ::= | StructMembers OptAnnotation StructMember ;
+        # StructEnding ::= | eos ; | SMRemainder ;
+        contexts = self.parseOptWithContext()
+        self.expect("{")
+        members = []
+        while True:
+            a = self.accept("ANNOTATION")
+            if a is None and self.at("}"):
+                break
+            if a is None and self.accept("eos"):
+                self.expect(";")
+                members.append(SMEos())
+                break
+            m, isRemainder = self.parseStructMember(False)
+            if a:
+                m.annotation = str(a)
+            self.expect(";")
+            members.append(m)
+            if isRemainder:
+                break
+        self.expect("}")
+        return StructDecl(str(name), members, contexts)
+
+    def parseNestedStructDecl(self, name):
+        """Parse the rest of a StructDecl declared inside another one, and
+           remember it so we can lift it out to the top level."""
+        idx = len(self.lingering_structs)
+        self.lingering_structs.append(None)
+        decl = self.parseStructDecl(name)
+        self.lingering_structs[idx] = decl
+        return decl
+
+    def parseStructMember(self, inUnion):
+        """Parse a StructMember (or, if inUnion, a UnionField), or an
+           SMRemainder without its annotation.  Return a tuple of the
+           member and a flag that is true iff it was an SMRemainder."""
+        # StructMember ::= SMInteger | SMStruct | SMString | SMArray
+        #                | SMUnion | SMPosition
+        # UnionField ::= SMInteger | SMFixedArray | SMVarArray
+        #                | SMString | SMStruct
+        if not inUnion and self.at("union"):
+            return self.parseUnion(), False
+
+        if not inUnion and self.accept("@"):
+            # SMPosition ::= @ PtrKW ID
+            kw = self.expect("ID")
+            name = self.expect("ID")
+            if str(kw) != 'ptr':
+                self.deferred_error = SyntaxError(
+                    "Expected 'ptr' at %s" % kw.lineno)
+            return SMPosition(str(name)), False
+
+        if self.accept("nulterm"):
+            # SMString ::= nulterm ID
+            return SMString(self.expect("ID")), False
+
+        if self.at(*self.INT_TYPES):
+            # SMInteger ::= IntType ID OptIntConstraint
+            # OptIntConstraint ::= | IN [ IntList ]
+            inttype = self.parseIntType()
+            name = self.expect("ID")
+            if self.at("["):
+                return self.parseArrayTail(inttype, name)
+            constraint = None
+            if self.accept("IN"):
+                self.expect("[")
+                constraint = IntConstraint(self.parseIntList())
+                self.expect("]")
+            return SMInteger(inttype, str(name), constraint), False
+
+        if self.at("struct"):
+            # SMStruct ::= struct ID ID | StructDecl ID
+            structname = self.parseStructRef()
+            name = self.expect("ID")
+            if self.at("["):
+                return self.parseArrayTail(structname, name)
+            return SMStruct(structname, str(name)), False
+
+        return self.parseArrayTail(self.parseArrayBase(), self.expect("ID"))
+
+    def parseIntType(self):
+        # IntType ::= u8 | u16 | u32 | u64
+        if not self.at(*self.INT_TYPES):
+            self.syntaxError()
+        return IntType(int(self.advance().type[1:]))
+
+    def parseStructRef(self):
+        """Parse 'struct ID' or a StructDecl, and return the name of the
+           structure."""
+        # ArrayBase ::= struct ID | StructDecl
+        self.expect("struct")
+        name = self.expect("ID")
+        if self.at("with", "{"):
+            return self.parseNestedStructDecl(name).name
+        return str(name)
+
+    def parseArrayBase(self):
+        # ArrayBase ::= IntType | struct ID | StructDecl | char
+        if self.at("struct"):
+            return self.parseStructRef()
+        if self.at("char"):
+            return self.advance()
+        return self.parseIntType()
+
+    def parseArrayTail(self, basetype, name):
+        """Parse the bracketed part of an array declaration, given its base
+           type and its name token.  Return a tuple as for
+           parseStructMember."""
+        # SMRemainder ::= OptAnnotation ArrayBase ID [ ]
+        # SMVarArray ::= ArrayBase ID [ IDRef ]
+        # SMVarArray ::= ArrayBase ID [ .. - Integer ]
+        # SMFixedArray ::= ArrayBase ID [ Integer ]
+        self.expect("[")
+        if self.accept("]"):
+            return SMVarArray(basetype, name, None), True
+        if self.accept(".."):
+            self.expect("-")
+            leftover = self.parseInteger()
+            self.expect("]")
+            array = SMVarArray(basetype, str(name), None)
+            return SMLenConstrained(None, [array], leftover), False
+        if self.at("INT", "CONST_ID"):
+            width = self.parseInteger()
+            self.expect("]")
+            return SMFixedArray(basetype, str(name), width), False
+        widthfield = self.parseIDRef()
+        self.expect("]")
+        return SMVarArray(basetype, str(name), str(widthfield)), False
+
+    def parseRemainder(self, annotation):
+        # SMRemainder ::= OptAnnotation ArrayBase ID [ ]
+        m = SMVarArray(self.parseArrayBase(), self.expect("ID"), None)
+        self.expect("[")
+        self.expect("]")
+        m.annotation = str(annotation)
+        return m
+
+    def parseInteger(self):
+        # Integer ::= INT | CONST_ID
+        if not self.at("INT", "CONST_ID"):
+            self.syntaxError()
+        return self.advance().value
+
+    def parseIntList(self):
+        # IntList ::= IntListMember | IntList , IntListMember
+        # IntListMember ::= Integer | Integer .. Integer
+        lst = []
+        while True:
+            lo = self.parseInteger()
+            hi = lo
+            if self.accept(".."):
+                hi = self.parseInteger()
+            lst.append((lo, hi))
+            if not self.accept(","):
+                return lst
+
+    def parseIDRef(self):
+        # IDRef ::= ID | ID . ID
+        ident = self.expect("ID")
+        if self.accept("."):
+            return IDReference(ident, self.expect("ID"))
+        return ident
+
+    def parseUnion(self):
+        # SMUnion ::= union ID [ IDRef ] OptUnionLength { UnionMembers }
+        # OptUnionLength ::= | with LengthKW IDRef
+        #                    | with LengthKW .. - Integer
+        # UnionMembers ::= UnionMember | UnionMembers UnionMember
+        self.expect("union")
+        name = self.expect("ID")
+        self.expect("[")
+        tagfield = self.parseIDRef()
+        self.expect("]")
+        optlength = None
+        if self.accept("with"):
+            kw = self.expect("ID")
+            if str(kw) != 'length':
+                self.deferred_error = SyntaxError(
+                    "Expected 'length' at %s" % kw.lineno)
+            if self.accept(".."):
+                self.expect("-")
+                optlength = self.parseInteger()
+            else:
+                optlength = str(self.parseIDRef())
+        self.expect("{")
+        members = [self.parseUnionMember()]
+        while not self.at("}"):
+            members.append(self.parseUnionMember())
+        self.advance()
+
+        union = SMUnion(str(name), str(tagfield), members)
+        if optlength is not None:
+            if type(optlength) == str:
+                union = SMLenConstrained(optlength, [union])
+            else:
+                union = SMLenConstrained(None, [union], optlength)
+        return union
+
+    def parseUnionMember(self):
+        # UnionMember ::= UnionCase : UnionFields OptExtentSpec
+        # UnionCase ::= IntList | default
+        # UnionFields ::= ; | fail ; | ignore ; | SMRemainder ;
+        #               | UnionField ; | UnionFields UnionField ;
+        # OptExtentSpec ::= | ... ; | SMRemainder ;
+        if self.accept("default"):
+            tagvals = None
+        else:
+            tagvals = self.parseIntList()
+        self.expect(":")
+
+        if self.accept(";"):
+            fields = []
+        elif self.accept("fail"):
+            self.expect(";")
+            fields = [SMFail()]
+        elif self.accept("ignore"):
+            self.expect(";")
+            fields = [SMIgnore()]
+        else:
+            fields = [self.parseUnionField()[0]]
+            self.expect(";")
+
+        # An SMRemainder after the first entry can only be an
+        # OptExtentSpec, and ends the member.
+        extends = []
+        while self.at("u8", "u16", "u32", "u64", "char", "struct", "nulterm",
+                      "ANNOTATION"):
+            field, isRemainder = self.parseUnionField()
+            self.expect(";")
+            if isRemainder:
+                extends = [field]
+                break
+            fields.append(field)
+        else:
+            if self.accept("..."):
+                self.expect(";")
+                extends = [SMIgnore()]
+
+        return UnionMember(tagvals, fields + extends)
+
+    def parseUnionField(self):
+        """Parse a UnionField or an SMRemainder.  Return a tuple as for
+           parseStructMember."""
+        a = self.accept("ANNOTATION")
+        if a is not None:
+            return self.parseRemainder(a), True
+        return self.parseStructMember(True)
+
+
+# Bump this whenever the cached parser tables change in a way that the rule
+# digest wouldn't notice.
+PARSER_CACHE_VERSION = 1
+
+
+def parserRulesDigest():
+    """Return a digest of every grammar rule in Parser, along with the name
+       of the method that implements it.  (The names matter: spark uses them
+       to resolve ambiguities.)"""
+    items = ["parser-tables", str(PARSER_CACHE_VERSION),
+             trunnel.spark.__version__, "%d.%d" % sys.version_info[:2]]
+    for name in sorted(dir(Parser)):
+        if name.startswith("p_"):
+            items.append(name)
+            items.append(getattr(Parser, name).rule)
+    return trunnel.Cache.digest(*items)
+
+
+# The names of the parser engines that getParser() knows about.  The first
+# one is the default.
+PARSER_ENGINES = ("earley", "rd")
+
+
+def getParser(engine="earley"):
+    """Return a new parser for trunnel's grammar.  'engine' is one of
+       PARSER_ENGINES: "earley" for Parser, or "rd" for
+       RecursiveDescentParser.
+
+       For Parser, load the parse tables from the on-disk cache (see
+       trunnel.Cache) if we can; otherwise, build them and save them there
+       for next time.
+    """
+    if engine == "rd":
+        return RecursiveDescentParser()
+    elif engine != "earley":
+        raise ValueError("Unknown parser engine %r" % engine)
+
+    if trunnel.Cache.cacheDir() is None:
+        return Parser()
+
+    name = "parser-%s.pickle" % parserRulesDigest()
+    data = trunnel.Cache.load(name)
+    if data is not None:
+        try:
+            p = pickle.loads(data)
+            if isinstance(p, Parser):
+                return p
+        except Exception:
+            # A corrupt cache entry is the same as a missing one.
+            pass
+
+    p = Parser()
+    # Pickling a GenericParser builds its complete state machine.  Once
+    # that's done, it's safe to use the faster set-construction code.
+    trunnel.Cache.store(name, pickle.dumps(p, pickle.HIGHEST_PROTOCOL))
+    p.makeSet = p.makeSet_fast
+    return p
+
 if __name__ == '__main__':
     print ("===== Here is our actual grammar, extracted from Grammar.py\n")
 
@@ -0,0 +1,307 @@
+# Interface.py -- what one trunnel file exports to the files that import it.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Support for 'import "other.trunnel";'.
+
+   When a file imports another one, it can use the other file's
+   constants, structures, and contexts, and its header includes the other
+   file's header.  All we need to know about the other file to check and
+   generate code for this one is in its Interface: its constant values,
+   the contexts that each structure uses, the fields of each context, and
+   the encoded size of each structure whose size never changes.
+
+   We keep interfaces in the cache (see trunnel.Cache), keyed by a digest
+   of the file's contents and directory, so that we only need to parse
+   and check each imported file when it changes.  Every time we compile a
+   file, we record its interface there too.
+"""
+
+import json
+import os
+
+import trunnel.Cache
+import trunnel.CodeGen
+import trunnel.Grammar
+import trunnel.Manifest
+
+# Bump this if the format of an interface changes.
+INTERFACE_VERSION = 1
+
+# How many interfaces to keep in the cache.  Every change to a trunnel
+# file gives it a new interface key, so without a limit, the cache would
+# keep growing as long as somebody edits their files.
+MAX_CACHED_INTERFACES = 1000
+
+
+def interfaceKey(text, directory):
+    """Return the digest that identifies the interface of the trunnel
+       source 'text', whose imports are relative to 'directory'.  (The
+       same text in another directory might import different files.)"""
+    return trunnel.Cache.digest("trunnel-interface", str(INTERFACE_VERSION),
+                                trunnel.Manifest.generatorDigest(),
+                                os.path.abspath(directory), text)
+
+
+def headerName(import_fname, target_dir=None):
+    """Return the name to #include for the header generated from the
+       imported file 'import_fname'.  If we're putting all our output into
+       'target_dir', the header will be next to ours."""
+    if import_fname.endswith(".trunnel"):
+        import_fname = import_fname[:-len(".trunnel")]
+    if target_dir is not None:
+        import_fname = os.path.basename(import_fname)
+    return import_fname + ".h"
+
+
+class Interface(object):
+
+    """Everything that a trunnel file makes available to the files that
+       import it."""
+    #
+    # key -- the interfaceKey for the file.
+    # constants -- a map from constant name to its integer value.
+    # structs -- a map from structure name to an ExternStructDecl for it,
+    #    with its contextList and size set.
+    # contexts -- a map from context name to a list of its fields' names.
+    # imports -- a list of (filename, fingerprint) for every file that the
+    #    file imports.  If any of their interfaces change, so might this
+    #    one.
+
+    def __init__(self, key, constants, structs, contexts, imports):
+        self.key = key
+        self.constants = constants
+        self.structs = structs
+        self.contexts = contexts
+        self.imports = imports
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """Return a digest of everything in this interface, including the
+           fingerprints of the interfaces it depends on."""
+        if self._fingerprint is None:
+            self._fingerprint = trunnel.Cache.digest(self.asJSON())
+        return self._fingerprint
+
+    def asJSON(self):
+        structs = {}
+        for name, es in self.structs.items():
+            structs[name] = {"contexts": es.contextList, "size": es.size}
+        return json.dumps({
+            "version": INTERFACE_VERSION,
+            "key": self.key,
+            "constants": self.constants,
+            "structs": structs,
+            "contexts": self.contexts,
+            "imports": self.imports,
+        }, indent=1, sort_keys=True)
+
+
+def interfaceFromJSON(s):
+    """Return the Interface encoded in the string 's', or None if we can't
+       read it."""
+    try:
+        content = json.loads(s)
+        if content.get("version") != INTERFACE_VERSION:
+            return None
+        structs = {}
+        for name, info in content["structs"].items():
+            structs[name] = trunnel.Grammar.ExternStructDecl(
+                name, info["contexts"], info["size"])
+        return Interface(content["key"], content["constants"], structs,
+                         content["contexts"],
+                         [tuple(item) for item in content["imports"]])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def makeInterface(parsed, checker, key):
+    """Return the Interface for the File 'parsed', which 'checker' (a
+       trunnel.CodeGen.Checker) has checked, and whose interfaceKey is
+       'key'."""
+    constants = dict((c.name, checker.constValues[c.name])
+                     for c in parsed.constants)
+    structs = {}
+    contexts = {}
+    for name in checker.sortedStructs:
+        sd = parsed.declarationsByName[name]
+        if sd.isContext():
+            contexts[name] = [m.name for m in sd.members]
+            continue
+        structs[name] = trunnel.Grammar.ExternStructDecl(
+            name, sd.contextList, sd.encodedSize)
+    imports = [(imp.path, imp.interface.fingerprint())
+               for imp in parsed.imports]
+    return Interface(key, constants, structs, contexts, imports)
+
+
+def encodedSize(sd, constValues, sizes):
+    """Return the number of bytes that the StructDecl 'sd' always takes
+       when encoded, or None if that can vary.  'constValues' maps
+       constant names to values; 'sizes' maps the names of the structures
+       that 'sd' can use to their sizes, or None."""
+    total = 0
+    for m in sd.members:
+        if isinstance(m, trunnel.Grammar.SMInteger):
+            total += m.inttype.width // 8
+        elif isinstance(m, trunnel.Grammar.SMStruct):
+            if sizes.get(m.structname) is None:
+                return None
+            total += sizes[m.structname]
+        elif isinstance(m, trunnel.Grammar.SMFixedArray):
+            width = m.width
+            if isinstance(width, str):
+                width = constValues[width]
+            if isinstance(m.basetype, trunnel.Grammar.IntType):
+                total += width * (m.basetype.width // 8)
+            elif str(m.basetype) == "char":
+                total += width
+            elif sizes.get(m.basetype) is None:
+                return None
+            else:
+                total += width * sizes[m.basetype]
+        elif isinstance(m, (trunnel.Grammar.SMPosition,
+                            trunnel.Grammar.SMEos)):
+            pass
+        else:
+            return None
+    return total
+
+
+class InterfaceLoader(object):
+
+    """Finds the Interface for each file that a trunnel file imports,
+       parsing and checking those files only when the cache doesn't
+       already have their interfaces."""
+    #
+    # lexer, parser -- as in trunnel.CodeGen.Compiler.
+    # byKey -- a map from interfaceKey to every Interface we have loaded
+    #    or made.
+    # building -- a set of the files we're making interfaces for right
+    #    now, so that we can notice import cycles.
+
+    def __init__(self, lexer, parser):
+        self.lexer = lexer
+        self.parser = parser
+        self.byKey = {}
+        self.building = set()
+
+    def resolve(self, parsed, directory, target_dir=None):
+        """Find the interface for every import in the File 'parsed', whose
+           imports are relative to 'directory', and fill in the 'path',
+           'interface', and 'header' fields of its ImportDecls."""
+        for imp in parsed.imports:
+            imp.path = os.path.abspath(os.path.join(directory, imp.fname))
+            imp.interface = self.load(imp.path)
+            imp.header = headerName(imp.fname, target_dir)
+
+    def remember(self, iface):
+        """Record 'iface', so that we can find it later by its key.  Only
+           write it to the cache if the cache doesn't already have it."""
+        self.byKey[iface.key] = iface
+        name = "interface-%s.json" % iface.key
+        data = iface.asJSON().encode("utf-8")
+        if trunnel.Cache.load(name) != data:
+            trunnel.Cache.store(name, data)
+            trunnel.Cache.prune("interface-", MAX_CACHED_INTERFACES)
+
+    def load(self, fname):
+        """Return the Interface for the trunnel file 'fname'."""
+        if fname in self.building:
+            raise trunnel.CodeGen.CheckError(
+                "Import cycle involving %s" % fname)
+        try:
+            with open(fname, 'r') as f:
+                text = f.read()
+        except (IOError, OSError) as e:
+            raise trunnel.CodeGen.CheckError(
+                "Can't import %s: %s" % (fname, e.strerror))
+        key = interfaceKey(text, os.path.dirname(fname))
+        iface = self.byKey.get(key)
+        if iface is None:
+            data = trunnel.Cache.load("interface-%s.json" % key)
+            if data is not None:
+                iface = interfaceFromJSON(data.decode("utf-8"))
+        if iface is not None and self.isCurrent(iface.imports):
+            self.byKey[key] = iface
+            return iface
+        return self.build(fname, text, key)
+
+    def isCurrent(self, imports):
+        """Given a list of (filename, fingerprint) tuples, as in
+           Interface.imports, return true iff all of those files still
+           have the same interfaces."""
+        for fname, fingerprint in imports:
+            try:
+                if self.load(fname).fingerprint() != fingerprint:
+                    return False
+            except trunnel.CodeGen.CheckError:
+                return False
+        return True
+
+    def build(self, fname, text, key):
+        """Parse and check the trunnel source 'text' from the file 'fname',
+           and return (and remember) its Interface."""
+        self.building.add(fname)
+        try:
+            parsed = self.parser.parse(self.lexer.itertokens(text))
+            self.resolve(parsed, os.path.dirname(fname))
+            checker = trunnel.CodeGen.Checker()
+            checker.visit(parsed)
+            trunnel.CodeGen.Annotator(checker.constValues).visit(parsed)
+        finally:
+            self.building.discard(fname)
+        iface = makeInterface(parsed, checker, key)
+        self.remember(iface)
+        return iface
+
+
+def importedFiles(interfaces, fnames):
+    """Return a sorted list of every file that the trunnel files in
+       'fnames' import, directly or not, using the InterfaceLoader
+       'interfaces'."""
+    result = set()
+    pending = [os.path.abspath(fn) for fn in fnames]
+    seen = set()
+    while pending:
+        fname = pending.pop()
+        if fname in seen:
+            continue
+        seen.add(fname)
+        for dep, _ in interfaces.load(fname).imports:
+            result.add(dep)
+            pending.append(dep)
+    return sorted(result)
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
@@ -0,0 +1,200 @@
+# Manifest.py -- records of trunnel's output, for incremental builds.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Support for regenerating only the code that needs it.
+
+   When trunnel runs in incremental mode, it keeps a manifest file in each
+   directory where it writes output.  For every pair of .c and .h files
+   there, the manifest records a digest of the input file, the options,
+   and the code generator itself, along with a digest of each output
+   file.  If all of those still match, there's no need to parse the input
+   again.
+"""
+
+import hashlib
+import json
+import os
+
+import trunnel
+import trunnel.Cache
+
+MANIFEST_FNAME = ".trunnel-manifest"
+
+# Bump this if the format of the manifest changes.
+MANIFEST_VERSION = 1
+
+_generatorDigest = None
+
+
+def generatorDigest():
+    """Return a digest of trunnel's version and its source code."""
+    global _generatorDigest
+    if _generatorDigest is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        items = ["trunnel-generator", trunnel.__version__]
+        for fname in sorted(os.listdir(directory)):
+            if fname.endswith(".py"):
+                with open(os.path.join(directory, fname), 'rb') as f:
+                    items.extend([fname, f.read()])
+        _generatorDigest = trunnel.Cache.digest(*items)
+    return _generatorDigest
+
+
+def inputDigest(text, options):
+    """Return a digest to identify the output that we would generate from
+       the trunnel source 'text' with the list of extra options
+       'options'."""
+    items = ["trunnel-input", generatorDigest(), text, str(len(options))]
+    items.extend(options)
+    return trunnel.Cache.digest(*items)
+
+
+def fileDigest(fname):
+    """Return a digest of the contents of the file 'fname', or None if we
+       can't read it."""
+    try:
+        with open(fname, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def fileStamp(fname):
+    """Return a tuple that changes whenever the file 'fname' is replaced
+       or modified, or None if it doesn't exist."""
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class Manifest(object):
+
+    """The manifest for a single output directory."""
+    #
+    # directory -- the directory holding the manifest and the files it
+    #    describes.
+    # entries -- a map from the basename of a pair of output files (as in
+    #    "foo" for "foo.c" and "foo.h") to a dict with these keys:
+    #       "source" -- the name of the input file.
+    #       "key" -- the inputDigest for that file.
+    #       "outputs" -- a map from each output file name to its fileDigest.
+    #       "imports" -- a list of [filename, fingerprint] for every file
+    #          that the input imports, as in trunnel.Interface.Interface.
+    # stamp -- the fileStamp of the manifest file when we loaded it.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        self.stamp = fileStamp(self.fname())
+        try:
+            with open(self.fname(), 'r') as f:
+                content = json.load(f)
+            if content.get("version") == MANIFEST_VERSION:
+                self.entries = content["entries"]
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            # A missing or unreadable manifest is the same as an empty one.
+            pass
+
+    def fname(self):
+        return os.path.join(self.directory, MANIFEST_FNAME)
+
+    def changedOnDisk(self):
+        """Return true iff somebody has saved this manifest since we
+           loaded it."""
+        return fileStamp(self.fname()) != self.stamp
+
+    def isCurrent(self, name, key):
+        """Return true iff the outputs for 'name' were generated from an
+           input with the digest 'key', and nobody has changed them
+           since."""
+        entry = self.entries.get(name)
+        if entry is None or entry.get("key") != key:
+            return False
+        outputs = entry.get("outputs", {})
+        if not outputs:
+            return False
+        for fname, digest in outputs.items():
+            if fileDigest(os.path.join(self.directory, fname)) != digest:
+                return False
+        return True
+
+    def importsOf(self, name):
+        """Return a list of (filename, fingerprint) tuples for the files
+           that the input for 'name' imported when we last generated it."""
+        entry = self.entries.get(name, {})
+        return [tuple(item) for item in entry.get("imports", [])]
+
+    def save(self):
+        content = {"version": MANIFEST_VERSION, "entries": self.entries}
+        tmpname = "%s.tmp-%d" % (self.fname(), os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump(content, f, indent=1, sort_keys=True)
+            f.write("\n")
+        os.replace(tmpname, self.fname())
+
+
+def makeEntry(source, key, directory, outputs, imports=()):
+    """Return a manifest entry for the input file 'source' with the digest
+       'key', whose output went to the files in 'outputs', in
+       'directory'.  'imports' lists the (filename, fingerprint) of each
+       file that 'source' imports."""
+    return {
+        "source": source,
+        "key": key,
+        "outputs": dict((fname, fileDigest(os.path.join(directory, fname)))
+                        for fname in outputs),
+        "imports": [list(item) for item in imports],
+    }
+
+
+def recordAll(updates):
+    """Given a list of (directory, name, entry) tuples, update the manifest
+       for each directory to hold each entry, and save them.  We reload
+       each manifest first, to lose as little as we can if some other
+       trunnel process has changed it.  Return a list of the directories
+       whose manifests we saved."""
+    byDirectory = {}
+    for directory, name, entry in updates:
+        byDirectory.setdefault(directory, []).append((name, entry))
+    for directory, entries in sorted(byDirectory.items()):
+        manifest = Manifest(directory)
+        for name, entry in entries:
+            manifest.entries[name] = entry
+        manifest.save()
+    return sorted(byDirectory)
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
@@ -0,0 +1,238 @@
+# Profile.py -- find out where trunnel spends its time.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Record how long each phase of compiling a trunnel file takes, how much
+   memory it needs, and how much code it writes.  Inside the code
+   generator, also record the same things for each sub-generator for
+   each structure.
+
+   Memory is measured with tracemalloc, when it's available.  Tracing
+   every allocation slows Python down, so the times you get while
+   profiling are only useful for comparing with one another.
+"""
+
+import json
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class CountingWriter(object):
+
+    """Wraps a file-like object, and counts the bytes written to it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, s):
+        self.count += len(s)
+        self.f.write(s)
+
+
+class Profiler(object):
+
+    """Collects a profile for any number of input files."""
+    #
+    # files -- a list of dicts, one for each input file, with these keys:
+    #    "input" -- the name of the input file.
+    #    "phases" -- a list of dicts with keys "name", "seconds",
+    #        "peak_bytes" (or None), and "output_bytes".
+    #    "structs" -- a map from each structure's name to a map from the
+    #        name of each sub-generator of CodeGenerationVisitor to a dict
+    #        with keys "seconds", "peak_bytes" (or None), and
+    #        "output_bytes".
+    # output -- the CountingWriter for the file we're writing now, or None.
+    # measuring -- a list of the _Measurements that are running now,
+    #    innermost last.
+
+    def __init__(self):
+        self.files = []
+        self.output = None
+        self.measuring = []
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def beginFile(self, input_fname):
+        self.files.append({"input": input_fname, "phases": [],
+                           "structs": {}})
+
+    def counted(self, f):
+        """Return a wrapper for the file-like object 'f' that counts what
+           we write to it, for use in the phases we run next."""
+        self.output = CountingWriter(f)
+        return self.output
+
+    def phase(self, name):
+        """Return a context manager to record a phase called 'name'."""
+        return _Measurement(self, True, self._recordPhase, name)
+
+    def codegen(self, structname, generator):
+        """Return a context manager to record how long the sub-generator
+           'generator' takes on the structure 'structname', and how much
+           memory it needs."""
+        return _Measurement(self, True, self._recordCodegen, structname,
+                            generator)
+
+    def _recordPhase(self, seconds, peak, nbytes, name):
+        self.files[-1]["phases"].append({
+            "name": name, "seconds": seconds, "peak_bytes": peak,
+            "output_bytes": nbytes})
+
+    def _recordCodegen(self, seconds, peak, nbytes, structname, generator):
+        gens = self.files[-1]["structs"].setdefault(structname, {})
+        gens[generator] = {"seconds": seconds, "peak_bytes": peak,
+                           "output_bytes": nbytes}
+
+    def asJSON(self):
+        """Return the profile as a JSON string."""
+        return json.dumps({"files": self.files}, indent=1, sort_keys=True)
+
+    def report(self, nStructs=10):
+        """Return a human-readable summary of the profile, listing at most
+           'nStructs' of the most expensive structures in each file."""
+        out = []
+        for f in self.files:
+            out.append("Profile for %s:" % f["input"])
+            out.append("  %-32s %9s %10s %10s" % (
+                "phase", "seconds", "peak KiB", "out KiB"))
+            for p in f["phases"]:
+                out.append("  %-32s %9.4f %10s %10.1f" % (
+                    p["name"], p["seconds"], _kib(p["peak_bytes"]),
+                    p["output_bytes"] / 1024.0))
+                if p["name"] == "code":
+                    for g, seconds, peak, nbytes in generatorTotals(f):
+                        out.append("    %-30s %9.4f %10s %10.1f" % (
+                            g, seconds, _kib(peak), nbytes / 1024.0))
+
+            structs = structTotals(f)
+            if structs:
+                out.append("  Most expensive structures:")
+                for name, seconds, nbytes, gens in structs[:nStructs]:
+                    slowest = max(gens.items(),
+                                  key=lambda item: item[1]["seconds"])
+                    out.append("    %-30s %9.4fs %8.1f KiB  (slowest: %s)" %
+                               (name, seconds, nbytes / 1024.0, slowest[0]))
+        return "\n".join(out) + "\n"
+
+
+def generatorTotals(f):
+    """Return a list of (generator, seconds, peak_bytes, output_bytes) for
+       the sub-generators of CodeGenerationVisitor in the profile for 'f',
+       in the order they ran.  'peak_bytes' is the most that the generator
+       needed for any one structure, or None if we don't know."""
+    totals = {}
+    order = []
+    for gens in f["structs"].values():
+        for g, m in gens.items():
+            if g not in totals:
+                totals[g] = [0.0, None, 0]
+                order.append(g)
+            totals[g][0] += m["seconds"]
+            if m.get("peak_bytes") is not None:
+                totals[g][1] = max(totals[g][1] or 0, m["peak_bytes"])
+            totals[g][2] += m["output_bytes"]
+    return [(g,) + tuple(totals[g]) for g in order]
+
+
+def structTotals(f):
+    """Return a list of (structname, seconds, output_bytes, generators) for
+       every structure in the profile for 'f', most expensive first."""
+    result = []
+    for name, gens in f["structs"].items():
+        result.append((name, sum(m["seconds"] for m in gens.values()),
+                       sum(m["output_bytes"] for m in gens.values()), gens))
+    result.sort(key=lambda item: (-item[1], item[0]))
+    return result
+
+
+def _kib(nbytes):
+    if nbytes is None:
+        return "-"
+    return "%.1f" % (nbytes / 1024.0)
+
+
+class _Measurement(object):
+
+    """Context manager for Profiler: measures the time, peak memory (if
+       'memory' is true), and output of whatever runs inside it, and passes
+       them to 'record' along with 'args'.  Measurements can nest: since
+       each one resets tracemalloc's peak when it starts, it first passes
+       the peak so far on to the measurements around it."""
+
+    def __init__(self, profiler, memory, record, *args):
+        self.profiler = profiler
+        self.memory = memory
+        self.record = record
+        self.args = args
+
+    def __enter__(self):
+        output = self.profiler.output
+        self.startBytes = output.count if output is not None else 0
+        self.startMemory = None
+        self.highWater = 0
+        if self.memory and tracemalloc is not None and \
+                tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            for outer in self.profiler.measuring:
+                outer.highWater = max(outer.highWater, peak)
+            self.startMemory = current
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self.profiler.measuring.append(self)
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        seconds = time.time() - self.t0
+        self.profiler.measuring.pop()
+        peak = None
+        if self.startMemory is not None:
+            peak = max(self.highWater,
+                       tracemalloc.get_traced_memory()[1]) - self.startMemory
+        output = self.profiler.output
+        nbytes = (output.count if output is not None else 0) - \
+            self.startBytes
+        if exc_type is None:
+            self.record(seconds, peak, nbytes, *self.args)
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
@@ -27,6 +27,7 @@
 
 import trunnel.CodeGen
 import trunnel.Grammar
+import trunnel.Interface
 
 import os
 import hashlib
@@ -197,8 +198,8 @@ class NamedInt(object):
 
 
 def encodeInt(val, width):
-    return b"".join(chr((val >> (width-i)*8) & 0xff)
-                    for i in range(1, width+1))
+    return bytes(bytearray((val >> (width-i)*8) & 0xff
+                           for i in range(1, width+1)))
 
 
 def findLength(lst):
@@ -326,7 +327,8 @@ class CorpusGenerator(trunnel.CodeGen.ASTVisitor):
     # target_dir -- where to write items
     # sort_order -- topologically sorted list of structure names
     # structExamples -- map from structure name to possible
-    #   values that we generated for that structure
+    #   values that we generated for that structure.  Extern structures
+    #   have none, so neither do the structures that contain them.
     # _expandConst -- helper function that knows how to map constant
     #   names to integers.
     # _maxFanout -- used to limit the branching factor when running
@@ -435,7 +437,8 @@ class CorpusGenerator(trunnel.CodeGen.ASTVisitor):
         #             yield i + irest, c2
 
     def visitSMStruct(self, sms):
-        for e in self.structExamples[sms.structname][:self._maxFanout]:
+        examples = self.structExamples.get(sms.structname, [])
+        for e in examples[:self._maxFanout]:
             yield [e], NIL
 
     def visitSMString(self, sms):
@@ -446,7 +449,7 @@ class CorpusGenerator(trunnel.CodeGen.ASTVisitor):
     def visitSMFixedArray(self, sma):
         w = self.expandConst(sma.width)
         if type(sma.basetype) == str:
-            examples = self.structExamples[sma.basetype]
+            examples = self.structExamples.get(sma.basetype, [])
             for e in combineExamples(examples, w, self._maxFanout):
                 yield [e], NIL
         elif str(sma.basetype) == 'char':
@@ -461,7 +464,7 @@ class CorpusGenerator(trunnel.CodeGen.ASTVisitor):
     def visitSMVarArray(self, smva):
         widthfield = smva.widthfield
         if type(smva.basetype) == str:
-            examples = self.structExamples[smva.basetype]
+            examples = self.structExamples.get(smva.basetype, [])
             yield [b""], constrain(widthfield, 0)
             c = constrain(widthfield, 1)
             for e in examples[:self._maxFanout]:
@@ -519,11 +522,24 @@ class CorpusGenerator(trunnel.CodeGen.ASTVisitor):
 
 def generate_corpus(input_fnames, target_dir):
     generator = CorpusGenerator(target_dir)
-    for input_fname in input_fnames:
+    lexer = trunnel.Grammar.Lexer()
+    parser = trunnel.Grammar.getParser()
+    interfaces = trunnel.Interface.InterfaceLoader(lexer, parser)
+    done = set()
+
+    def generate(input_fname):
+        if os.path.abspath(input_fname) in done:
+            return
+        done.add(os.path.abspath(input_fname))
         inp = open(input_fname, 'r')
-        t = trunnel.Grammar.Lexer().tokenize(inp.read())
+        t = lexer.tokenize(inp.read())
         inp.close()
-        parsed = trunnel.Grammar.Parser().parse(t)
+        parsed = parser.parse(t)
+        interfaces.resolve(parsed, os.path.dirname(input_fname))
+        # We build examples of imported structures from the examples we
+        # made for them in their own files, so do those files first.
+        for imp in parsed.imports:
+            generate(imp.path)
 
         c = trunnel.CodeGen.Checker()
         c.visit(parsed)
@@ -531,6 +547,9 @@ def generate_corpus(input_fnames, target_dir):
         generator.setChecker(c)
         generator.visit(parsed)
 
+    for input_fname in input_fnames:
+        generate(input_fname)
+
 
 if __name__ == '__main__':
     import getopt
@@ -0,0 +1,181 @@
+# Server.py -- a long-lived trunnel compile server.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Keep trunnel running, so that build systems that call it many times
+   don't have to pay for starting Python and setting up a parser every
+   time.
+
+   The server listens on a Unix socket, and hands each request to a pool
+   of worker processes, each of which keeps its parsers around between
+   requests.  See trunnel.Client for the protocol, and for a client that
+   falls back to compiling on its own when there's no server.
+
+   Before answering each request, the server checks whether any of
+   trunnel's own files have changed since it started.  If they have, it
+   refuses the request and shuts down, so that nobody gets output from an
+   out-of-date code generator.
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import socketserver
+import threading
+
+import trunnel.CodeGen
+import trunnel.Depfile
+
+
+def generatorStamp():
+    """Return a list of (fname, mtime, size) for every file that makes up
+       trunnel, so we can tell when it has changed."""
+    stamp = []
+    for fname in trunnel.Depfile.generatorFiles():
+        try:
+            st = os.stat(fname)
+            stamp.append((fname, st.st_mtime, st.st_size))
+        except OSError:
+            stamp.append((fname, None, None))
+    return stamp
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    """Answers the requests from a single client connection."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if not isinstance(request, dict) or "input" not in request:
+                    raise ValueError("Missing input file")
+            except ValueError as e:
+                response = {"ok": False, "error": "Bad request: %s" % e}
+            else:
+                response = self.server.dispatch(request)
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            if response.get("stale"):
+                return
+
+
+class CompileServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+
+    """A server that compiles trunnel files on request, using a pool of
+       'jobs' worker processes."""
+    #
+    # pool -- the multiprocessing.Pool that does the actual work.
+    # stamp -- the generatorStamp() from when we started.
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, jobs=1, parser_engine="earley"):
+        if os.path.exists(socket_path):
+            # Probably left over from a server that didn't exit cleanly.
+            os.unlink(socket_path)
+        self.stamp = generatorStamp()
+        # Start the workers before we start any threads.
+        self.pool = multiprocessing.Pool(jobs, _initWorker, (parser_engine,))
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               RequestHandler)
+
+    def dispatch(self, request):
+        """Return the response to 'request'."""
+        if generatorStamp() != self.stamp:
+            threading.Thread(target=self.shutdown).start()
+            return {"ok": False, "stale": True,
+                    "error": "Trunnel has changed since the server started"}
+        return self.pool.apply(_handleInWorker, (request,))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def serve(socket_path, jobs=1, parser_engine="earley"):
+    """Answer compile requests on the Unix socket 'socket_path' until we
+       are interrupted or killed, or until trunnel changes."""
+    server = CompileServer(socket_path, jobs, parser_engine)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# In a worker process, the parser engine to use, and a map from
+# (options, target_dir, incremental) to the Compiler for those settings.
+_workerEngine = None
+_workerCompilers = {}
+
+
+def _initWorker(parser_engine):
+    global _workerEngine
+    # Leave it to the server to decide when the workers should exit.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _workerEngine = parser_engine
+
+
+def _handleInWorker(request):
+    """Compile the file that 'request' asks for, and return a response."""
+    options = tuple(request.get("options") or ())
+    target_dir = request.get("target_dir")
+    incremental = bool(request.get("incremental"))
+    key = (options, target_dir, incremental)
+    compiler = _workerCompilers.get(key)
+    if compiler is None:
+        compiler = trunnel.CodeGen.Compiler(options, target_dir,
+                                            _workerEngine, incremental)
+        _workerCompilers[key] = compiler
+    try:
+        timings = compiler.compile(request["input"])
+        compiler.finish()
+    except Exception as e:
+        compiler.manifest_updates = []
+        return {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+    return {"ok": True, "timings": timings}
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
@@ -0,0 +1,210 @@
+# Watch.py -- regenerate trunnel output whenever the input changes.
+#
+# Copyright 2014, The Tor Project, Inc.
+# See license at the end of this file for copying information.
+
+"""Keep trunnel running while you edit your trunnel files, and regenerate
+   the code for each one as soon as it changes.
+
+   We poll the files under a directory, rather than asking the operating
+   system to tell us about changes, so that this works everywhere.  We
+   only read a file when its modification time or size changes, and only
+   regenerate its code when its contents have changed too.  When a file
+   changes, we also regenerate every file that imports it, directly or
+   not.  All of this uses a single trunnel.CodeGen.Compiler, so we only
+   set up a parser once.
+"""
+
+import hashlib
+import os
+import signal
+import sys
+import time
+
+import trunnel.CodeGen
+
+# How many seconds to wait between looking for changes.
+POLL_INTERVAL = 0.5
+
+
+def findInputs(directory):
+    """Return a sorted list of every trunnel file under 'directory'."""
+    result = []
+    for dirpath, dirnames, fnames in os.walk(directory):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for fname in fnames:
+            if fname.endswith(".trunnel"):
+                result.append(os.path.join(dirpath, fname))
+    return sorted(result)
+
+
+class Watcher(object):
+
+    """Regenerates the code for the trunnel files under a directory when
+       they change."""
+    #
+    # directory -- the directory we're watching.
+    # compiler -- the trunnel.CodeGen.Compiler we use for every file.
+    # stamps -- a map from each file we've seen to a tuple of its
+    #    modification time, its size, and a digest of its contents.
+    # imports -- a map from each file we've compiled, or at least parsed,
+    #    to a set of the absolute names of the files it imports.
+
+    def __init__(self, directory, extra_options=(), target_dir=None,
+                 parser_engine="earley", incremental=False, struct_jobs=1):
+        self.directory = directory
+        self.compiler = trunnel.CodeGen.Compiler(
+            extra_options, target_dir, parser_engine, incremental,
+            struct_jobs=struct_jobs)
+        self.stamps = {}
+        self.imports = {}
+
+    def changedFiles(self):
+        """Return a sorted list of the files whose contents have changed
+           since we last looked, including any new files.  Forget about
+           files that have gone away."""
+        changed = []
+        present = set()
+        for fname in findInputs(self.directory):
+            present.add(fname)
+            try:
+                st = os.stat(fname)
+                old = self.stamps.get(fname)
+                if old is not None and old[:2] == (st.st_mtime, st.st_size):
+                    continue
+                with open(fname, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+            except (IOError, OSError):
+                # It went away while we were looking; we'll notice later.
+                continue
+            self.stamps[fname] = (st.st_mtime, st.st_size, digest)
+            if old is None or old[2] != digest:
+                changed.append(fname)
+        for fname in list(self.stamps):
+            if fname not in present:
+                del self.stamps[fname]
+                self.imports.pop(fname, None)
+        return changed
+
+    def affectedFiles(self, changed):
+        """Return a sorted list of the files in 'changed', along with every
+           file that imports one of them, directly or not."""
+        result = set(changed)
+        paths = set(os.path.abspath(fname) for fname in result)
+        grew = True
+        while grew:
+            grew = False
+            for fname, imported in self.imports.items():
+                if fname not in result and imported & paths:
+                    result.add(fname)
+                    paths.add(os.path.abspath(fname))
+                    grew = True
+        return sorted(fname for fname in result if fname in self.stamps)
+
+    def poll(self):
+        """Regenerate the code for every file that needs it.  Return a list
+           of (filename, timings, exception) tuples as for
+           trunnel.CodeGen.generate_code_batch, one for each file that we
+           regenerated."""
+        results = []
+        for fname in self.affectedFiles(self.changedFiles()):
+            try:
+                timings = self.compiler.compile(fname)
+            except Exception as e:
+                results.append((fname, None, e))
+                # If we failed because of a file it imports, we need to
+                # try again once that file is fixed.
+                imported = self.parsedImports(fname)
+                if imported is not None:
+                    self.imports[fname] = imported
+                continue
+            results.append((fname, timings, None))
+            iface = self.compiler.interfaces.load(os.path.abspath(fname))
+            self.imports[fname] = set(path for path, _ in iface.imports)
+        self.compiler.finish()
+        return results
+
+    def parsedImports(self, fname):
+        """Return a set of the absolute names of the files that 'fname'
+           says it imports, or None if we can't parse it."""
+        try:
+            with open(fname, 'r') as f:
+                text = f.read()
+            parsed = self.compiler.parser.parse(
+                self.compiler.lexer.itertokens(text))
+        except Exception:
+            return None
+        directory = os.path.dirname(fname)
+        return set(os.path.abspath(os.path.join(directory, imp.fname))
+                   for imp in parsed.imports)
+
+
+def watch(directory, extra_options=(), target_dir=None,
+          parser_engine="earley", incremental=False, struct_jobs=1,
+          interval=POLL_INTERVAL, out=sys.stdout):
+    """Regenerate the code for the trunnel files under 'directory' as they
+       change, until we are interrupted or killed.  Write how long each
+       regeneration took to 'out'."""
+    watcher = Watcher(directory, extra_options, target_dir, parser_engine,
+                      incremental, struct_jobs)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    out.write("Watching %s for changes\n" % directory)
+    out.flush()
+    try:
+        while True:
+            t0 = time.time()
+            results = watcher.poll()
+            if results:
+                report(results, time.time() - t0, out)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def report(results, elapsed, out):
+    """Write a description of the results of one Watcher.poll() to 'out',
+       given that it took 'elapsed' seconds."""
+    n_failed = 0
+    for fname, timings, err in results:
+        if err is not None:
+            n_failed += 1
+            out.write("  FAILED %s: %s\n" % (fname, err))
+            continue
+        out.write("%8.3fs %s (%s)\n" % (
+            sum(t for _, t in timings), fname,
+            ", ".join("%s %.3fs" % pt for pt in timings)))
+    out.write("%8.3fs to regenerate %d files, %d failed\n" % (
+        elapsed, len(results), n_failed))
+    out.flush()
+
+__license__ = """
+Copyright 2014  The Tor Project, Inc.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+    * Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+    * Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following disclaimer
+in the documentation and/or other materials provided with the
+distribution.
+
+    * Neither the names of the copyright owners nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
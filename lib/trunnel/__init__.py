@@ -4,3 +4,14 @@
 #
 
 __version__ = "1.5.3"
+
+
+def compile_string(source, options=(), basename="trunnel",
+                   parser_engine="earley", import_dir=""):
+    """Generate code from the trunnel source in 'source', and return a
+       tuple of the header and the C code.  See
+       trunnel.CodeGen.compile_string."""
+    # Import this here, so that "import trunnel" stays quick.
+    import trunnel.CodeGen
+    return trunnel.CodeGen.compile_string(source, options, basename,
+                                          parser_engine, import_dir)
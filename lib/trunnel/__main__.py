@@ -7,16 +7,33 @@ if __name__ == '__main__':
     import sys
     import trunnel.Boilerplate
     import trunnel.CodeGen
+    import trunnel.Depfile
+    import trunnel.Grammar
     import getopt
+    import time
 
     opts, args = getopt.gnu_getopt(
-        sys.argv[1:], "O:",
-        ["option=", "write-c-files", "target-dir=", "require-version="])
+        sys.argv[1:], "O:j:",
+        ["option=", "write-c-files", "target-dir=", "require-version=",
+         "parser=", "batch", "jobs=", "incremental", "depfile=", "serve=",
+         "profile", "profile-json=", "struct-jobs=",
+         "check-only", "watch="])
 
     more_options = []
     target_dir = None
     write_c_files = None
     need_version = None
+    parser_engine = trunnel.Grammar.PARSER_ENGINES[0]
+    batch = False
+    jobs = 1
+    struct_jobs = 1
+    incremental = False
+    check_only = False
+    depfile = None
+    serve_socket = None
+    watch_dir = None
+    profile = False
+    profile_json = None
 
     for (k, v) in opts:
         if k in ('-O', '--option'):
@@ -27,6 +44,45 @@ if __name__ == '__main__':
             target_dir = v
         elif k == '--require-version':
             need_version = v
+        elif k == '--parser':
+            if v not in trunnel.Grammar.PARSER_ENGINES:
+                sys.stderr.write("Unknown parser %r; try one of: %s\n" % (
+                    v, ", ".join(trunnel.Grammar.PARSER_ENGINES)))
+                sys.exit(1)
+            parser_engine = v
+        elif k == '--batch':
+            batch = True
+        elif k == '--profile':
+            profile = True
+        elif k == '--profile-json':
+            profile = True
+            profile_json = v
+        elif k == '--serve':
+            serve_socket = v
+        elif k == '--watch':
+            watch_dir = v
+        elif k == '--depfile':
+            depfile = v
+        elif k == '--incremental':
+            incremental = True
+        elif k == '--check-only':
+            check_only = True
+        elif k in ('-j', '--jobs'):
+            try:
+                jobs = int(v)
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                sys.stderr.write("--jobs needs a positive number\n")
+                sys.exit(1)
+        elif k == '--struct-jobs':
+            try:
+                struct_jobs = int(v)
+            except ValueError:
+                struct_jobs = 0
+            if struct_jobs < 1:
+                sys.stderr.write("--struct-jobs needs a positive number\n")
+                sys.exit(1)
 
     if need_version is not None:
         try:
@@ -38,16 +94,117 @@ if __name__ == '__main__':
         except ImportError:
             print("Can't import")
 
+    if serve_socket is not None:
+        import trunnel.Server
+        trunnel.Server.serve(serve_socket, jobs=jobs,
+                             parser_engine=parser_engine)
+        sys.exit(0)
+
+    if watch_dir is not None:
+        if args or batch or jobs > 1 or check_only or profile or \
+                depfile is not None:
+            sys.stderr.write("--watch doesn't take input files, and doesn't "
+                             "work with --batch, --jobs, --check-only, "
+                             "--profile, or --depfile\n")
+            sys.exit(1)
+        import trunnel.Watch
+        if write_c_files:
+            trunnel.Boilerplate.emit(target_dir=target_dir,
+                                     only_if_changed=incremental)
+        trunnel.Watch.watch(watch_dir, more_options, target_dir,
+                            parser_engine, incremental, struct_jobs)
+        sys.exit(0)
+
     if len(args) < 1 and not write_c_files and not need_version:
         sys.stderr.write("Syntax: python -m trunnel <fname>\n")
         sys.exit(1)
 
-    for filename in args:
-        trunnel.CodeGen.generate_code(filename, more_options,
-                                      target_dir=target_dir)
+    if profile and (batch or jobs > 1):
+        sys.stderr.write("--profile doesn't work with --batch or --jobs\n")
+        sys.exit(1)
+
+    if check_only and (write_c_files or depfile is not None or profile):
+        sys.stderr.write("--check-only doesn't work with --write-c-files, "
+                         "--depfile, or --profile\n")
+        sys.exit(1)
+
+    if struct_jobs > 1 and (batch or jobs > 1 or profile):
+        sys.stderr.write("--struct-jobs doesn't work with --batch, --jobs, "
+                         "or --profile\n")
+        sys.exit(1)
+
+    if batch:
+        started = time.time()
+        setup_time, results = trunnel.CodeGen.generate_code_batch(
+            args, more_options, target_dir=target_dir,
+            parser_engine=parser_engine, jobs=jobs, incremental=incremental,
+            check_only=check_only)
+        totals = {}
+        n_failed = n_current = 0
+        for filename, timings, err in results:
+            if err is not None:
+                n_failed += 1
+                print("  FAILED %s: %s" % (filename, err))
+                continue
+            if timings[0][0] == "up-to-date":
+                n_current += 1
+            for phase, t in timings:
+                totals[phase] = totals.get(phase, 0) + t
+            print("%8.3fs %s (%s)" % (
+                sum(t for _, t in timings), filename,
+                ", ".join("%s %.3fs" % pt for pt in timings)))
+        print("%8.3fs total for %d files, %d failed, %d up to date "
+              "(setup %.3fs, %s)" % (
+            time.time() - started, len(results), n_failed, n_current,
+            setup_time,
+            ", ".join("%s %.3fs" % (phase, totals.get(phase, 0))
+                      for phase in ("parse", "check", "generate"))))
+        if n_failed:
+            sys.exit(1)
+    elif jobs > 1 or check_only:
+        _, results = trunnel.CodeGen.generate_code_batch(
+            args, more_options, target_dir=target_dir,
+            parser_engine=parser_engine, jobs=jobs, incremental=incremental,
+            check_only=check_only)
+        failed = False
+        for filename, _, err in results:
+            if err is not None:
+                sys.stderr.write("%s: %s: %s\n" % (
+                    filename, type(err).__name__, err))
+                failed = True
+        if failed:
+            sys.exit(1)
+    elif args:
+        profiler = None
+        if profile:
+            import trunnel.Profile
+            profiler = trunnel.Profile.Profiler()
+        compiler = trunnel.CodeGen.Compiler(more_options, target_dir,
+                                            parser_engine, incremental,
+                                            profiler, struct_jobs)
+        try:
+            for filename in args:
+                compiler.compile(filename)
+        finally:
+            compiler.finish()
+        if profiler is not None:
+            profiler.stop()
+            if profile_json is None:
+                sys.stdout.write(profiler.report())
+            elif profile_json == '-':
+                sys.stdout.write(profiler.asJSON() + "\n")
+            else:
+                with open(profile_json, 'w') as f:
+                    f.write(profiler.asJSON() + "\n")
 
     if write_c_files:
-        trunnel.Boilerplate.emit(target_dir=target_dir)
+        trunnel.Boilerplate.emit(target_dir=target_dir,
+                                 only_if_changed=incremental)
+
+    if depfile is not None:
+        trunnel.Depfile.write_depfile(depfile, args, target_dir=target_dir,
+                                      write_c_files=write_c_files,
+                                      only_if_changed=incremental)
 
 
 __license__ = """
@@ -209,6 +209,75 @@ trunnel_strdup(const char *s)
     trunnel_memwipe((da)->elts_, (da)->allocated_ * sizeof((da)->elts_[0])); \
   } while (0)
 
+/* A dynamic array is "borrowed" when its elements are really part of
+ * somebody else's buffer, as when we parse a byte array in zero_copy
+ * mode.  We mark a borrowed array by leaving allocated_ at 0, which is
+ * otherwise only possible when elts_ is NULL.  We never free or modify the
+ * elements of a borrowed array: before changing one, we make a copy of its
+ * elements with TRUNNEL_DYNARRAY_OWN. */
+
+/** Make the empty dynamic array 'da' a view of the 'n' elements at 'ptr'. */
+#define TRUNNEL_DYNARRAY_BORROW(da, ptr, n) do {                 \
+    trunnel_assert((da)->elts_ == NULL);                         \
+    (da)->elts_ = (n) ? (void *)(ptr) : NULL;                    \
+    (da)->n_ = (n);                                              \
+    (da)->allocated_ = 0;                                        \
+  } while (0)
+
+/** Return true iff 'da' is a view of somebody else's buffer. */
+#define TRUNNEL_DYNARRAY_IS_BORROWED(da)                        \
+  ((da)->allocated_ == 0 && (da)->elts_ != NULL)
+
+/** If 'da' is borrowed, replace its elements with a copy that we own, so
+ * that we can change them.  On failure, run the code in 'on_fail' and goto
+ * trunnel_alloc_failed. */
+#define TRUNNEL_DYNARRAY_OWN(elttype, da, on_fail) do {                 \
+    if (TRUNNEL_DYNARRAY_IS_BORROWED(da)) {                             \
+      elttype *newarray;                                                \
+      newarray = trunnel_dynarray_own(&(da)->allocated_, (da)->elts_,   \
+                                      (da)->n_, sizeof(elttype));       \
+      if (newarray == NULL) {                                           \
+        on_fail;                                                        \
+        goto trunnel_alloc_failed;                                      \
+      }                                                                 \
+      (da)->elts_ = newarray;                                           \
+    }                                                                   \
+  } while (0)
+
+/** If 'da' is borrowed, make it empty without freeing its elements. */
+#define TRUNNEL_DYNARRAY_DISOWN(da) do {                \
+    if (TRUNNEL_DYNARRAY_IS_BORROWED(da)) {             \
+      (da)->elts_ = NULL;                               \
+      (da)->n_ = 0;                                     \
+    }                                                   \
+  } while (0)
+
+/** Expand the dynamic array 'da' of 'elttype', as TRUNNEL_DYNARRAY_EXPAND,
+ * but using memory from the trunnel_arena_t 'arena'. */
+#define TRUNNEL_ARENA_DYNARRAY_EXPAND(arena, elttype, da, howmanymore,  \
+                                      on_fail) do {                     \
+    elttype *newarray;                                                  \
+    newarray = trunnel_arena_dynarray_expand((arena), &(da)->allocated_, \
+                                             (da)->elts_, (da)->n_,     \
+                                             (howmanymore),             \
+                                             sizeof(elttype));          \
+    if (newarray == NULL) {                                             \
+      on_fail;                                                          \
+      goto trunnel_alloc_failed;                                        \
+    }                                                                   \
+    (da)->elts_ = newarray;                                             \
+  } while (0)
+
+/** Add 'v' to the end of the dynamic array 'da' of 'elttype', as
+ * TRUNNEL_DYNARRAY_ADD, but using memory from the trunnel_arena_t
+ * 'arena'. */
+#define TRUNNEL_ARENA_DYNARRAY_ADD(arena, elttype, da, v, on_fail) do { \
+      if ((da)->n_ == (da)->allocated_) {                               \
+        TRUNNEL_ARENA_DYNARRAY_EXPAND(arena, elttype, da, 1, on_fail);  \
+      }                                                                 \
+      (da)->elts_[(da)->n_++] = (v);                                    \
+    } while (0)
+
 /** Helper: wraps or implements an OpenBSD-style reallocarray.  Behaves
  * as realloc(a, x*y), but verifies that no overflow will occur in the
  * multiplication. Returns NULL on failure. */
@@ -227,6 +296,39 @@ void *trunnel_reallocarray(void *a, size_t x, size_t y);
 void *trunnel_dynarray_expand(size_t *allocated_p, void *ptr,
                               size_t howmanymore, size_t eltsize);
 
+/** Helper to stop borrowing a dynamic array. Behaves as
+ * TRUNNEL_DYNARRAY_OWN(), taking a pointer to the current number of
+ * allocated elements in 'allocated_p', the 'n' borrowed elements in 'ptr',
+ * and the size of a single element in 'eltsize'.
+ *
+ * On success, adjust *allocated_p, and return a newly allocated copy of the
+ * elements.  On failure, adjust nothing and return NULL.
+ */
+void *trunnel_dynarray_own(size_t *allocated_p, const void *ptr,
+                           size_t n, size_t eltsize);
+
+/** Helper: return a pointer to 'n' bytes of uninitialized memory from
+ * 'arena', suitably aligned for any of the types that trunnel generates.
+ * The memory stays valid until the arena is reset or destroyed.  Return
+ * NULL on failure. */
+void *trunnel_arena_alloc(trunnel_arena_t *arena, size_t n);
+
+/** Helper to expand a dynamic array whose elements are in 'arena'. Behaves
+ * as trunnel_dynarray_expand(), but takes the number of elements in use in
+ * 'n', and copies them to the new array rather than reallocating the old
+ * one. */
+void *trunnel_arena_dynarray_expand(trunnel_arena_t *arena,
+                                    size_t *allocated_p, const void *ptr,
+                                    size_t n, size_t howmanymore,
+                                    size_t eltsize);
+
+/** Helper: as trunnel_string_setstr0(), but make 'str' hold a copy of
+ * 'inp' in memory from 'arena'.  'str' must be empty.  Return 0 on success
+ * and -1 on failure. */
+int trunnel_arena_string_setstr0(trunnel_arena_t *arena,
+                                 trunnel_string_t *str, const char *inp,
+                                 size_t len);
+
 /** Type for a function to free members of a dynarray of pointers. */
 typedef void (*trunnel_free_fn_t)(void *);
 
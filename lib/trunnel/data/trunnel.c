@@ -7,6 +7,7 @@
  */
 
 #include "trunnel-impl.h"
+#include <stddef.h>
 #include <stdlib.h>
 #include <string.h>
 
@@ -115,6 +116,19 @@ trunnel_dynarray_expand(size_t *allocated_p, void *ptr,
   return newarray;
 }
 
+void *
+trunnel_dynarray_own(size_t *allocated_p, const void *ptr,
+                     size_t n, size_t eltsize)
+{
+  void *newarray;
+  trunnel_assert(*allocated_p == 0);
+  newarray = trunnel_dynarray_expand(allocated_p, NULL, n, eltsize);
+  if (newarray == NULL)
+    return NULL;
+  memcpy(newarray, ptr, n * eltsize);
+  return newarray;
+}
+
 #ifndef trunnel_reallocarray
 void *
 trunnel_reallocarray(void *a, size_t x, size_t y)
@@ -214,6 +228,166 @@ trunnel_dynarray_setlen(size_t *allocated_p, size_t *len_p,
   return NULL;
 }
 
+/* ====== arenas ======== */
+
+/* An arena is a list of chunks of heap memory.  We allocate from the end
+ * of the first chunk, and start a new chunk when that one is full. */
+
+/** Union of the types that need the strictest alignment in trunnel
+ * objects.  Every allocation from an arena is a multiple of its size. */
+typedef union trunnel_arena_align_u {
+  void *p;
+  uint64_t u64;
+  size_t sz;
+  double d;
+} trunnel_arena_align_t;
+
+#define TRUNNEL_ARENA_ALIGN (sizeof(trunnel_arena_align_t))
+
+/** Default for the number of usable bytes in each chunk of an arena. */
+#define TRUNNEL_ARENA_DEFAULT_CHUNK_SIZE 4096
+
+typedef struct trunnel_arena_chunk_st {
+  /** The next chunk in the arena, or NULL. */
+  struct trunnel_arena_chunk_st *next;
+  /** The number of usable bytes in this chunk. */
+  size_t size;
+  /** The number of those bytes that we have handed out. */
+  size_t used;
+  /** The start of the usable bytes. */
+  trunnel_arena_align_t mem[1];
+} trunnel_arena_chunk_t;
+
+#define TRUNNEL_ARENA_CHUNK_HEADER_LEN (offsetof(trunnel_arena_chunk_t, mem))
+
+struct trunnel_arena_st {
+  /** The chunks in this arena, starting with the one we allocate from. */
+  trunnel_arena_chunk_t *chunks;
+  /** The number of usable bytes in a new chunk. */
+  size_t chunk_size;
+};
+
+trunnel_arena_t *
+trunnel_arena_new(size_t chunk_size)
+{
+  trunnel_arena_t *arena = trunnel_malloc(sizeof(trunnel_arena_t));
+  if (arena == NULL)
+    return NULL;
+  arena->chunks = NULL;
+  arena->chunk_size = chunk_size ? chunk_size : TRUNNEL_ARENA_DEFAULT_CHUNK_SIZE;
+  return arena;
+}
+
+void *
+trunnel_arena_alloc(trunnel_arena_t *arena, size_t n)
+{
+  trunnel_arena_chunk_t *chunk = arena->chunks;
+  void *result;
+
+  if (n > SIZE_MAX - TRUNNEL_ARENA_ALIGN)
+    return NULL;
+  if (n == 0)
+    n = 1;
+  n = ((n + TRUNNEL_ARENA_ALIGN - 1) / TRUNNEL_ARENA_ALIGN) * TRUNNEL_ARENA_ALIGN;
+
+  if (chunk == NULL || chunk->size - chunk->used < n) {
+    size_t size = n > arena->chunk_size ? n : arena->chunk_size;
+    trunnel_arena_chunk_t *newchunk;
+    if (size > SIZE_MAX - TRUNNEL_ARENA_CHUNK_HEADER_LEN)
+      return NULL;
+    newchunk = trunnel_malloc(TRUNNEL_ARENA_CHUNK_HEADER_LEN + size);
+    if (newchunk == NULL)
+      return NULL;
+    newchunk->size = size;
+    newchunk->used = 0;
+    if (chunk != NULL && size > arena->chunk_size) {
+      /* This is bigger than a whole chunk: give it a chunk of its own, but
+       * keep allocating from the current one. */
+      newchunk->next = chunk->next;
+      chunk->next = newchunk;
+    } else {
+      newchunk->next = chunk;
+      arena->chunks = newchunk;
+    }
+    chunk = newchunk;
+  }
+
+  result = ((char *)chunk->mem) + chunk->used;
+  chunk->used += n;
+  return result;
+}
+
+void *
+trunnel_arena_dynarray_expand(trunnel_arena_t *arena,
+                              size_t *allocated_p, const void *ptr,
+                              size_t n, size_t howmanymore,
+                              size_t eltsize)
+{
+  size_t newsize = howmanymore + *allocated_p;
+  void *newarray;
+  trunnel_assert(n <= *allocated_p);
+  if (newsize < 8)
+    newsize = 8;
+  if (newsize < *allocated_p * 2)
+    newsize = *allocated_p * 2;
+  if (newsize <= *allocated_p || newsize < howmanymore ||
+      newsize > SIZE_MAX / eltsize)
+    return NULL;
+  newarray = trunnel_arena_alloc(arena, newsize * eltsize);
+  if (newarray == NULL)
+    return NULL;
+  if (n)
+    memcpy(newarray, ptr, n * eltsize);
+
+  *allocated_p = newsize;
+  return newarray;
+}
+
+int
+trunnel_arena_string_setstr0(trunnel_arena_t *arena, trunnel_string_t *str,
+                             const char *val, size_t len)
+{
+  trunnel_assert(str->elts_ == NULL);
+  if (len == SIZE_MAX)
+    return -1;
+  str->elts_ = trunnel_arena_alloc(arena, len + 1);
+  if (str->elts_ == NULL)
+    return -1;
+  memcpy(str->elts_, val, len);
+  str->elts_[len] = 0;
+  str->n_ = len;
+  str->allocated_ = len + 1;
+  return 0;
+}
+
+void
+trunnel_arena_reset(trunnel_arena_t *arena)
+{
+  trunnel_arena_chunk_t *chunk, *next;
+  if (arena->chunks == NULL)
+    return;
+  /* Keep the chunk that we were allocating from. */
+  for (chunk = arena->chunks->next; chunk; chunk = next) {
+    next = chunk->next;
+    trunnel_free_(chunk);
+  }
+  arena->chunks->next = NULL;
+  arena->chunks->used = 0;
+}
+
+void
+trunnel_arena_destroy(trunnel_arena_t *arena)
+{
+  trunnel_arena_chunk_t *chunk, *next;
+  if (arena == NULL)
+    return;
+  for (chunk = arena->chunks; chunk; chunk = next) {
+    next = chunk->next;
+    trunnel_free_(chunk);
+  }
+  trunnel_free_(arena);
+}
+
 /*
 Copyright 2014  The Tor Project, Inc.
 
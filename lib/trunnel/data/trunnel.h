@@ -25,6 +25,24 @@
 /** Typedef used for storing variable-length arrays of char. */
 typedef TRUNNEL_DYNARRAY_HEAD(trunnel_string_st, char) trunnel_string_t;
 
+/** An arena of memory that the typename_parse_arena() functions allocate
+ * parsed objects from.  Everything allocated from an arena is released at
+ * once, by trunnel_arena_reset() or trunnel_arena_destroy(). */
+typedef struct trunnel_arena_st trunnel_arena_t;
+
+/** Return a new empty arena that allocates memory from the heap in chunks
+ * of 'chunk_size' bytes, or in chunks of a reasonable default size if
+ * 'chunk_size' is 0.  Return NULL on failure. */
+trunnel_arena_t *trunnel_arena_new(size_t chunk_size);
+
+/** Release everything that has been allocated from 'arena', but keep
+ * 'arena' and some of its memory around for reuse. */
+void trunnel_arena_reset(trunnel_arena_t *arena);
+
+/** Release everything that has been allocated from 'arena', and 'arena'
+ * itself.  (Do nothing if 'arena' is NULL.) */
+void trunnel_arena_destroy(trunnel_arena_t *arena);
+
 #endif
 
 /*
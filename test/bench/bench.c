@@ -0,0 +1,158 @@
+/* bench.c -- time parsing and encoding of structures with many
+ *   fixed-width fields.
+ *
+ * Copyright 2014 The Tor Project, Inc.
+ * See LICENSE file for copying information.
+ *
+ * Run "make bench" from the test directory.  Since the same program is
+ * built from whatever the current trunnel generates, you can compare the
+ * numbers it gives for different versions of trunnel.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include "bench/cells.h"
+
+/* How many times to call the function in each round, and how many rounds
+ * to time.  We report the fastest round. */
+#define N_ITERATIONS 1000000
+#define N_ROUNDS 5
+
+static uint8_t inp[512];
+static size_t inp_len;
+static uint8_t out[512];
+static bench_header_t *header;
+static bench_cell_t *cell;
+
+static double
+now(void)
+{
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static ssize_t
+header_parse(void)
+{
+  bench_header_t *h = NULL;
+  ssize_t r = bench_header_parse(&h, inp + 8, inp_len - 8);
+  bench_header_free(h);
+  return r;
+}
+
+static ssize_t
+header_validate(void)
+{
+  return bench_header_validate(inp + 8, inp_len - 8);
+}
+
+static ssize_t
+header_encode(void)
+{
+  return bench_header_encode(out, sizeof(out), header);
+}
+
+static ssize_t
+cell_parse(void)
+{
+  bench_cell_t *c = NULL;
+  ssize_t r = bench_cell_parse(&c, inp, inp_len);
+  bench_cell_free(c);
+  return r;
+}
+
+static ssize_t
+cell_validate(void)
+{
+  return bench_cell_validate(inp, inp_len);
+}
+
+static ssize_t
+cell_encode(void)
+{
+  return bench_cell_encode(out, sizeof(out), cell);
+}
+
+static void
+run(const char *what, ssize_t (*fn)(void))
+{
+  double best = 0;
+  int i, round;
+  for (round = 0; round < N_ROUNDS; ++round) {
+    double start = now(), elapsed;
+    for (i = 0; i < N_ITERATIONS; ++i) {
+      if (fn() < 0) {
+        fprintf(stderr, "%s failed\n", what);
+        exit(1);
+      }
+    }
+    elapsed = now() - start;
+    if (round == 0 || elapsed < best)
+      best = elapsed;
+  }
+  printf("%-20s %7.1f ns/call\n", what, best * 1e9 / N_ITERATIONS);
+}
+
+static void
+make_cell(int command)
+{
+  bench_cell_t *c = bench_cell_new();
+  bench_header_t *h = bench_header_new();
+  ssize_t len;
+  int i;
+
+  bench_header_set_version(h, 3);
+  bench_header_set_length(h, 509);
+  bench_header_set_stream_id(h, 0x11223344);
+  bench_header_set_timestamp(h, 1400000000);
+  bench_cell_set_header(c, h);
+  bench_cell_set_circ_id(c, 0x80000001);
+  bench_cell_set_command(c, command);
+  bench_cell_set_window(c, 1000);
+  for (i = 0; i < 4; ++i)
+    bench_cell_add_words(c, i);
+  bench_cell_set_n_words(c, 4);
+  bench_cell_set_port(c, 9001);
+  bench_cell_set_addr(c, 0x7f000001);
+  for (i = 0; i < 5; ++i)
+    bench_cell_set_nickname(c, i, "bench"[i]);
+  bench_cell_set_body_seq(c, 7);
+  bench_cell_set_body_count(c, 4);
+  for (i = 0; i < 16; ++i)
+    bench_cell_add_trailer(c, i);
+
+  len = bench_cell_encode(inp, sizeof(inp), c);
+  bench_cell_free(c);
+  if (len < 0) {
+    fprintf(stderr, "Couldn't encode a cell: %d\n", (int)len);
+    exit(1);
+  }
+  inp_len = len;
+}
+
+int
+main(void)
+{
+  int command;
+
+  for (command = 1; command <= 2; ++command) {
+    printf("Cells with command %d:\n", command);
+    make_cell(command);
+    bench_header_parse(&header, inp + 8, inp_len - 8);
+    bench_cell_parse(&cell, inp, inp_len);
+
+    run("  header parse", header_parse);
+    run("  header validate", header_validate);
+    run("  header encode", header_encode);
+    run("  cell parse", cell_parse);
+    run("  cell validate", cell_validate);
+    run("  cell encode", cell_encode);
+
+    bench_header_free(header);
+    bench_cell_free(cell);
+  }
+  return 0;
+}
@@ -22,6 +22,9 @@ struct testgroup_t test_groups[] = {
   { "contexts/varsize2/", contexts_varsize2_tests },
   { "contexts/complex/", contexts_complex_tests },
   { "positions/", positions_tests },
+  { "zero-copy/", zero_copy_tests },
+  { "arena/", arena_tests },
+  { "runs/", runs_tests },
   END_OF_GROUPS,
 };
 
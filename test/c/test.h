@@ -32,6 +32,9 @@ extern struct testcase_t contexts_varsize_tests[];
 extern struct testcase_t contexts_varsize2_tests[];
 extern struct testcase_t contexts_complex_tests[];
 extern struct testcase_t positions_tests[];
+extern struct testcase_t zero_copy_tests[];
+extern struct testcase_t arena_tests[];
+extern struct testcase_t runs_tests[];
 
 ssize_t unhex(uint8_t *out, size_t outlen, const char *in);
 const uint8_t *ux(const char *in);
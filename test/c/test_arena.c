@@ -0,0 +1,183 @@
+#include "test.h"
+#include "valid/arena.h"
+
+/* n=2, body, name, label, words, pts, corners, tag=3, ulen=6, more, rest */
+#define AR_MSG_HEX "02" "AABB" "686900" "7879" "00010002" \
+  "010203" "020405" "030607" "040809" "03" "06" "050A0B" "060C0D" \
+  "070E0F" "081011" "091213"
+#define AR_MSG_LEN 41
+
+static void
+test_arena_parse(void *arg)
+{
+  trunnel_arena_t *arena = NULL;
+  ar_msg_t *msg = NULL, *heap_msg = NULL;
+  uint8_t buf[64];
+  (void)arg;
+
+  arena = trunnel_arena_new(0);
+  tt_assert(arena);
+
+  /* Truncated, and invalid. */
+  tt_int_op(-2, ==, ar_msg_parse_arena(&msg, ux(AR_MSG_HEX), 20, arena));
+  tt_ptr_op(msg, ==, NULL);
+  tt_int_op(-1, ==, ar_msg_parse_arena(&msg, ux("00" "00" "" "00000000"
+                                                "00" "0000" "0000"), 11,
+                                       arena));
+  tt_ptr_op(msg, ==, NULL);
+
+  tt_int_op(AR_MSG_LEN, ==, ar_msg_validate(ux(AR_MSG_HEX), AR_MSG_LEN));
+  tt_int_op(AR_MSG_LEN, ==,
+            ar_msg_parse_arena(&msg, ux(AR_MSG_HEX), AR_MSG_LEN, arena));
+  tt_int_op(2, ==, ar_msg_getlen_body(msg));
+  tt_int_op(0xbb, ==, ar_msg_get_body(msg, 1));
+  tt_str_op(ar_msg_get_name(msg), ==, "hi");
+  tt_str_op(ar_msg_getstr_label(msg), ==, "xy");
+  tt_int_op(2, ==, ar_msg_get_words(msg, 1));
+  tt_int_op(2, ==, ar_point_get_x(ar_msg_get_pts(msg, 1)));
+  tt_int_op(0x0405, ==, ar_point_get_y(ar_msg_get_pts(msg, 1)));
+  tt_int_op(4, ==, ar_point_get_x(ar_msg_get_corners(msg, 1)));
+  tt_int_op(2, ==, ar_msg_getlen_u_more(msg));
+  tt_int_op(6, ==, ar_point_get_x(ar_msg_get_u_more(msg, 1)));
+  tt_int_op(3, ==, ar_msg_getlen_rest(msg));
+  tt_int_op(0x1213, ==, ar_point_get_y(ar_msg_get_rest(msg, 2)));
+  tt_ptr_op(ar_msg_check(msg), ==, NULL);
+
+  /* It encodes the same as a message parsed the usual way. */
+  tt_int_op(AR_MSG_LEN, ==, ar_msg_encode(buf, sizeof(buf), msg));
+  tt_mem_op(buf, ==, ux(AR_MSG_HEX), AR_MSG_LEN);
+  tt_int_op(AR_MSG_LEN, ==,
+            ar_msg_parse(&heap_msg, ux(AR_MSG_HEX), AR_MSG_LEN));
+  tt_int_op(AR_MSG_LEN, ==, ar_msg_encode(buf, sizeof(buf), heap_msg));
+  tt_mem_op(buf, ==, ux(AR_MSG_HEX), AR_MSG_LEN);
+
+  /* A nul-terminated string in a union. */
+  tt_int_op(18, ==, ar_msg_parse_arena(&msg, ux("00" "686900" "010000"
+                                                "010000" "02" "03" "6F6B00"
+                                                "090A0B"),
+                                       18, arena));
+  tt_str_op(ar_msg_get_u_greeting(msg), ==, "ok");
+  tt_int_op(1, ==, ar_msg_getlen_rest(msg));
+
+ end:
+  ar_msg_free(heap_msg);
+  trunnel_arena_destroy(arena);
+}
+
+static void
+test_arena_reuse(void *arg)
+{
+  trunnel_arena_t *arena = NULL;
+  ar_msg_t *msg = NULL;
+  uint8_t inp[1024];
+  uint8_t buf[1024];
+  size_t len;
+  int i, round;
+  (void)arg;
+
+  /* Lots of points at the end, and a long name, so that we need arrays
+   * and strings bigger than a chunk. */
+  memcpy(inp, ux("00"), 1);
+  memset(inp + 1, 'a', 99);
+  inp[100] = 0;
+  memcpy(inp + 101, ux("010000" "010000" "00" "00"), 8);
+  len = 109;
+  for (i = 0; i < 100; ++i) {
+    inp[len++] = 1 + i;
+    inp[len++] = 0;
+    inp[len++] = i;
+  }
+
+  arena = trunnel_arena_new(64);
+  tt_assert(arena);
+  for (round = 0; round < 3; ++round) {
+    tt_int_op(len, ==, ar_msg_parse_arena(&msg, inp, len, arena));
+    tt_int_op(99, ==, strlen(ar_msg_get_name(msg)));
+    tt_int_op(100, ==, ar_msg_getlen_rest(msg));
+    tt_int_op(50, ==, ar_point_get_x(ar_msg_get_rest(msg, 49)));
+    tt_int_op(len, ==, ar_msg_encode(buf, sizeof(buf), msg));
+    tt_mem_op(buf, ==, inp, len);
+    trunnel_arena_reset(arena);
+  }
+
+  trunnel_arena_destroy(NULL);
+
+ end:
+  trunnel_arena_destroy(arena);
+}
+
+static void
+test_arena_contexts(void *arg)
+{
+  trunnel_arena_t *arena = NULL;
+  ar_flagged_t *flagged = NULL;
+  ar_ctx_t ctx;
+  (void)arg;
+
+  arena = trunnel_arena_new(0);
+  tt_assert(arena);
+
+  ctx.flag = 0;
+  tt_int_op(0, ==, ar_flagged_parse_arena(&flagged, ux("05"), 1, arena,
+                                          &ctx));
+  tt_ptr_op(ar_flagged_get_u_pt(flagged), ==, NULL);
+  ctx.flag = 1;
+  tt_int_op(3, ==, ar_flagged_parse_arena(&flagged, ux("050001"), 3, arena,
+                                          &ctx));
+  tt_int_op(5, ==, ar_point_get_x(ar_flagged_get_u_pt(flagged)));
+  tt_int_op(-1, ==, ar_flagged_parse_arena(&flagged, ux("650001"), 3, arena,
+                                           &ctx));
+  tt_int_op(3, ==, ar_flagged_validate(ux("050001"), 3, &ctx));
+  tt_int_op(-1, ==, ar_flagged_validate(ux("650001"), 3, &ctx));
+  tt_int_op(-2, ==, ar_flagged_validate(ux("0500"), 2, &ctx));
+  ctx.flag = 2;
+  tt_int_op(-1, ==, ar_flagged_parse_arena(&flagged, ux("050001"), 3, arena,
+                                           &ctx));
+  tt_int_op(-1, ==, ar_flagged_validate(ux("050001"), 3, &ctx));
+
+ end:
+  trunnel_arena_destroy(arena);
+}
+
+static void
+test_arena_allocfail(void *arg)
+{
+#ifdef ALLOCFAIL
+  trunnel_arena_t *arena = NULL;
+  ar_msg_t *msg = NULL;
+  (void)arg;
+
+  set_alloc_fail(1);
+  tt_ptr_op(NULL, ==, trunnel_arena_new(0));
+
+  arena = trunnel_arena_new(16);
+  tt_assert(arena);
+  set_alloc_fail(1);
+  tt_int_op(-1, ==,
+            ar_msg_parse_arena(&msg, ux(AR_MSG_HEX), AR_MSG_LEN, arena));
+  tt_ptr_op(msg, ==, NULL);
+  set_alloc_fail(5);
+  tt_int_op(-1, ==,
+            ar_msg_parse_arena(&msg, ux(AR_MSG_HEX), AR_MSG_LEN, arena));
+  tt_ptr_op(msg, ==, NULL);
+  set_alloc_fail(0);
+
+  trunnel_arena_reset(arena);
+  tt_int_op(AR_MSG_LEN, ==,
+            ar_msg_parse_arena(&msg, ux(AR_MSG_HEX), AR_MSG_LEN, arena));
+
+ end:
+  trunnel_arena_destroy(arena);
+#else
+  (void)arg;
+  tt_skip();
+#endif
+}
+
+struct testcase_t arena_tests[] = {
+  { "parse", test_arena_parse, 0, NULL, NULL },
+  { "reuse", test_arena_reuse, 0, NULL, NULL },
+  { "contexts", test_arena_contexts, 0, NULL, NULL },
+  { "allocfail", test_arena_allocfail, 0, NULL, NULL },
+  END_OF_TESTCASES
+};
@@ -146,6 +146,42 @@ test_rst_accessors(void *arg)
   restricted_free(rst2);
 }
 
+static void
+test_rst_fixed_size(void *arg)
+{
+  uint8_t buf[12];
+  restricted_t *rst = NULL;
+  (void)arg;
+
+  tt_int_op(12, ==, RESTRICTED_ENCODED_LEN);
+  rst = restricted_new();
+  tt_int_op(RESTRICTED_ENCODED_LEN, ==, restricted_encoded_len(rst));
+  rst->i2 = 100;
+  tt_int_op(-1, ==, restricted_encoded_len(rst));
+  restricted_free(rst);
+  rst = NULL;
+
+  /* When the input is short, we still say it's invalid if the part we
+   * have is invalid. */
+  tt_int_op(-1, ==, restricted_parse(&rst, ux("00000001""00000101"), 8));
+  tt_ptr_op(NULL, ==, rst);
+  tt_int_op(-2, ==, restricted_parse(&rst, ux("00000001""00000001"), 8));
+  tt_ptr_op(NULL, ==, rst);
+  tt_int_op(-1, ==, restricted_parse(&rst, ux("00000101""0000"), 6));
+  tt_ptr_op(NULL, ==, rst);
+
+  /* An invalid object is invalid even if there's no room for it. */
+  rst = restricted_new();
+  rst->i3 = 100;
+  tt_int_op(-1, ==, restricted_encode(buf, 4, rst));
+  rst->i3 = 3;
+  tt_int_op(-2, ==, restricted_encode(buf, 11, rst));
+  tt_int_op(12, ==, restricted_encode(buf, 12, rst));
+
+ end:
+  restricted_free(rst);
+}
+
 static void
 test_rst_allocfail(void *arg)
 {
@@ -170,6 +206,7 @@ struct testcase_t restricted_tests[] = {
   { "invalid", test_rst_invalid, 0, NULL, NULL },
   { "encode-decode", test_rst_encdec, 0, NULL, NULL },
   { "accessors", test_rst_accessors, 0, NULL, NULL },
+  { "fixed-size", test_rst_fixed_size, 0, NULL, NULL },
   { "allocfail", test_rst_allocfail, 0, NULL, NULL },
   END_OF_TESTCASES
 };
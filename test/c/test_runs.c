@@ -0,0 +1,159 @@
+#include "test.h"
+#include "valid/runs.h"
+
+/* a, b, c, d, name, n, words, tag=1, x, y, z, tail1, tail2 */
+#define RUNS_HEX "01" "0005" "01020304" "0A0B0C" "61626300" "02" \
+  "00010002" "01" "1111" "0005" "07" "2222" "33334444"
+#define RUNS_LEN 31
+
+static void
+test_runs_parse(void *arg)
+{
+  runs_t *runs = NULL;
+  uint8_t inp[RUNS_LEN];
+  unsigned i;
+  (void)arg;
+
+  memcpy(inp, ux(RUNS_HEX), RUNS_LEN);
+  tt_int_op(RUNS_LEN, ==, runs_parse(&runs, inp, RUNS_LEN));
+  tt_int_op(1, ==, runs_get_a(runs));
+  tt_int_op(5, ==, runs_get_b(runs));
+  tt_int_op(0x01020304, ==, runs_get_c(runs));
+  tt_int_op(0x0c, ==, runs_get_d(runs, 2));
+  tt_str_op("abc", ==, runs_getconstarray_name(runs));
+  tt_int_op(2, ==, runs_getlen_words(runs));
+  tt_int_op(2, ==, runs_get_words(runs, 1));
+  tt_int_op(0x1111, ==, runs_get_u_x(runs));
+  tt_int_op(5, ==, runs_get_u_y(runs));
+  tt_int_op(7, ==, runs_get_u_z(runs));
+  tt_int_op(0x2222, ==, runs_get_tail1(runs));
+  tt_int_op(0x3333, ==, runs_get_tail2(runs, 0));
+  tt_int_op(0x4444, ==, runs_get_tail2(runs, 1));
+  runs_free(runs);
+  runs = NULL;
+
+  /* Every prefix is truncated. */
+  for (i = 0; i < RUNS_LEN; ++i) {
+    tt_int_op(-2, ==, runs_parse(&runs, inp, i));
+    tt_int_op(-2, ==, runs_validate(inp, i));
+  }
+
+  /* But if we can see a bad value before the input runs out, we say so,
+   * even if it's in the middle of a run. */
+  inp[2] = 11;
+  tt_int_op(-2, ==, runs_parse(&runs, inp, 2));
+  tt_int_op(-1, ==, runs_parse(&runs, inp, 3));
+  tt_int_op(-1, ==, runs_validate(inp, 3));
+  inp[2] = 5;
+  inp[23] = 6;
+  tt_int_op(-2, ==, runs_parse(&runs, inp, 23));
+  tt_int_op(-1, ==, runs_parse(&runs, inp, 24));
+  tt_int_op(-1, ==, runs_validate(inp, 24));
+  inp[23] = 5;
+  inp[19] = 3;
+  tt_int_op(-1, ==, runs_parse(&runs, inp, 20));
+
+ end:
+  runs_free(runs);
+}
+
+static void
+test_runs_other_arm(void *arg)
+{
+  runs_t *runs = NULL;
+  uint8_t buf[34];
+  const char *hex = "01" "0005" "01020304" "0A0B0C" "61626300" "00" "02"
+    "0102030405060708090A0B0C" "2222" "33334444";
+  unsigned i;
+  (void)arg;
+
+  tt_int_op(-2, ==, runs_parse(&runs, ux(hex), 21));
+  tt_int_op(-2, ==, runs_parse(&runs, ux(hex), 29));
+  tt_int_op(34, ==, runs_parse(&runs, ux(hex), 34));
+  tt_int_op(0x01020304, ==, runs_get_u_big(runs));
+  tt_assert(runs_get_u_bigger(runs) == 0x05060708090A0B0CULL);
+  for (i = 0; i < 34; ++i)
+    tt_int_op(-2, ==, runs_encode(buf, i, runs));
+  tt_int_op(34, ==, runs_encode(buf, sizeof(buf), runs));
+  tt_mem_op(buf, ==, ux(hex), 34);
+
+ end:
+  runs_free(runs);
+}
+
+static void
+test_runs_encode(void *arg)
+{
+  runs_t *runs = NULL;
+  uint8_t buf[RUNS_LEN];
+  unsigned i;
+  (void)arg;
+
+  tt_int_op(RUNS_LEN, ==, runs_parse(&runs, ux(RUNS_HEX), RUNS_LEN));
+  for (i = 0; i < RUNS_LEN; ++i)
+    tt_int_op(-2, ==, runs_encode(buf, i, runs));
+  tt_int_op(RUNS_LEN, ==, runs_encode(buf, RUNS_LEN, runs));
+  tt_mem_op(buf, ==, ux(RUNS_HEX), RUNS_LEN);
+
+  /* A bad object is bad, however little room we give it. */
+  tt_int_op(0, ==, runs_set_u_y(runs, 5));
+  runs->u_y = 6;
+  tt_int_op(-1, ==, runs_encode(buf, 3, runs));
+  tt_int_op(-1, ==, runs_encode(buf, RUNS_LEN, runs));
+
+ end:
+  runs_free(runs);
+}
+
+/* first, p1, p2, mid, chk, last */
+#define NESTED_HEX "01" "020003" "040005" "0006" "0307" "08"
+#define NESTED_LEN 12
+
+static void
+test_runs_nested(void *arg)
+{
+  nested_runs_t *nested = NULL;
+  uint8_t inp[NESTED_LEN];
+  uint8_t buf[NESTED_LEN];
+  unsigned i;
+  (void)arg;
+
+  memcpy(inp, ux(NESTED_HEX), NESTED_LEN);
+  tt_int_op(NESTED_LEN, ==, nested_runs_parse(&nested, inp, NESTED_LEN));
+  tt_int_op(1, ==, nested_runs_get_first(nested));
+  tt_int_op(2, ==, run_point_get_x(nested_runs_get_p1(nested)));
+  tt_int_op(5, ==, run_point_get_y(nested_runs_get_p2(nested)));
+  tt_int_op(6, ==, nested_runs_get_mid(nested));
+  tt_int_op(7, ==, run_checked_get_w(nested_runs_get_chk(nested)));
+  tt_int_op(8, ==, nested_runs_get_last(nested));
+
+  for (i = 0; i < NESTED_LEN; ++i)
+    tt_int_op(-2, ==, nested_runs_encode(buf, i, nested));
+  tt_int_op(NESTED_LEN, ==, nested_runs_encode(buf, NESTED_LEN, nested));
+  tt_mem_op(buf, ==, inp, NESTED_LEN);
+  nested_runs_free(nested);
+  nested = NULL;
+
+  for (i = 0; i < NESTED_LEN; ++i) {
+    tt_int_op(-2, ==, nested_runs_parse(&nested, inp, i));
+    tt_int_op(-2, ==, nested_runs_validate(inp, i));
+  }
+
+  /* The structure that can be invalid isn't part of the run, so we
+   * notice its bad value before the input runs out. */
+  inp[9] = 9;
+  tt_int_op(-2, ==, nested_runs_parse(&nested, inp, 9));
+  tt_int_op(-1, ==, nested_runs_parse(&nested, inp, 10));
+  tt_int_op(-1, ==, nested_runs_validate(inp, 10));
+
+ end:
+  nested_runs_free(nested);
+}
+
+struct testcase_t runs_tests[] = {
+  { "parse", test_runs_parse, 0, NULL, NULL },
+  { "other-arm", test_runs_other_arm, 0, NULL, NULL },
+  { "encode", test_runs_encode, 0, NULL, NULL },
+  { "nested", test_runs_nested, 0, NULL, NULL },
+  END_OF_TESTCASES
+};
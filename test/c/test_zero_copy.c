@@ -0,0 +1,181 @@
+#include "test.h"
+#include "valid/zero_copy.h"
+
+/* n=2, body, name, label, words, tag=1, ulen=3, payload, rest */
+#define ZC_MSG_HEX "02" "AABB" "686900" "7879" "00010002" "01" "03" \
+  "010203" "FFFE"
+#define ZC_MSG_LEN 19
+
+static void
+test_zc_parse(void *arg)
+{
+  uint8_t inp[ZC_MSG_LEN];
+  uint8_t orig[ZC_MSG_LEN];
+  uint8_t buf[64];
+  zc_msg_t *msg = NULL;
+  (void)arg;
+
+  memcpy(inp, ux(ZC_MSG_HEX), ZC_MSG_LEN);
+  memcpy(orig, inp, ZC_MSG_LEN);
+
+  /* Truncated. */
+  tt_int_op(-2, ==, zc_msg_parse(&msg, inp, 2));
+  tt_int_op(-2, ==, zc_msg_parse(&msg, inp, 4));
+
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_parse(&msg, inp, ZC_MSG_LEN));
+
+  /* Byte arrays and strings point into the input... */
+  tt_int_op(2, ==, zc_msg_getlen_body(msg));
+  tt_ptr_op(zc_msg_getconstarray_body(msg), ==, inp + 1);
+  tt_ptr_op(zc_msg_get_name(msg), ==, (const char *)inp + 3);
+  tt_str_op(zc_msg_get_name(msg), ==, "hi");
+  tt_int_op(3, ==, zc_msg_getlen_u_payload(msg));
+  tt_ptr_op(zc_msg_getconstarray_u_payload(msg), ==, inp + 14);
+  tt_int_op(2, ==, zc_msg_getlen_rest(msg));
+  tt_ptr_op(zc_msg_getconstarray_rest(msg), ==, inp + 17);
+  tt_int_op(0xfe, ==, zc_msg_get_rest(msg, 1));
+
+  /* ...but char arrays and other arrays don't. */
+  tt_str_op(zc_msg_getstr_label(msg), ==, "xy");
+  tt_ptr_op(zc_msg_getstr_label(msg), !=, (const char *)inp + 6);
+  tt_int_op(2, ==, zc_msg_get_words(msg, 1));
+
+  /* Encoding works as usual. */
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_encoded_len(msg));
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_encode(buf, sizeof(buf), msg));
+  tt_mem_op(buf, ==, inp, ZC_MSG_LEN);
+
+  /* Freeing the message doesn't touch the input. */
+  zc_msg_free(msg);
+  msg = NULL;
+  tt_mem_op(inp, ==, orig, ZC_MSG_LEN);
+
+ end:
+  zc_msg_free(msg);
+}
+
+static void
+test_zc_modify(void *arg)
+{
+  uint8_t inp[ZC_MSG_LEN];
+  uint8_t orig[ZC_MSG_LEN];
+  uint8_t buf[64];
+  zc_msg_t *msg = NULL;
+  uint8_t *arr;
+  (void)arg;
+
+  memcpy(inp, ux(ZC_MSG_HEX), ZC_MSG_LEN);
+  memcpy(orig, inp, ZC_MSG_LEN);
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_parse(&msg, inp, ZC_MSG_LEN));
+
+  /* Changing a borrowed array makes a copy first. */
+  tt_int_op(0, ==, zc_msg_set_body(msg, 0, 0x11));
+  tt_ptr_op(zc_msg_getconstarray_body(msg), !=, inp + 1);
+  tt_int_op(0x11, ==, zc_msg_get_body(msg, 0));
+  tt_int_op(0xbb, ==, zc_msg_get_body(msg, 1));
+
+  arr = zc_msg_getarray_u_payload(msg);
+  tt_ptr_op(arr, !=, NULL);
+  tt_ptr_op(arr, !=, inp + 14);
+  arr[2] = 0x33;
+
+  tt_int_op(0, ==, zc_msg_add_rest(msg, 0x44));
+  tt_int_op(3, ==, zc_msg_getlen_rest(msg));
+  tt_int_op(0, ==, zc_msg_setlen_rest(msg, 1));
+  tt_int_op(0xff, ==, zc_msg_get_rest(msg, 0));
+
+  tt_int_op(0, ==, zc_msg_set_name(msg, "yo"));
+  tt_ptr_op(zc_msg_get_name(msg), !=, (const char *)inp + 3);
+
+  /* None of that changed the input. */
+  tt_mem_op(inp, ==, orig, ZC_MSG_LEN);
+
+  tt_int_op(ZC_MSG_LEN - 1, ==, zc_msg_encode(buf, sizeof(buf), msg));
+  tt_mem_op(buf, ==, ux("02" "11BB" "796F00" "7879" "00010002" "01" "03"
+                        "010233" "FF"), ZC_MSG_LEN - 1);
+
+  /* A borrowed string in a union. */
+  zc_msg_free(msg);
+  inp[12] = 2;
+  memcpy(inp + 14, "ok", 3);
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_parse(&msg, inp, ZC_MSG_LEN));
+  tt_ptr_op(zc_msg_get_u_greeting(msg), ==, (const char *)inp + 14);
+  tt_int_op(0, ==, zc_msg_set_u_greeting(msg, "hey"));
+  tt_str_op(zc_msg_get_u_greeting(msg), ==, "hey");
+  tt_str_op((const char *)inp + 14, ==, "ok");
+
+ end:
+  zc_msg_free(msg);
+}
+
+static void
+test_zc_nested(void *arg)
+{
+  uint8_t inp[11];
+  uint8_t buf[16];
+  zc_list_t *lst = NULL;
+  zc_item_t *item;
+  (void)arg;
+
+  memcpy(inp, ux("02" "03414243" "7800" "00" "7A7900"), sizeof(inp));
+  tt_int_op(-2, ==, zc_list_parse(&lst, inp, 10));
+  tt_int_op(11, ==, zc_list_parse(&lst, inp, 11));
+  tt_int_op(2, ==, zc_list_getlen_items(lst));
+  item = zc_list_get_items(lst, 0);
+  tt_ptr_op(zc_item_getconstarray_data(item), ==, inp + 2);
+  tt_ptr_op(zc_item_get_s(item), ==, (const char *)inp + 5);
+  item = zc_list_get_items(lst, 1);
+  tt_int_op(0, ==, zc_item_getlen_data(item));
+  tt_ptr_op(zc_item_getconstarray_data(item), ==, NULL);
+  tt_str_op(zc_item_get_s(item), ==, "zy");
+  tt_int_op(11, ==, zc_list_encode(buf, sizeof(buf), lst));
+  tt_mem_op(buf, ==, inp, 11);
+
+ end:
+  zc_list_free(lst);
+}
+
+static void
+test_zc_allocfail(void *arg)
+{
+#ifdef ALLOCFAIL
+  uint8_t inp[ZC_MSG_LEN];
+  uint8_t buf[64];
+  zc_msg_t *msg = NULL;
+  (void)arg;
+
+  memcpy(inp, ux(ZC_MSG_HEX), ZC_MSG_LEN);
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_parse(&msg, inp, ZC_MSG_LEN));
+
+  set_alloc_fail(1);
+  tt_int_op(-1, ==, zc_msg_set_body(msg, 0, 0x11));
+  tt_ptr_op(zc_msg_getconstarray_body(msg), ==, inp + 1);
+  tt_int_op(-1, ==, zc_msg_encode(buf, sizeof(buf), msg));
+  zc_msg_clear_errors(msg);
+
+  set_alloc_fail(1);
+  tt_ptr_op(NULL, ==, zc_msg_getarray_rest(msg));
+  zc_msg_clear_errors(msg);
+
+  set_alloc_fail(1);
+  tt_int_op(-1, ==, zc_msg_setlen_u_payload(msg, 10));
+  zc_msg_clear_errors(msg);
+
+  tt_int_op(0, ==, zc_msg_set_body(msg, 0, 0x11));
+  tt_int_op(ZC_MSG_LEN, ==, zc_msg_encode(buf, sizeof(buf), msg));
+
+ end:
+  zc_msg_free(msg);
+#else
+  (void)arg;
+  tt_skip();
+#endif
+}
+
+struct testcase_t zero_copy_tests[] = {
+  { "parse", test_zc_parse, 0, NULL, NULL },
+  { "modify", test_zc_modify, 0, NULL, NULL },
+  { "nested", test_zc_nested, 0, NULL, NULL },
+  { "allocfail", test_zc_allocfail, 0, NULL, NULL },
+  END_OF_TESTCASES
+};
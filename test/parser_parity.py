@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#
+# parser_parity.py -- check that trunnel's parser engines agree.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: parser_parity.py FILE...
+
+   Parse every FILE with each engine in trunnel.Grammar.PARSER_ENGINES,
+   and make sure that they all build the same AST, or all fail with the
+   same error.  Exits with status 1 if any of them disagree.
+"""
+
+import sys
+
+import trunnel.Grammar
+
+
+def dump(obj):
+    """Return a representation of an AST or token that we can compare with
+       ==, and print when it doesn't match."""
+    if isinstance(obj, (list, tuple)):
+        return [dump(item) for item in obj]
+    elif isinstance(obj, dict):
+        return [(k, dump(obj[k])) for k in sorted(obj)]
+    elif isinstance(obj, (trunnel.Grammar.AST, trunnel.Grammar.Token)):
+        names = set(getattr(obj, "__dict__", ()))
+        for cls in type(obj).__mro__:
+            names.update(getattr(cls, "__slots__", ()))
+        fields = [(n, dump(getattr(obj, n))) for n in sorted(names)
+                  if hasattr(obj, n)]
+        return (type(obj).__name__, fields)
+    else:
+        return obj
+
+
+def parse(engine, text):
+    try:
+        tokens = trunnel.Grammar.Lexer().tokenize(text)
+        return ("ok", dump(trunnel.Grammar.getParser(engine).parse(tokens)))
+    except Exception as e:
+        return ("error", type(e).__name__, str(e))
+
+
+def check(fname):
+    with open(fname, 'r') as f:
+        text = f.read()
+    engines = trunnel.Grammar.PARSER_ENGINES
+    expected = parse(engines[0], text)
+    ok = True
+    for engine in engines[1:]:
+        got = parse(engine, text)
+        if got != expected:
+            sys.stderr.write("%s: %s and %s disagree:\n  %r\n  %r\n" % (
+                fname, engines[0], engine, expected, got))
+            ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    results = [check(fname) for fname in sys.argv[1:]]
+    if not all(results):
+        sys.exit(1)
@@ -13,12 +13,24 @@ GRAMMAR=`dirname $0`/../lib/trunnel/Grammar.py
 CODEGEN=`dirname $0`/../lib/trunnel/CodeGen.py
 TRUNNEL=`dirname $0`/../lib/trunnel/__main__.py
 BOILERPLATE=`dirname $0`/../lib/trunnel/Boilerplate.py
+CACHE=`dirname $0`/../lib/trunnel/Cache.py
+MANIFEST=`dirname $0`/../lib/trunnel/Manifest.py
+DEPFILE=`dirname $0`/../lib/trunnel/Depfile.py
+CLIENT=`dirname $0`/../lib/trunnel/Client.py
+PROFILE=`dirname $0`/../lib/trunnel/Profile.py
+INTERFACE=`dirname $0`/../lib/trunnel/Interface.py
+WATCH=`dirname $0`/../lib/trunnel/Watch.py
 CC=gcc
 CFLAGS="-g -O2 -D_FORTIFY_SOURCE=2 -fstack-protector-all -Wstack-protector -fwrapv --param ssp-buffer-size=1 -fPIE -fasynchronous-unwind-tables -Wall -fno-strict-aliasing -Wno-deprecated-declarations -W -Wfloat-equal -Wundef -Wpointer-arith -Wstrict-prototypes -Wmissing-prototypes -Wwrite-strings -Wredundant-decls -Wchar-subscripts -Wcomment -Wformat=2 -Wwrite-strings -Wmissing-declarations -Wredundant-decls -Wnested-externs -Wbad-function-cast -Wswitch-enum -Werror -Winit-self -Wmissing-field-initializers -Wdeclaration-after-statement -Wold-style-definition -Waddress -Wmissing-noreturn -Wstrict-overflow=1 -I `dirname $0`/include/"
 X=" -Wshorten-64-to-32  -Qunused-arguments"
 
 PYTHON=python
 
+# Use a private, initially empty cache, so that we exercise both building
+# the parser tables and loading them.
+TRUNNEL_CACHE_DIR=`mktemp -d`
+export TRUNNEL_CACHE_DIR
+
 if $PYTHON -m coverage >/dev/null ; then
   COVERAGE="$PYTHON -m coverage"
   RUN0="$PYTHON -m coverage run"
@@ -48,13 +60,221 @@ for fn in `dirname $0`/valid/*.trunnel; do
   $CC $CFLAGS -c $CNAME || echo "FAILED: $CC $CFLAGS $fn"
 done
 
+# Compile everything at once, too.
+echo >>tests.log "==== batch"
+$RUN $TRUNNEL --batch `dirname $0`/valid/*.trunnel >>tests.log 2>&1 \
+    || echo "FAILED: batch"
+$RUN $TRUNNEL --batch `dirname $0`/failing/*.trunnel >>tests.log 2>&1 \
+    && echo "SHOULD HAVE FAILED: batch"
+
+# In parallel, we should get the same output, byte for byte.
+echo >>tests.log "==== parallel"
+PARALLEL_DIR=`mktemp -d`
+$RUN $TRUNNEL -j 3 --target-dir=$PARALLEL_DIR `dirname $0`/valid/*.trunnel \
+    2>>tests.log || echo "FAILED: parallel"
+for fn in `dirname $0`/valid/*.trunnel; do
+  for ext in c h; do
+    OUT=`echo $fn | sed -e "s/trunnel$/$ext/"`
+    cmp -s $OUT $PARALLEL_DIR/`basename $OUT` || echo "MISMATCH: -j 3 $OUT"
+  done
+done
+rm -rf "$PARALLEL_DIR"
+$RUN $TRUNNEL -j 3 `dirname $0`/failing/*.trunnel 2>>tests.log \
+    && echo "SHOULD HAVE FAILED: parallel"
+
+# --check-only should accept every valid file, reject every failing one,
+# and write nothing.
+echo >>tests.log "==== check-only"
+CHECK_DIR=`mktemp -d`
+$RUN $TRUNNEL --check-only -j 3 --target-dir=$CHECK_DIR \
+    `dirname $0`/valid/*.trunnel 2>>tests.log || echo "FAILED: check-only"
+for fn in `dirname $0`/failing/*.trunnel; do
+  $RUN $TRUNNEL --check-only $fn 2>>tests.log \
+      && echo "SHOULD HAVE FAILED: check-only $fn"
+done
+test -z "`ls -A $CHECK_DIR`" || echo "FAILED: check-only wrote files"
+rm -rf "$CHECK_DIR"
+
+# Incremental builds should match, and shouldn't touch unchanged files.
+echo >>tests.log "==== incremental"
+INCR_DIR=`mktemp -d`
+$RUN $TRUNNEL --incremental --target-dir=$INCR_DIR \
+    `dirname $0`/valid/*.trunnel 2>>tests.log || echo "FAILED: incremental"
+test -f $INCR_DIR/.trunnel-manifest || echo "FAILED: no manifest"
+touch -d '2000-01-01' $INCR_DIR/*.c $INCR_DIR/*.h
+$RUN $TRUNNEL --incremental --batch --target-dir=$INCR_DIR \
+    `dirname $0`/valid/*.trunnel >>tests.log 2>&1 \
+    || echo "FAILED: incremental rebuild"
+for fn in `dirname $0`/valid/*.trunnel; do
+  for ext in c h; do
+    OUT=`echo $fn | sed -e "s/trunnel$/$ext/"`
+    INCR_OUT=$INCR_DIR/`basename $OUT`
+    cmp -s $OUT $INCR_OUT || echo "MISMATCH: --incremental $OUT"
+    test -n "`find $INCR_OUT -newermt '2001-01-01'`" \
+        && echo "REWROTE: --incremental $OUT"
+  done
+done
+rm -rf "$INCR_DIR"
+
+# Changing a file should make us regenerate the files that import it,
+# even indirectly.  The depfile should list the imported files.
+echo >>tests.log "==== imports"
+IMP_DIR=`mktemp -d`
+cp `dirname $0`/valid/imports.trunnel `dirname $0`/valid/contexts.trunnel \
+    `dirname $0`/valid/derived.trunnel $IMP_DIR
+echo 'import "imports.trunnel"; struct outer { struct imported i; }' \
+    > $IMP_DIR/outer.trunnel
+$RUN $TRUNNEL --incremental --depfile=$IMP_DIR/out.d $IMP_DIR/outer.trunnel \
+    2>>tests.log || echo "FAILED: imports"
+for dep in imports.trunnel contexts.trunnel derived.trunnel; do
+  grep -q "$dep" $IMP_DIR/out.d || echo "MISSING FROM DEPFILE: $dep"
+done
+$RUN $TRUNNEL --incremental --batch $IMP_DIR/outer.trunnel 2>>tests.log \
+    | grep -q "1 up to date" || echo "FAILED: imports rebuilt unchanged file"
+echo "const SIX = 6;" >> $IMP_DIR/derived.trunnel
+$RUN $TRUNNEL --incremental --batch $IMP_DIR/outer.trunnel 2>>tests.log \
+    | grep -q "0 up to date" || echo "FAILED: imports didn't notice a change"
+touch -d '2000-01-01' $TRUNNEL_CACHE_DIR/interface-*
+$RUN $TRUNNEL $IMP_DIR/outer.trunnel 2>>tests.log \
+    || echo "FAILED: imports recompile"
+test -z "`find $TRUNNEL_CACHE_DIR -name 'interface-*' -newermt '2001-01-01'`" \
+    || echo "REWROTE: interface cache"
+rm -rf "$IMP_DIR"
+
+# The depfile should name the input and the generator as prerequisites.
+echo >>tests.log "==== depfile"
+DEP_DIR=`mktemp -d`
+$RUN $TRUNNEL --depfile=$DEP_DIR/out.d --target-dir=$DEP_DIR \
+    `dirname $0`/valid/simple.trunnel 2>>tests.log || echo "FAILED: depfile"
+for dep in "$DEP_DIR/simple.c $DEP_DIR/simple.h:" valid/simple.trunnel \
+    trunnel/CodeGen.py trunnel/data/trunnel.h; do
+  grep -q "$dep" $DEP_DIR/out.d || echo "MISSING FROM DEPFILE: $dep"
+done
+rm -rf "$DEP_DIR"
+
+# A compile server should give the same output too.  The client should
+# still work once the server is gone.
+echo >>tests.log "==== server"
+SERVE_DIR=`mktemp -d`
+$PYTHON $TRUNNEL --serve=$SERVE_DIR/sock -j 2 2>>tests.log &
+SERVER_PID=$!
+for i in 1 2 3 4 5 6 7 8 9 10; do
+  test -S $SERVE_DIR/sock && break
+  sleep 1
+done
+$RUN $CLIENT --socket=$SERVE_DIR/sock --target-dir=$SERVE_DIR \
+    `dirname $0`/valid/*.trunnel 2>>tests.log || echo "FAILED: client"
+$RUN $CLIENT --socket=$SERVE_DIR/sock `dirname $0`/failing/*.trunnel \
+    2>>tests.log && echo "SHOULD HAVE FAILED: client"
+kill $SERVER_PID
+wait $SERVER_PID
+test -S $SERVE_DIR/sock && echo "FAILED: server left its socket behind"
+for fn in `dirname $0`/valid/*.trunnel; do
+  for ext in c h; do
+    OUT=`echo $fn | sed -e "s/trunnel$/$ext/"`
+    cmp -s $OUT $SERVE_DIR/`basename $OUT` || echo "MISMATCH: --serve $OUT"
+  done
+done
+rm -f $SERVE_DIR/*.[ch]
+$RUN $CLIENT --socket=$SERVE_DIR/sock --target-dir=$SERVE_DIR \
+    `dirname $0`/valid/simple.trunnel 2>>tests.log \
+    || echo "FAILED: client without server"
+test -f $SERVE_DIR/simple.c || echo "FAILED: client without server"
+rm -rf "$SERVE_DIR"
+$RUN `dirname $0`/server.py `dirname $0`/valid/simple.trunnel 2>>tests.log \
+    || echo "FAILED: server incremental"
+
+# Profiling shouldn't change the output.
+echo >>tests.log "==== profile"
+PROFILE_DIR=`mktemp -d`
+$RUN $TRUNNEL --profile --target-dir=$PROFILE_DIR \
+    `dirname $0`/valid/*.trunnel >>tests.log 2>&1 || echo "FAILED: profile"
+for fn in `dirname $0`/valid/*.trunnel; do
+  for ext in c h; do
+    OUT=`echo $fn | sed -e "s/trunnel$/$ext/"`
+    cmp -s $OUT $PROFILE_DIR/`basename $OUT` || echo "MISMATCH: --profile $OUT"
+  done
+done
+$RUN $TRUNNEL --profile-json=$PROFILE_DIR/profile.json \
+    --target-dir=$PROFILE_DIR `dirname $0`/valid/simple.trunnel 2>>tests.log \
+    || echo "FAILED: profile-json"
+$PYTHON -c 'import json,sys; s=json.load(open(sys.argv[1]))["files"][0]["structs"]; assert all(m["peak_bytes"] is not None for g in s.values() for m in g.values())' \
+    $PROFILE_DIR/profile.json 2>>tests.log || echo "FAILED: profile-json output"
+rm -rf "$PROFILE_DIR"
+
+# Generating each file's structures in parallel shouldn't change the
+# output either.
+echo >>tests.log "==== struct-jobs"
+SJ_DIR=`mktemp -d`
+for fn in `dirname $0`/valid/*.trunnel; do
+  $RUN $TRUNNEL --struct-jobs=3 --target-dir=$SJ_DIR $fn 2>>tests.log \
+      || echo "FAILED: --struct-jobs $fn"
+  for ext in c h; do
+    OUT=`echo $fn | sed -e "s/trunnel$/$ext/"`
+    cmp -s $OUT $SJ_DIR/`basename $OUT` || echo "MISMATCH: --struct-jobs $OUT"
+  done
+done
+rm -rf "$SJ_DIR"
+
+# Watch mode should regenerate changed files and the files that import
+# them, and nothing else.
+echo >>tests.log "==== watch"
+$RUN `dirname $0`/watcher.py `dirname $0`/valid 2>>tests.log \
+    || echo "FAILED: watch"
+WATCH_DIR=`mktemp -d`
+cp `dirname $0`/valid/simple.trunnel $WATCH_DIR
+$PYTHON $TRUNNEL --watch $WATCH_DIR >>tests.log 2>&1 &
+WATCH_PID=$!
+for i in 1 2 3 4 5 6 7 8 9 10; do
+  test -f $WATCH_DIR/simple.c && break
+  sleep 1
+done
+kill $WATCH_PID
+wait $WATCH_PID
+cmp -s `dirname $0`/valid/simple.c $WATCH_DIR/simple.c \
+    || echo "MISMATCH: --watch"
+rm -rf "$WATCH_DIR"
+
+# Validating should always give the same answer as parsing.
+echo >>tests.log "==== validate"
+CC=$CC $RUN `dirname $0`/validate_corpus.py `dirname $0`/include \
+    `dirname $0`/valid/simple.trunnel `dirname $0`/valid/leftover.trunnel \
+    `dirname $0`/valid/positions.trunnel `dirname $0`/valid/zero_copy.trunnel \
+    `dirname $0`/valid/arena.trunnel `dirname $0`/valid/runs.trunnel \
+    >>tests.log 2>&1 \
+    || echo "FAILED: validate"
+
+# The fused code generator is off by default, but it should still make
+# the same code.
+echo >>tests.log "==== fused"
+$RUN `dirname $0`/../bench/codegen_bench.py 1 >>tests.log 2>&1 \
+    || echo "FAILED: fused"
+
+echo >>tests.log "==== compile_string"
+$RUN `dirname $0`/string_api.py `dirname $0`/valid/*.trunnel 2>>tests.log \
+    || echo "FAILED: compile_string"
+
+echo >>tests.log "==== Parser parity"
+$RUN `dirname $0`/parser_parity.py `dirname $0`/valid/*.trunnel \
+    `dirname $0`/failing/*.trunnel `dirname $0`/../examples/*.trunnel \
+    2>>tests.log || echo "FAILED: parser parity"
+
 echo >>tests.log "==== MakeGrammar"
 $RUN $GRAMMAR > grammar.tmp 2>>tests.log || echo "FAILED: grammar"
 rm -f grammar.tmp
+rm -rf "$TRUNNEL_CACHE_DIR"
 
-$COVERAGE report $TRUNNEL $GRAMMAR $CODEGEN $BOILERPLATE
+$COVERAGE report $TRUNNEL $GRAMMAR $CODEGEN $BOILERPLATE $CACHE $MANIFEST \
+    $DEPFILE $CLIENT $PROFILE $INTERFACE $WATCH
 $COVERAGE annotate $TRUNNEL
 $COVERAGE annotate $GRAMMAR
 $COVERAGE annotate $CODEGEN
 $COVERAGE annotate $BOILERPLATE
+$COVERAGE annotate $CACHE
+$COVERAGE annotate $MANIFEST
+$COVERAGE annotate $DEPFILE
+$COVERAGE annotate $CLIENT
+$COVERAGE annotate $PROFILE
+$COVERAGE annotate $INTERFACE
+$COVERAGE annotate $WATCH
 
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+#
+# server.py -- check that a trunnel.Server doesn't redo incremental work.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: server.py TRUNNEL_FILE
+
+   Start a trunnel.Server.CompileServer, and ask it to compile TRUNNEL_FILE
+   into a temporary directory in incremental mode several times.  The
+   first request should generate the code, and the others should find it
+   up to date, whichever worker answers them.  Exits with status 1 if
+   they don't.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import trunnel.Client
+import trunnel.Server
+
+
+def phases(response):
+    """Return the list of phase names in the timings of 'response'."""
+    return [phase for phase, _ in response.get("timings") or []]
+
+
+def main(args):
+    directory = tempfile.mkdtemp()
+    errors = []
+    server = trunnel.Server.CompileServer(os.path.join(directory, "sock"),
+                                          jobs=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = trunnel.Client.Connection(server.server_address)
+        try:
+            request = trunnel.Client.makeRequest(args[0], (), directory,
+                                                 incremental=True)
+            first = conn.send(request)
+            if not first.get("ok") or "up-to-date" in phases(first):
+                errors.append("first request: %s" % first)
+            for i in range(4):
+                again = conn.send(request)
+                if phases(again) != ["up-to-date"]:
+                    errors.append("request %d: %s" % (i + 2, again))
+        finally:
+            conn.close()
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        shutil.rmtree(directory)
+
+    for error in errors:
+        sys.stderr.write("%s\n" % error)
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+#
+# string_api.py -- check trunnel.compile_string against generated files.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: string_api.py FILE...
+
+   For every FILE, call trunnel.compile_string on its contents, and make
+   sure that the result matches the .h and .c files that trunnel already
+   generated next to it.  Exits with status 1 if any of them differ.
+"""
+
+import os
+import sys
+
+import trunnel
+
+
+def main(args):
+    ok = True
+    for fname in args:
+        with open(fname) as f:
+            source = f.read()
+        basename = fname
+        if basename.endswith(".trunnel"):
+            basename = basename[:-len(".trunnel")]
+        directory, name = os.path.split(basename)
+        h_text, c_text = trunnel.compile_string(
+            source, basename=name, import_dir=directory)
+        for ext, text in ((".h", h_text), (".c", c_text)):
+            with open(basename + ext) as f:
+                if f.read() != text:
+                    sys.stderr.write("MISMATCH: %s%s\n" % (basename, ext))
+                    ok = False
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
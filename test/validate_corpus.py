@@ -0,0 +1,169 @@
+#!/usr/bin/python
+#
+# validate_corpus.py -- check that typename_validate() agrees with
+#   typename_parse().
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: validate_corpus.py INCLUDE_DIR FILE...
+
+   Use trunnel.SeedFuzzer to make a corpus of examples for every structure
+   in the trunnel FILEs, and build a little C program that calls both
+   typename_parse() and typename_validate() on each example, on every
+   prefix of each example, and on copies of each example with one byte
+   changed.  The code generated from each FILE must already be next to it,
+   and INCLUDE_DIR must hold the trunnel support files.  Uses the C
+   compiler in $CC.  Exits with status 1 if the two functions ever
+   disagree.
+"""
+
+import binascii
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import trunnel.CodeGen
+import trunnel.Grammar
+import trunnel.SeedFuzzer
+
+DRIVER = """\
+#include <stdio.h>
+#include <string.h>
+%(includes)s
+
+typedef ssize_t (*check_fn_t)(const uint8_t *, size_t);
+
+%(wrappers)s
+static const struct {
+  const char *name;
+  check_fn_t parse;
+  check_fn_t validate;
+} checkers[] = {
+%(table)s  { NULL, NULL, NULL }
+};
+
+static int n_checked = 0, n_failed = 0;
+
+static void
+check(int idx, const uint8_t *inp, size_t len)
+{
+  ssize_t parsed = checkers[idx].parse(inp, len);
+  ssize_t validated = checkers[idx].validate(inp, len);
+  size_t i;
+  ++n_checked;
+  if (parsed == validated)
+    return;
+  ++n_failed;
+  printf("%%s: parse gave %%ld, validate gave %%ld, on ",
+         checkers[idx].name, (long)parsed, (long)validated);
+  for (i = 0; i < len; ++i)
+    printf("%%02x", inp[i]);
+  printf("\\n");
+}
+
+int
+main(void)
+{
+  static char line[65536];
+  static uint8_t inp[32768];
+  while (fgets(line, sizeof(line), stdin)) {
+    char *hex = strchr(line, ' ');
+    size_t len = 0, i;
+    unsigned byte;
+    int idx;
+    if (!hex)
+      continue;
+    *hex++ = 0;
+    for (idx = 0; checkers[idx].name; ++idx)
+      if (!strcmp(checkers[idx].name, line))
+        break;
+    if (!checkers[idx].name)
+      continue;
+    while (len < sizeof(inp) && sscanf(hex + 2 * len, "%%2x", &byte) == 1)
+      inp[len++] = byte;
+    for (i = 0; i <= len; ++i)
+      check(idx, inp, i);
+    for (i = 0; i < len; ++i) {
+      uint8_t old = inp[i];
+      inp[i] = 0;
+      check(idx, inp, len);
+      inp[i] = 0xff;
+      check(idx, inp, len);
+      inp[i] = old;
+    }
+  }
+  printf("%%d checks, %%d disagreements\\n", n_checked, n_failed);
+  return n_failed ? 1 : 0;
+}
+"""
+
+WRAPPER = """\
+static ssize_t
+parse_%(name)s(const uint8_t *inp, size_t len)
+{
+  %(name)s_t *obj = NULL;
+  ssize_t result = %(name)s_parse(&obj, inp, len);
+  %(name)s_free(obj);
+  return result;
+}
+"""
+
+
+def structNames(fname):
+    """Return a list of the names of the structures in the trunnel file
+       'fname' that we can parse without any contexts."""
+    with open(fname, 'r') as f:
+        parsed = trunnel.Grammar.getParser().parse(
+            trunnel.Grammar.Lexer().tokenize(f.read()))
+    return [sd.name for sd in parsed.declarations
+            if isinstance(sd, trunnel.Grammar.StructDecl) and
+            not sd.isContext() and not sd.contextList]
+
+
+def main(args):
+    include_dir, fnames = args[0], args[1:]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        corpus = os.path.join(tmpdir, "corpus")
+        trunnel.SeedFuzzer.generate_corpus(fnames, corpus)
+
+        names = []
+        for fname in fnames:
+            names.extend(structNames(fname))
+        with open(os.path.join(tmpdir, "cases"), 'w') as f:
+            for name in names:
+                exdir = os.path.join(corpus, name)
+                if not os.path.isdir(exdir):
+                    continue
+                for ex in sorted(os.listdir(exdir)):
+                    with open(os.path.join(exdir, ex), 'rb') as exf:
+                        data = binascii.hexlify(exf.read()).decode("ascii")
+                    f.write("%s %s\n" % (name, data))
+
+        driver = os.path.join(tmpdir, "driver.c")
+        with open(driver, 'w') as f:
+            f.write(DRIVER % {
+                "includes": "".join(
+                    '#include "%s"\n' % os.path.abspath(fn[:-len("trunnel")] + "h")
+                    for fn in fnames),
+                "wrappers": "".join(WRAPPER % {"name": n} for n in names),
+                "table": "".join('  { "%s", parse_%s, %s_validate },\n'
+                                 % (n, n, n) for n in names),
+            })
+        program = os.path.join(tmpdir, "driver")
+        subprocess.check_call(
+            [os.environ.get("CC", "cc"), "-g", "-I", include_dir, "-o",
+             program, driver, os.path.join(include_dir, "trunnel.c")] +
+            [fn[:-len("trunnel")] + "c" for fn in fnames])
+        with open(os.path.join(tmpdir, "cases"), 'rb') as f:
+            status = subprocess.call([program], stdin=f)
+    finally:
+        shutil.rmtree(tmpdir)
+    if status:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
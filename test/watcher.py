@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# watcher.py -- check that trunnel.Watch regenerates the right files.
+#
+# Copyright 2014 The Tor Project, Inc.
+# See LICENSE file for copying information.
+
+"""Usage: watcher.py VALID_DIR
+
+   Copy some of the trunnel files from VALID_DIR into a temporary
+   directory, and make sure that a trunnel.Watch.Watcher regenerates the
+   code for a file when it changes, and for the files that import it, but
+   not for anything else.  Exits with status 1 if it doesn't.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import trunnel.Watch
+
+FILES = ["simple.trunnel", "contexts.trunnel", "derived.trunnel",
+         "imports.trunnel"]
+
+
+def polled(watcher):
+    """Poll 'watcher', and return a sorted list of the basenames of the
+       files it regenerated successfully, and of the ones that failed."""
+    ok, failed = [], []
+    for fname, _, err in watcher.poll():
+        (ok if err is None else failed).append(os.path.basename(fname))
+    return sorted(ok), sorted(failed)
+
+
+def append(fname, text):
+    with open(fname, 'a') as f:
+        f.write(text)
+    # Make sure the change shows up even if the clock is coarse.
+    st = os.stat(fname)
+    os.utime(fname, (st.st_atime, st.st_mtime + 10))
+
+
+def main(args):
+    directory = tempfile.mkdtemp()
+    errors = []
+
+    def path(fname):
+        return os.path.join(directory, fname)
+
+    def expect(what, got, wanted):
+        if got != wanted:
+            errors.append("%s: got %s, wanted %s" % (what, got, wanted))
+
+    try:
+        for fname in FILES:
+            shutil.copy(os.path.join(args[0], fname), directory)
+        with open(os.path.join(directory, "outer.trunnel"), 'w') as f:
+            f.write('import "imports.trunnel";\n'
+                    'struct outer { struct imported i; }\n')
+        watcher = trunnel.Watch.Watcher(directory)
+
+        expect("first poll", polled(watcher),
+               (sorted(FILES + ["outer.trunnel"]), []))
+        for fname in FILES:
+            if not os.path.exists(path(fname[:-len("trunnel")] + "c")):
+                errors.append("no output for %s" % fname)
+        expect("nothing changed", polled(watcher), ([], []))
+
+        os.utime(path("simple.trunnel"), None)
+        expect("touched", polled(watcher), ([], []))
+
+        append(path("derived.trunnel"), "const SIX = 6;\n")
+        expect("changed import", polled(watcher),
+               (["derived.trunnel", "imports.trunnel", "outer.trunnel"], []))
+
+        append(path("simple.trunnel"), "struct broken {\n")
+        expect("broken file", polled(watcher), ([], ["simple.trunnel"]))
+
+        os.unlink(path("outer.trunnel"))
+        append(path("imports.trunnel"), "const SEVEN = 7;\n")
+        expect("removed file", polled(watcher), (["imports.trunnel"], []))
+
+        with open(path("broken.trunnel"), 'w') as f:
+            f.write("struct broken {\n  u8 x;\n")
+        with open(path("importer.trunnel"), 'w') as f:
+            f.write('import "broken.trunnel";\n'
+                    'struct importer { struct broken b; }\n')
+        expect("broken import", polled(watcher),
+               ([], ["broken.trunnel", "importer.trunnel"]))
+        append(path("broken.trunnel"), "}\n")
+        expect("fixed import", polled(watcher),
+               (["broken.trunnel", "importer.trunnel"], []))
+    finally:
+        shutil.rmtree(directory)
+
+    for error in errors:
+        sys.stderr.write("%s\n" % error)
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])